@@ -0,0 +1,198 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import settings
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# Set by the request middleware so every record logged while handling a request carries its id.
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Headers that must never reach the log, even at DEBUG.
+REDACTED_HEADERS = {"authorization", "cookie", "set-cookie", "x-api-key"}
+
+
+class LogWriter:
+    """
+    Background thread that owns the log file. Records are taken off a queue in batches
+    and written with one write() per batch; the file is rotated by size like
+    logging.handlers.RotatingFileHandler (path, path.1, ... path.<backup_count>).
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int, batch_size: int, flush_interval: float,
+                 queue_size: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._file = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, line: str):
+        """
+        Queue one line. Never blocks: if the writer has fallen behind, the line is dropped and counted.
+        """
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Flush everything queued so far and stop the writer thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            if first is None:
+                stopping = True
+            else:
+                batch.append(first)
+            while len(batch) < self.batch_size and not stopping:
+                try:
+                    line = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    stopping = True
+                else:
+                    batch.append(line)
+            if batch:
+                self._write("".join(batch), len(batch))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, data: str, count: int):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            if self.max_bytes and self._file.tell() + len(data) > self.max_bytes and self._file.tell() > 0:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self.written += count
+        except OSError:
+            self.dropped += count
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+
+class StructuredLogger:
+    """
+    JSON-lines logger. Each call builds one record ({"ts", "level", "msg", "request_id", ...fields})
+    and hands it to the LogWriter thread, so logging never opens a file or blocks the event loop.
+    Records below settings.LOG_LEVEL are discarded before any formatting work.
+    """
+
+    def __init__(self, writer: Optional[LogWriter], level: str = "INFO"):
+        self.writer = writer
+        self.level = LEVELS.get(level.upper(), LEVELS["INFO"])
+
+    def enabled(self, level: str) -> bool:
+        return self.writer is not None and LEVELS[level] >= self.level
+
+    def log(self, level: str, message: str, **fields: Any):
+        if not self.enabled(level):
+            return
+        record: Dict[str, Any] = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "level": level,
+            "msg": message,
+        }
+        request_id = request_id_var.get()
+        if request_id is not None:
+            record["request_id"] = request_id
+        record.update(fields)
+        self.writer.submit(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+
+    def debug(self, message: str, **fields: Any):
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message: str, **fields: Any):
+        self.log("INFO", message, **fields)
+
+    def warning(self, message: str, **fields: Any):
+        self.log("WARNING", message, **fields)
+
+    def error(self, message: str, **fields: Any):
+        self.log("ERROR", message, **fields)
+
+    def stats(self) -> Dict[str, Any]:
+        if self.writer is None:
+            return {"enabled": False}
+        return {
+            "level": next(name for name, value in LEVELS.items() if value == self.level),
+            "queued": self.writer.queue.qsize(),
+            "written": self.writer.written,
+            "dropped": self.writer.dropped,
+        }
+
+    def shutdown(self):
+        if self.writer is not None:
+            self.writer.stop()
+
+
+def redact_headers(headers) -> Dict[str, str]:
+    return {name: ("<redacted>" if name.lower() in REDACTED_HEADERS else value) for name, value in headers.items()}
+
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+log = StructuredLogger(
+    LogWriter(
+        settings.LOG_PATH,
+        max_bytes=settings.LOG_MAX_BYTES,
+        backup_count=settings.LOG_BACKUP_COUNT,
+        batch_size=settings.LOG_BATCH_SIZE,
+        flush_interval=settings.LOG_FLUSH_INTERVAL_SECONDS,
+        queue_size=settings.LOG_QUEUE_SIZE,
+    ) if settings.LOG_PATH else None,
+    level=settings.LOG_LEVEL,
+)
+atexit.register(log.shutdown)
@@ -0,0 +1,322 @@
+"""
+Load test for chat_api.app against the offline model backend (fake_model.py).
+
+    python benchmark.py
+    python benchmark.py --items 10,1000,10000 --turns 0,50,500 --concurrency 1,8,32 --save baseline.json
+    python benchmark.py --compare baseline.json
+
+Requests go through the ASGI app in-process (httpx.ASGITransport), so the numbers cover
+the whole server path (validation, sessions, prompts, analytics) but not the network.
+In-process responses are buffered, so for streaming first-delta times run a server
+(BUDGIT_MODEL_BACKEND=fake uvicorn chat_api:app) and pass --url http://127.0.0.1:8000;
+peak RSS is then not measured.
+Each case reports p50/p95/p99 latency, throughput, prompt bytes per model call and the
+process's peak RSS. --save writes the results as a baseline; --compare reports cases
+whose p95 or throughput got worse by more than --tolerance and exits with status 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+# Offline, quiet defaults; must be set before the app's modules read settings.
+os.environ.setdefault("BUDGIT_MODEL_BACKEND", "fake")
+os.environ.setdefault("BUDGIT_LOG_PATH", "none")
+os.environ.setdefault("BUDGIT_RECEIPT_CACHE_PATH", "none")
+os.environ.setdefault("BUDGIT_BUDGET_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="budgit-bench-"), "budgets.sqlite3"))
+
+import httpx
+import numpy as np
+
+import settings
+from chat_api import app
+
+SCENARIOS = ("chat", "session", "stream", "receipt")
+RECEIPT_IMAGE = "reciept_test_1.png"
+
+_NAMES = ["Rent", "Groceries", "Electricity", "Water", "Internet", "Phone", "Netflix", "Spotify", "Gym",
+          "Car payment", "Fuel", "Insurance", "Coffee", "Dining out", "Books", "Clothes", "Gifts", "Pet food",
+          "Daycare", "Student loan", "Parking", "Haircut", "Medication", "Charity", "Vacation fund"]
+_CATEGORIES = ["Housing", "Groceries", "Utilities", "Entertainment", "Health", "Transport", "Shopping",
+               "Education", "Savings", "Personal"]
+_SCHEDULES = [None, None, "Monthly", "Monthly", "Weekly", "Biweekly", "Yearly", "Quarterly", "0 0 1,15 * *"]
+_QUESTIONS = ["Where could I cut back this month?", "Is my spending on food reasonable?",
+              "How do my subscriptions compare to last month?", "What should I prioritise paying first?",
+              "Can I afford a holiday in the summer?", "Which of these expenses could I drop?"]
+
+
+def make_budget(items: int, turns: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    A budget of the given size, with conversation history, in the shape clients upload.
+    """
+    rng = random.Random(seed)
+    budget_items = [
+        {
+            "item_name": f"{rng.choice(_NAMES)} {index}" if index >= len(_NAMES) else _NAMES[index],
+            "amount": round(rng.lognormvariate(3.5, 1.0), 2),
+            "category": rng.choice(_CATEGORIES),
+            "importance_rank": rng.randint(1, 10),
+            "recurrence_schedule": rng.choice(_SCHEDULES),
+            "due_date": rng.choice([None, 1767225600 + rng.randint(0, 365) * 86400]),
+        }
+        for index in range(items)
+    ]
+    conversations = [
+        {
+            "user_message": rng.choice(_QUESTIONS),
+            "ai_response": "Looking at your budget, your largest costs are housing and transport. "
+                           "You could save by reviewing subscriptions and dining out less often. "
+                           "Is there anything else I can do for you?",
+        }
+        for _ in range(turns)
+    ]
+    total = sum(item["amount"] for item in budget_items)
+    return {"Budget": {"budget_limit": round(total * 1.1, 2), "items": budget_items,
+                       "conversations": conversations}}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class VirtualUser:
+    """
+    One client: uploads its budget on the first request, then (except in the "chat"
+    scenario, which uploads every time) continues with session_id and revision.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, scenario: str, budget: Dict[str, Any], number: int,
+                 budget_id: str):
+        self.client = client
+        self.scenario = scenario
+        self.budget = budget
+        self.number = number
+        # Sessions are per user and budget, and every virtual user is the same dev user.
+        self.budget_id = budget_id
+        self.session_id: Optional[str] = None
+        self.revision: Optional[int] = None
+        self.requests = 0
+
+    def _body(self) -> Dict[str, Any]:
+        # A number in the message keeps the reply out of the response cache.
+        message = f"Question {self.number}.{self.requests}: {_QUESTIONS[self.requests % len(_QUESTIONS)]}"
+        if self.session_id is None or self.scenario == "chat":
+            return {**json.loads(json.dumps(self.budget)), "budget_id": self.budget_id, "conversation": message}
+        return {"session_id": self.session_id, "revision": self.revision, "conversation": message}
+
+    def _remember(self, data: Dict[str, Any]):
+        self.session_id = data.get("session_id", self.session_id)
+        self.revision = data.get("revision", self.revision)
+
+    async def request(self) -> Dict[str, Any]:
+        """
+        Send one request; returns {"ok", "seconds", "first_seconds"?}.
+        """
+        body = self._body()
+        self.requests += 1
+        start = time.perf_counter()
+        if self.scenario == "stream":
+            first = None
+            done = None
+            async with self.client.stream("POST", "/chat/stream", json=body) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: ") and event == "delta" and first is None:
+                        first = time.perf_counter() - start
+                    elif line.startswith("data: ") and event == "done":
+                        done = json.loads(line[6:])
+            if done is not None:
+                self._remember(done)
+            return {"ok": done is not None, "seconds": time.perf_counter() - start, "first_seconds": first}
+        if self.scenario == "receipt":
+            with open(RECEIPT_IMAGE, "rb") as f:
+                image = f.read()
+            form = {"session_id": self.session_id} if self.session_id else {"current_state": json.dumps(self.budget),
+                                                                            "budget_id": self.budget_id}
+            if self.revision is not None:
+                form["revision"] = str(self.revision)
+            response = await self.client.post("/receipt", data=form, files={"receipt": (RECEIPT_IMAGE, image, "image/png")})
+        else:
+            response = await self.client.post("/chat", json=body)
+        if response.status_code == 200:
+            self._remember(response.json())
+        return {"ok": response.status_code == 200, "seconds": time.perf_counter() - start,
+                "status": response.status_code}
+
+
+async def prompt_totals(client: httpx.AsyncClient) -> Dict[str, Any]:
+    response = await client.get("/stats")
+    response.raise_for_status()
+    stats = response.json()
+    # Counters are per worker process; note which one answered.
+    return {**stats["prompts"], "pid": stats.get("pid")}
+
+
+async def run_case(scenario: str, items: int, turns: int, concurrency: int, requests: int,
+                   url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    requests requests from concurrency virtual users at once, all on budgets of one size.
+    """
+    budget = make_budget(items, turns)
+    transport = None if url else httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url=url or "http://bench", timeout=600) as client:
+        users = [VirtualUser(client, scenario, budget, number,
+                             f"bench-{scenario}-{items}-{turns}-{concurrency}-{number}-{time.time_ns()}")
+                 for number in range(concurrency)]
+        results: List[Dict[str, Any]] = []
+        remaining = [requests]
+
+        async def drive(user: VirtualUser):
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                results.append(await user.request())
+
+        prompts_before = await prompt_totals(client)
+        start = time.perf_counter()
+        await asyncio.gather(*(drive(user) for user in users))
+        wall = time.perf_counter() - start
+        prompts_after = await prompt_totals(client)
+
+    ok = [result for result in results if result["ok"]]
+    latencies = [result["seconds"] for result in ok]
+    first = [result["first_seconds"] for result in ok if result.get("first_seconds") is not None]
+    model_calls = prompts_after["prompts"] - prompts_before["prompts"]
+    case = {
+        "scenario": scenario,
+        "items": items,
+        "turns": turns,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+        # Unknown when the two /stats calls reached different workers of a multi-worker server.
+        "prompt_bytes_per_call": None if prompts_after["pid"] != prompts_before["pid"]
+        else round((prompts_after["bytes"] - prompts_before["bytes"]) / model_calls) if model_calls else 0,
+        "peak_rss_mb": None if url else peak_rss_mb(),
+    }
+    if first:
+        case["first_delta_p50_ms"] = percentile(first, 50)
+        case["first_delta_p95_ms"] = percentile(first, 95)
+    if scenario == "receipt" and len(ok) < len(results):
+        statuses = sorted({str(result.get("status")) for result in results if not result["ok"]})
+        case["note"] = f"failed with status {', '.join(statuses)} (is Tesseract installed?)"
+    return case
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    return f"{case['scenario']}/items={case['items']}/turns={case['turns']}/c={case['concurrency']}"
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Cases whose p95 latency rose, or throughput fell, by more than tolerance (a fraction).
+    """
+    previous = {case_key(case): case for case in baseline.get("results", [])}
+    regressions = []
+    for case in results:
+        old = previous.get(case_key(case))
+        if old is None or case["errors"] or not old.get("p95_ms"):
+            continue
+        if case["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{case_key(case)}: p95 {old['p95_ms']} -> {case['p95_ms']} ms")
+        if old.get("throughput_rps") and case["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{case_key(case)}: throughput {old['throughput_rps']} -> {case['throughput_rps']} req/s")
+    return regressions
+
+
+def _size(value, unit: str) -> str:
+    return "n/a" if value is None else f"{value}{unit}"
+
+
+def print_case(case: Dict[str, Any]):
+    first = f"  first {case['first_delta_p50_ms']}ms" if "first_delta_p50_ms" in case else ""
+    print(f"{case_key(case):<42} p50 {case['p50_ms']}ms  p95 {case['p95_ms']}ms  p99 {case['p99_ms']}ms  "
+          f"{case['throughput_rps']} req/s  prompt {_size(case['prompt_bytes_per_call'], 'B')}  rss {_size(case['peak_rss_mb'], 'MB')}  "
+          f"errors {case['errors']}{first}{'  ' + case['note'] if 'note' in case else ''}", flush=True)
+
+
+def _ints(text: str) -> List[int]:
+    return [int(part) for part in text.split(",") if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test chat_api.app with the offline model backend.")
+    parser.add_argument("--scenarios", default="chat,session,stream",
+                        help=f"comma separated, any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--items", default="10,1000,10000", help="budget sizes (items)")
+    parser.add_argument("--turns", default="0,500", help="conversation turns already in each budget")
+    parser.add_argument("--concurrency", default="1,8,32", help="virtual users sending at once")
+    parser.add_argument("--requests", type=int, default=32, help="requests per case")
+    parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="baseline file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed p95/throughput change before a case counts as a regression")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if not args.url:
+        print(f"model backend {settings.MODEL_BACKEND}: first token {settings.FAKE_MODEL_FIRST_TOKEN_MS}ms, "
+              f"{settings.FAKE_MODEL_TOKENS_PER_SECOND} tokens/s", flush=True)
+
+    async def run_all():
+        # One event loop for every case: the app's semaphores are bound to the loop they were first used on.
+        cases = []
+        for scenario in scenarios:
+            for items in _ints(args.items):
+                for turns in _ints(args.turns):
+                    for concurrency in _ints(args.concurrency):
+                        case = await run_case(scenario, items, turns, concurrency, args.requests, args.url)
+                        print_case(case)
+                        cases.append(case)
+        return cases
+
+    results = asyncio.run(run_all())
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": time.time(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "settings": {name: getattr(settings, name) for name in dir(settings)
+                             if name.startswith(("FAKE_MODEL_", "MODEL_", "HISTORY_", "RESPONSE_CACHE_"))},
+                "results": results,
+            }, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
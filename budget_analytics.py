@@ -0,0 +1,148 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_IMPORTANCE = 5
+# Suggested cuts shown when over budget.
+MAX_SUGGESTED_CUTS = 10
+
+
+def _number(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ItemColumns:
+    """
+    Budget items in columnar form: one NumPy array per field, with categories and
+    recurrence schedules stored as integer codes into small lookup lists. Building it reads
+    each field once per item; every aggregate after that is a vectorised pass.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.ids = [item.get("id") for item in items]
+        self.names = [item.get("item_name") for item in items]
+        self.amounts = self._numbers([item.get("amount") for item in items], 0.0)
+        self.importance = self._numbers([item.get("importance_rank") for item in items],
+                                        DEFAULT_IMPORTANCE).clip(1, 10).astype(np.int8)
+        self.categories, self.category_codes = self._encode([item.get("category") or "Uncategorised" for item in items])
+        self.schedules, self.schedule_codes = self._encode([item.get("recurrence_schedule") or "" for item in items])
+        # Occurrences per month, from the same schedule parser /projection uses
+        # (imported here because recurrence imports this module).
+        from recurrence import monthly_factor
+        factors = np.array([monthly_factor(schedule) for schedule in self.schedules], dtype=np.float64)
+        self.monthly_factors = factors[self.schedule_codes]
+
+    @staticmethod
+    def _numbers(values: List[Any], default: float) -> np.ndarray:
+        """
+        float64 array of values, with None and unparseable values replaced by default.
+        Converted in one NumPy call when every value is already a number.
+        """
+        try:
+            array = np.array(values, dtype=np.float64)
+            missing = np.isnan(array)
+            if missing.any():
+                array[missing] = default
+            return array
+        except (TypeError, ValueError):
+            return np.array([_number(value, default) for value in values], dtype=np.float64)
+
+    @staticmethod
+    def _encode(values: List[str]):
+        """
+        (unique values, integer code per value). A dict pass is faster than np.unique on
+        Python strings and keeps first-seen order.
+        """
+        lookup: Dict[str, int] = {}
+        codes = np.array([lookup.setdefault(value, len(lookup)) for value in values], dtype=np.int32)
+        return [str(value) for value in lookup], codes
+
+    def __len__(self):
+        return len(self.amounts)
+
+
+def suggested_cuts(columns: ItemColumns, deficit: float) -> List[Dict[str, Any]]:
+    """
+    Items to cut to close a deficit: lowest importance first, and within the same
+    importance the most expensive first, up to the item that covers the deficit.
+    """
+    if deficit <= 0 or not len(columns):
+        return []
+    # One sort key: importance ascending, then amount descending (amounts are below scale).
+    scale = float(columns.amounts.max()) + 1.0
+    key = columns.importance * scale - columns.amounts
+    key[columns.amounts <= 0] = np.inf
+    # Only the first MAX_SUGGESTED_CUTS can be shown, so partition instead of a full sort.
+    candidates = min(MAX_SUGGESTED_CUTS, len(key))
+    order = np.argpartition(key, candidates - 1)[:candidates]
+    order = order[np.argsort(key[order])]
+    order = order[np.isfinite(key[order])]
+    covered = np.cumsum(columns.amounts[order])
+    count = min(int(np.searchsorted(covered, deficit - 1e-9)) + 1, len(order))
+    return [
+        {
+            "id": columns.ids[index],
+            "item_name": columns.names[index],
+            "amount": round(float(columns.amounts[index]), 2),
+            "importance_rank": int(columns.importance[index]),
+        }
+        for index in order[:count]
+    ]
+
+
+def analyse(state_dict: Dict[str, Any], columns: Optional[ItemColumns] = None) -> Dict[str, Any]:
+    """
+    Budget analytics for the dashboard and the warnings list:
+    - total, surplus (limit minus total; the limit counts as 0 when unset)
+    - categories: [{"category", "total", "share", "count"}], largest first
+    - monthly_recurring / yearly_projection: recurring items scaled by their schedule
+      (one-time items are counted once in the yearly projection)
+    - suggested_cuts: see suggested_cuts(), only when over budget
+    - warnings: over budget, recurring costs alone above the limit
+    """
+    budget = state_dict.get("Budget") or {}
+    columns = columns if columns is not None else ItemColumns(budget.get("items") or [])
+    limit = budget.get("budget_limit")
+    limit_value = _number(limit, 0.0) if limit is not None else 0.0
+
+    total = float(columns.amounts.sum())
+    surplus = round(limit_value - total, 2)
+
+    category_totals = np.bincount(columns.category_codes, weights=columns.amounts, minlength=len(columns.categories))
+    category_counts = np.bincount(columns.category_codes, minlength=len(columns.categories))
+    order = np.argsort(-category_totals, kind="stable")
+    categories = [
+        {
+            "category": columns.categories[index],
+            "total": round(float(category_totals[index]), 2),
+            "share": round(float(category_totals[index] / total), 4) if total else 0.0,
+            "count": int(category_counts[index]),
+        }
+        for index in order
+    ]
+
+    recurring = columns.monthly_factors > 0
+    monthly_recurring = float(np.dot(columns.amounts, columns.monthly_factors))
+    yearly_projection = monthly_recurring * 12 + float(columns.amounts[~recurring].sum())
+
+    warnings = []
+    if limit is not None and surplus < 0:
+        warnings.append(f"Expenses of ${total:,.2f} exceed the budget limit of ${limit_value:,.2f} "
+                        f"by ${-surplus:,.2f}.")
+    if limit is not None and limit_value > 0 and monthly_recurring > limit_value:
+        warnings.append(f"Recurring costs of ${monthly_recurring:,.2f} a month exceed the budget limit.")
+
+    return {
+        "total": round(total, 2),
+        "surplus": surplus,
+        "item_count": len(columns),
+        "categories": categories,
+        "monthly_recurring": round(monthly_recurring, 2),
+        "yearly_projection": round(yearly_projection, 2),
+        "recurring_count": int(recurring.sum()),
+        "suggested_cuts": suggested_cuts(columns, -surplus) if limit is not None else [],
+        "warnings": warnings,
+    }
@@ -0,0 +1,154 @@
+import hashlib
+import itertools
+import json
+import secrets
+from typing import Any, Dict, List, Tuple
+
+# Fields an item may carry besides its id. Anything else in an operation is ignored.
+ITEM_FIELDS = ("item_name", "amount", "category", "importance_rank", "recurrence_schedule", "due_date")
+
+# Schema of one item operation, shown to the model instead of the full items array.
+OPERATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "op": {"type": "string", "enum": ["add", "update", "remove"]},
+        "id": {"type": "string"},
+        "item": {
+            "type": "object",
+            "properties": {
+                "item_name": {"type": "string"},
+                "amount": {"type": "number"},
+                "category": {"type": "string"},
+                "importance_rank": {"type": "integer"},
+                "recurrence_schedule": {"type": ["string", "null"]},
+                "due_date": {"type": ["number", "null"]},
+            },
+        },
+    },
+    "required": ["op"],
+}
+
+
+class DeltaError(ValueError):
+    """
+    An operation that cannot be applied (unknown id, missing fields, bad op).
+    """
+
+
+def new_item_id(taken) -> str:
+    """
+    A short random id not in taken. Ids are short on purpose, since they are repeated in
+    every prompt and reply, and random so a removed item's id is practically never reused.
+    """
+    while True:
+        item_id = secrets.token_hex(3)
+        if item_id not in taken:
+            return item_id
+
+
+def content_item_id(item: Dict[str, Any], taken) -> str:
+    """
+    A short id derived from the item's fields, not in taken. The same upload always gets the
+    same ids, so identical requests build byte-identical prompts (see model_client.call_key).
+    """
+    content = json.dumps({name: item.get(name) for name in ITEM_FIELDS}, sort_keys=True, default=str)
+    for attempt in itertools.count():
+        item_id = hashlib.sha256(f"{attempt}:{content}".encode("utf-8")).hexdigest()[:6]
+        if item_id not in taken:
+            return item_id
+
+
+def ensure_item_ids(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Give every item without one a stable id. Existing ids are kept; duplicates get a new id.
+    """
+    seen = set()
+    taken = {item.get("id") for item in items}
+    for item in items:
+        item_id = item.get("id")
+        if not isinstance(item_id, str) or not item_id or item_id in seen:
+            item["id"] = content_item_id(item, taken)
+            taken.add(item["id"])
+        seen.add(item["id"])
+    return items
+
+
+def _clean_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: value for name, value in fields.items() if name in ITEM_FIELDS}
+
+
+def apply_operations(items: List[Dict[str, Any]], operations: List[Dict[str, Any]],
+                     strict: bool = False) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Apply add/update/remove operations to a list of items (each with an "id").
+    - {"op": "add", "item": {...}}: new item; the id is assigned here.
+    - {"op": "update", "id": "3fa9c2", "item": {changed fields only}}
+    - {"op": "remove", "id": "3fa9c2"}
+    Returns the new list (input is not modified) and a list of problems with skipped
+    operations. With strict=True the first problem raises DeltaError instead.
+    """
+    result = [dict(item) for item in items]
+    by_id = {item["id"]: item for item in result}
+    problems = []
+
+    def problem(message):
+        if strict:
+            raise DeltaError(message)
+        problems.append(message)
+
+    for operation in operations or []:
+        if not isinstance(operation, dict):
+            problem(f"Operation is not an object: {operation!r}")
+            continue
+        op = operation.get("op")
+        fields = operation.get("item") if isinstance(operation.get("item"), dict) else {}
+        item_id = operation.get("id")
+        if op == "add":
+            new_item = _clean_fields(fields)
+            if "item_name" not in new_item or "amount" not in new_item:
+                problem(f"add without item_name and amount: {operation!r}")
+                continue
+            if not isinstance(item_id, str) or not item_id or item_id in by_id:
+                item_id = new_item_id(by_id)
+            new_item["id"] = item_id
+            result.append(new_item)
+            by_id[item_id] = new_item
+        elif op == "update":
+            if item_id not in by_id:
+                problem(f"update of unknown item id {item_id!r}")
+                continue
+            by_id[item_id].update(_clean_fields(fields))
+        elif op == "remove":
+            if item_id not in by_id:
+                problem(f"remove of unknown item id {item_id!r}")
+                continue
+            removed = by_id.pop(item_id)
+            result = [item for item in result if item is not removed]
+        else:
+            problem(f"unknown op {op!r}")
+    return result, problems
+
+
+def diff_items(old_items: List[Dict[str, Any]], new_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Operations that turn old_items into new_items (both keyed by "id"). Updates carry only
+    the changed fields. Used for delta responses to the client.
+    """
+    old_by_id = {item["id"]: item for item in old_items if "id" in item}
+    new_ids = set()
+    operations = []
+    for item in new_items:
+        item_id = item.get("id")
+        new_ids.add(item_id)
+        old = old_by_id.get(item_id)
+        if old is None:
+            operations.append({"op": "add", "id": item_id, "item": _clean_fields(item)})
+            continue
+        changed = {name: item.get(name) for name in ITEM_FIELDS if item.get(name) != old.get(name)}
+        if changed:
+            operations.append({"op": "update", "id": item_id, "item": changed})
+    for item_id in old_by_id:
+        if item_id not in new_ids:
+            operations.append({"op": "remove", "id": item_id})
+    return operations
+
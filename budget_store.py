@@ -0,0 +1,321 @@
+import json
+import queue
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import settings
+from budget_delta import ITEM_FIELDS, ensure_item_ids
+from metrics import metrics
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users ("
+    " id TEXT PRIMARY KEY, created REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS budgets ("
+    " id TEXT PRIMARY KEY, user_id TEXT NOT NULL REFERENCES users (id), name TEXT,"
+    " budget_limit REAL, budget_surplus REAL, warnings TEXT NOT NULL DEFAULT '[]',"
+    " created REAL NOT NULL, updated REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS budgets_user ON budgets (user_id, updated)",
+    "CREATE TABLE IF NOT EXISTS items ("
+    " budget_id TEXT NOT NULL REFERENCES budgets (id) ON DELETE CASCADE, id TEXT NOT NULL,"
+    " user_id TEXT NOT NULL, position INTEGER NOT NULL, item_name TEXT NOT NULL, amount REAL NOT NULL,"
+    " category TEXT, importance_rank INTEGER, recurrence_schedule TEXT, due_date REAL,"
+    " PRIMARY KEY (budget_id, id))",
+    "CREATE INDEX IF NOT EXISTS items_budget_category ON items (budget_id, category)",
+    "CREATE INDEX IF NOT EXISTS items_budget_due ON items (budget_id, due_date)",
+    "CREATE INDEX IF NOT EXISTS items_user_category ON items (user_id, category)",
+    "CREATE INDEX IF NOT EXISTS items_user_due ON items (user_id, due_date)",
+    "CREATE TABLE IF NOT EXISTS conversation_turns ("
+    " budget_id TEXT NOT NULL REFERENCES budgets (id) ON DELETE CASCADE, turn INTEGER NOT NULL,"
+    " user_message TEXT, ai_response TEXT, PRIMARY KEY (budget_id, turn))",
+]
+
+_ITEM_COLUMNS = ("id", "position") + ITEM_FIELDS
+
+
+def _item_row(budget_id: str, user_id: str, position: int, item: Dict[str, Any]) -> tuple:
+    return (budget_id, user_id, item["id"], position, str(item.get("item_name") or ""),
+            float(item.get("amount") or 0), item.get("category"), item.get("importance_rank"),
+            item.get("recurrence_schedule"), item.get("due_date"))
+
+
+class BudgetStoreError(RuntimeError):
+    """
+    The budget belongs to another user.
+    """
+
+
+class BudgetBackend(ABC):
+    """
+    Interface of the server-side budget store. Budgets are stored in the same
+    {"Budget": {...}} shape the chat endpoints use; items and conversation turns are kept
+    as rows so they can be queried without loading whole budgets. SQLiteBudgetBackend is
+    the local implementation; a Data Connect / Postgres one would implement the same
+    methods (see dataconnect/schema/schema.gql for the matching tables).
+    """
+
+    @abstractmethod
+    def save_budget(self, user_id: str, budget_id: str, state_dict: Dict[str, Any],
+                    name: Optional[str] = None, changes: Optional[List[Dict[str, Any]]] = None):
+        """
+        Store the budget. changes, if given, are the item operations since the budget was
+        last saved (budget_delta.diff_items), and only those item rows are written;
+        without them every item is written.
+        """
+
+    @abstractmethod
+    def load_budget(self, user_id: str, budget_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def list_budgets(self, user_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def delete_budget(self, user_id: str, budget_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def query_items(self, user_id: str, budget_id: Optional[str] = None, category: Optional[str] = None,
+                    due_after: Optional[float] = None, due_before: Optional[float] = None,
+                    limit: int = 500) -> List[Dict[str, Any]]:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class SQLiteBudgetBackend(BudgetBackend):
+    """
+    SQLite file with users, budgets, items and conversation_turns tables, indexed on user,
+    budget, category and due date. Connections come from a small pool, each opened in WAL
+    mode so readers are not blocked by a writer. Saving a budget is one transaction:
+    an upsert of its new and changed items, deletion of removed items, and an append of
+    new turns. The methods block, so async code runs them in a thread.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._pool_size = pool_size
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        if not self._schema_ready:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            self._schema_ready = True
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection (opening one if the pool is not full yet, otherwise
+        waiting for one to be returned). Commits on success, rolls back on error.
+        """
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            with self._open_lock:
+                can_open = self._opened < self._pool_size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    with self._open_lock:
+                        connection = self._connect()
+                except Exception:
+                    with self._open_lock:
+                        self._opened -= 1
+                    raise
+            else:
+                connection = self._pool.get(timeout=self.busy_timeout)
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            self._pool.put(connection)
+
+    def _owner(self, connection, budget_id: str) -> Optional[str]:
+        row = connection.execute("SELECT user_id FROM budgets WHERE id = ?", (budget_id,)).fetchone()
+        return row["user_id"] if row else None
+
+    def save_budget(self, user_id: str, budget_id: str, state_dict: Dict[str, Any],
+                    name: Optional[str] = None, changes: Optional[List[Dict[str, Any]]] = None):
+        budget = state_dict.get("Budget") or {}
+        items = ensure_item_ids(budget.get("items") or [])
+        turns = budget.get("conversations") or []
+        now = time.time()
+        start = time.perf_counter()
+        with self.connection() as connection:
+            owner = self._owner(connection, budget_id)
+            if owner is not None and owner != user_id:
+                raise BudgetStoreError(f"Budget {budget_id} belongs to another user")
+            connection.execute("INSERT OR IGNORE INTO users (id, created) VALUES (?, ?)", (user_id, now))
+            connection.execute(
+                "INSERT INTO budgets (id, user_id, name, budget_limit, budget_surplus, warnings, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET name = COALESCE(excluded.name, budgets.name),"
+                " budget_limit = excluded.budget_limit, budget_surplus = excluded.budget_surplus,"
+                " warnings = excluded.warnings, updated = excluded.updated",
+                (budget_id, user_id, name, budget.get("budget_limit"), budget.get("budget_surplus"),
+                 json.dumps(budget.get("warnings") or []), now, now),
+            )
+            upsert = (
+                "INSERT INTO items (budget_id, user_id, " + ", ".join(_ITEM_COLUMNS) + ")"
+                " VALUES (?, ?, " + ", ".join("?" for _ in _ITEM_COLUMNS) + ")"
+                " ON CONFLICT (budget_id, id) DO UPDATE SET "
+            )
+            if changes is None:
+                connection.executemany(
+                    upsert + ", ".join(f"{column} = excluded.{column}" for column in _ITEM_COLUMNS[1:]),
+                    [_item_row(budget_id, user_id, position, item) for position, item in enumerate(items)],
+                )
+                connection.execute(
+                    "DELETE FROM items WHERE budget_id = ? AND id NOT IN (SELECT value FROM json_each(?))",
+                    (budget_id, json.dumps([item["id"] for item in items])),
+                )
+            else:
+                written = {change["id"] for change in changes if change.get("op") in ("add", "update")}
+                removed = [change["id"] for change in changes if change.get("op") == "remove"]
+                if removed:
+                    connection.execute(
+                        "DELETE FROM items WHERE budget_id = ? AND id IN (SELECT value FROM json_each(?))",
+                        (budget_id, json.dumps(removed)),
+                    )
+                if written:
+                    # Changed items keep their stored position; new ones go after the last item.
+                    next_position = connection.execute(
+                        "SELECT COALESCE(MAX(position), -1) + 1 FROM items WHERE budget_id = ?", (budget_id,)
+                    ).fetchone()[0]
+                    connection.executemany(
+                        upsert + ", ".join(f"{column} = excluded.{column}" for column in _ITEM_COLUMNS[2:]),
+                        [_item_row(budget_id, user_id, position, item) for position, item in
+                         enumerate((item for item in items if item["id"] in written), start=next_position)],
+                    )
+            # Turns are append-only; a shorter history (a client reset) truncates the stored one.
+            stored = connection.execute(
+                "SELECT COUNT(*) FROM conversation_turns WHERE budget_id = ?", (budget_id,)
+            ).fetchone()[0]
+            if stored > len(turns):
+                connection.execute("DELETE FROM conversation_turns WHERE budget_id = ? AND turn >= ?",
+                                   (budget_id, len(turns)))
+                stored = len(turns)
+            if stored:
+                # A client that uploaded a different history: the last shared turn no longer
+                # matches, so the stored turns are replaced rather than appended to.
+                last = connection.execute(
+                    "SELECT user_message, ai_response FROM conversation_turns WHERE budget_id = ? AND turn = ?",
+                    (budget_id, stored - 1),
+                ).fetchone()
+                if last is None or tuple(last) != (turns[stored - 1].get("user_message"),
+                                                   turns[stored - 1].get("ai_response")):
+                    connection.execute("DELETE FROM conversation_turns WHERE budget_id = ?", (budget_id,))
+                    stored = 0
+            connection.executemany(
+                "INSERT OR REPLACE INTO conversation_turns (budget_id, turn, user_message, ai_response)"
+                " VALUES (?, ?, ?, ?)",
+                [(budget_id, index, turn.get("user_message"), turn.get("ai_response"))
+                 for index, turn in enumerate(turns[stored:], start=stored)],
+            )
+        metrics.record_timing("budget_store.save", time.perf_counter() - start)
+
+    def load_budget(self, user_id: str, budget_id: str) -> Optional[Dict[str, Any]]:
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT * FROM budgets WHERE id = ? AND user_id = ?", (budget_id, user_id)
+            ).fetchone()
+            if row is None:
+                return None
+            items = [
+                {column: item[column] for column in ("id",) + ITEM_FIELDS}
+                for item in connection.execute(
+                    "SELECT * FROM items WHERE budget_id = ? ORDER BY position", (budget_id,)
+                )
+            ]
+            turns = [
+                {"user_message": turn["user_message"], "ai_response": turn["ai_response"]}
+                for turn in connection.execute(
+                    "SELECT user_message, ai_response FROM conversation_turns WHERE budget_id = ? ORDER BY turn",
+                    (budget_id,),
+                )
+            ]
+        return {
+            "Budget": {
+                "budget_limit": row["budget_limit"],
+                "budget_surplus": row["budget_surplus"],
+                "warnings": json.loads(row["warnings"] or "[]"),
+                "items": items,
+                "conversations": turns,
+            },
+            "conversation": "",
+        }
+
+    def list_budgets(self, user_id: str) -> List[Dict[str, Any]]:
+        with self.connection() as connection:
+            rows = connection.execute(
+                "SELECT b.id, b.name, b.budget_limit, b.budget_surplus, b.created, b.updated,"
+                " (SELECT COUNT(*) FROM items WHERE budget_id = b.id) AS item_count"
+                " FROM budgets b WHERE b.user_id = ? ORDER BY b.updated DESC",
+                (user_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_budget(self, user_id: str, budget_id: str) -> bool:
+        with self.connection() as connection:
+            cursor = connection.execute("DELETE FROM budgets WHERE id = ? AND user_id = ?", (budget_id, user_id))
+        return cursor.rowcount > 0
+
+    def query_items(self, user_id: str, budget_id: Optional[str] = None, category: Optional[str] = None,
+                    due_after: Optional[float] = None, due_before: Optional[float] = None,
+                    limit: int = 500) -> List[Dict[str, Any]]:
+        """
+        Items of one budget (or all of a user's budgets) filtered by category and/or a
+        due date range, served from the indexes.
+        """
+        clauses, params = ["user_id = ?"], [user_id]
+        if budget_id is not None:
+            clauses.append("budget_id = ?")
+            params.append(budget_id)
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        if due_after is not None:
+            clauses.append("due_date >= ?")
+            params.append(due_after)
+        if due_before is not None:
+            clauses.append("due_date < ?")
+            params.append(due_before)
+        order = "due_date" if due_after is not None or due_before is not None else "budget_id, position"
+        params.append(limit)
+        with self.connection() as connection:
+            rows = connection.execute(
+                "SELECT budget_id, " + ", ".join(("id",) + ITEM_FIELDS) + " FROM items WHERE "
+                + " AND ".join(clauses) + f" ORDER BY {order} LIMIT ?",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "connections": self._opened, "idle_connections": self._pool.qsize()}
+
+
+budget_store: Optional[BudgetBackend] = (
+    SQLiteBudgetBackend(settings.BUDGET_DB_PATH, pool_size=settings.BUDGET_DB_POOL_SIZE)
+    if settings.BUDGET_DB_PATH else None
+)
@@ -1,35 +1,97 @@
 
-import json, re, os, io, uvicorn
-from PIL import Image
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Body, Request
-from fastapi.responses import JSONResponse, RedirectResponse, HTMLResponse
+import json, re, os, io, asyncio, time, uuid, itertools, uvicorn
+from datetime import date, datetime, timezone
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Body, Request, Header, Response
+from fastapi.responses import JSONResponse, RedirectResponse, HTMLResponse, StreamingResponse, PlainTextResponse
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.formparsers import MultiPartParser
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
-from receipt_reader import extract_text_from_image_stream
+from receipt_reader import read_receipt, ocr_receipt_bytes, ai_filter_receipt_texts_async, parse_locally, tesseract_version
+import receipt_parser
+from budget_delta import DeltaError, apply_operations, diff_items, ensure_item_ids
+from receipt_cache import receipt_cache, content_key
 
-from firebase_auth import get_current_user
+from firebase_auth import get_current_user, key_set, token_cache
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Depends
 
 
 # Import the helper functions from consolemain.
-from consolemain import configure_genai, initialize_chat, generate_prompt
-
-from datetime import datetime
-
-def get_current_time_string():
+from model_registry import model_registry
+from model_client import send_chat_message, stream_chat_message
+from scheduler import model_scheduler, ModelOverloaded
+from response_stream import AiResponseExtractor
+from response_validator import parse_chat_reply
+from response_cache import response_cache, budget_hash
+from idempotency import idempotency_store, fingerprint
+from intent_router import apply_command
+import history_manager
+import workers
+from metrics import metrics, trace_var, server_timing, stage_totals
+from profiler import finish_profile, start_profile
+from prompt_builder import PromptBuilder, prompt_stats
+import settings
+import serve
+from session_store import session_store, BudgetSession
+from budget_store import budget_store, BudgetStoreError
+from budget_analytics import analyse
+from recurrence import ScheduleIndex
+
+from app_log import log, request_id_var, redact_headers, elapsed_ms
+
+from contextlib import asynccontextmanager
+
+
+async def purge_sessions():
     """
-    Returns the current time as a string in the format YYYY-MM-DD-HH:MM:SS.
+    Remove expired chat sessions every SESSION_PURGE_INTERVAL_SECONDS, from memory and from
+    SESSION_DIR (otherwise session files would pile up there forever).
     """
-    return datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
-
-
-app = FastAPI()
+    while True:
+        await asyncio.sleep(settings.SESSION_PURGE_INTERVAL_SECONDS)
+        try:
+            removed = await asyncio.to_thread(session_store.purge_expired)
+        except Exception as e:
+            log.error("Session purge failed", error=str(e))
+            continue
+        if removed:
+            metrics.incr("sessions.purged", removed)
+            log.info("Expired sessions purged", sessions=removed)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Thread pools for blocking calls and the SIGTERM drain handler (see serve.py).
+    serve.configure_worker(asyncio.get_running_loop())
+    # Build the Gemini models once per process instead of on every request.
+    try:
+        model_registry.load()
+        log.info("Models initialised", init_seconds=round(model_registry.init_seconds, 3), cwd=os.getcwd())
+    except Exception as e:
+        # Don't refuse to start; the registry retries on first use.
+        log.error("Model initialisation failed", error=str(e))
+    if USE_AUTH:
+        # Fetch the token signing keys now and keep them fresh, so no request waits on Google.
+        key_set.start()
+    if settings.PRELOAD:
+        start = time.perf_counter()
+        report = await asyncio.to_thread(serve.preload)
+        log.info("Worker preloaded", seconds=round(time.perf_counter() - start, 3), **report)
+    purger = asyncio.create_task(purge_sessions()) if settings.SESSION_PURGE_INTERVAL_SECONDS > 0 else None
+    yield
+    if purger is not None:
+        purger.cancel()
+    key_set.stop()
+    workers.shutdown()
+    log.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS for the FastAPI app
 # app.add_middleware(
@@ -51,16 +113,65 @@ app.add_middleware(
 )
 
 
+# Keep uploaded receipts in memory while the multipart body is parsed, instead of
+# spooling anything over 1MB to a temporary file on disk.
+MultiPartParser.spool_max_size = settings.RECEIPT_MAX_BYTES
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Reject oversized receipt uploads from the Content-Length header, before the body is read.
+    """
+    if request.method == "POST" and request.url.path.startswith("/receipt"):
+        content_length = request.headers.get("content-length")
+        max_bytes = settings.RECEIPT_MAX_BYTES
+        if request.url.path.startswith("/receipts/batch"):
+            max_bytes *= settings.RECEIPT_BATCH_MAX_FILES
+        # Allow some room for the multipart framing and the other form fields.
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes + 1024 * 1024:
+            return JSONResponse(status_code=413, content={"detail": "Receipt upload too large"})
+    return await call_next(request)
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    log_message(f"DEBUG: Received request: {request.method} {request.url}")
-    log_message(f"DEBUG: Headers: {request.headers}")
-    
-    # Process the request
-    response = await call_next(request)
-    
-    log_message(f"DEBUG: Response status code: {response.status_code}")
-    return response
+    # Tag every record logged while handling this request with one id, echoed back to the client.
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    # Stages timed while handling the request (see metrics.timer), reported in the
+    # Server-Timing header and the access log. Streamed bodies finish after this returns.
+    trace = []
+    trace_token = trace_var.set(trace)
+    # "X-Profile: <BUDGIT_PROFILE_TOKEN>" samples the request's stacks (operators only).
+    profiler, profile_file = start_profile(request_id, request.headers.get("x-profile"))
+    start = time.perf_counter()
+    try:
+        if log.enabled("DEBUG"):
+            log.debug("Request headers", headers=redact_headers(request.headers))
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        if trace:
+            response.headers["Server-Timing"] = server_timing(trace)
+        if profile_file:
+            response.headers["X-Profile-File"] = os.path.basename(profile_file)
+        metrics.record_timing(f"http.{request.method} {request.scope.get('route').path}"
+                              if request.scope.get("route") is not None else "http.unmatched",
+                              time.perf_counter() - start)
+        log.info("request", method=request.method, path=request.url.path,
+                 status=response.status_code, latency_ms=elapsed_ms(start),
+                 stages={name: round(ms, 2) for name, ms in stage_totals(trace).items()} if trace else None)
+        return response
+    except Exception as e:
+        log.error("request failed", method=request.method, path=request.url.path,
+                  latency_ms=elapsed_ms(start), error=str(e))
+        raise
+    finally:
+        if profiler is not None:
+            samples = await asyncio.to_thread(finish_profile, profiler, profile_file)
+            log.info("Request profiled", path=profile_file, samples=samples)
+        trace_var.reset(trace_token)
+        request_id_var.reset(token)
 
 
 # Mount static files directory
@@ -70,9 +181,15 @@ app.mount("/static", StaticFiles(directory="public"), name="static")
 templates = Jinja2Templates(directory="public")
 
 # Define the Pydantic model that describes the expected request payload.
+# Clients that already hold a session_id may omit Budget and send only the new message,
+# plus their own item edits as operations against the revision they hold (see budget_delta.py).
 class ChatRequest(BaseModel):
-    Budget: Dict[str, Any]
+    Budget: Optional[Dict[str, Any]] = None
     conversation: Optional[str] = ""  # Defaults to an empty string if not provided.
+    session_id: Optional[str] = None
+    budget_id: Optional[str] = None
+    revision: Optional[int] = None
+    operations: Optional[List[Dict[str, Any]]] = None
 
 # Define a simple login request model
 class LoginRequest(BaseModel):
@@ -80,25 +197,20 @@ class LoginRequest(BaseModel):
     password: str
 
 
-def log_message(message: Optional[str]):
-    with open("log.txt", "a") as f:
-        f.write(get_current_time_string() + " -- "+ message + "\n")
-        
-
-log_message("\nDEBUG: New Attempt")
-log_message("DEBUG: Current working directory: " + os.getcwd())
 
 
 def calculate_surplus(state):
-    total = 0
-    budget = state["Budget"]["budget_limit"] if state["Budget"]["budget_limit"] != None else 0
-    items = state["Budget"]["items"]
-    
-    for item in items:
-        total += item["amount"]
-    surp_amount = round(budget - total,2)
-    state["Budget"]["budget_surplus"] = surp_amount
-    print(f"Surplus amount: {surp_amount}")
+    """
+    Recompute the surplus, warnings and dashboard analytics of state["Budget"]
+    (see budget_analytics.analyse). The warnings replace any the model wrote.
+    """
+    with metrics.timer("chat.surplus"):
+        analytics = analyse(state)
+    budget = state["Budget"]
+    budget["budget_surplus"] = analytics["surplus"]
+    budget["warnings"] = analytics.pop("warnings")
+    budget["analytics"] = analytics
+    log.debug("Surplus calculated", surplus=analytics["surplus"])
     return state
 
 # Root route - serve the login page
@@ -119,6 +231,63 @@ async def login(login_data: LoginRequest):
     return {"success": True, "message": "Use Firebase Authentication"}
 
 
+@app.get("/stats")
+async def stats():
+    """
+    Runtime statistics: model initialisation time and live chat sessions.
+    Each worker process (see serve.py) keeps its own; pid says which one answered.
+    """
+    return {
+        "pid": os.getpid(),
+        "models": model_registry.stats(),
+        "sessions": {"live": len(session_store)},
+        "prompts": prompt_stats.snapshot(),
+        "receipt_cache": receipt_cache.stats(),
+        "metrics": metrics.snapshot(),
+        "logging": log.stats(),
+        "response_cache": response_cache.stats(),
+        "budget_store": budget_store.stats() if budget_store is not None else {"enabled": False},
+        "auth": {"enabled": USE_AUTH, "token_cache": token_cache.stats(), "keys": key_set.stats()},
+        "idempotency": idempotency_store.stats(),
+        "scheduler": model_scheduler.stats(),
+    }
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the worker's event loop is answering.
+    """
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: 503 while the worker drains after SIGTERM, or when the models or the budget
+    database are unavailable. Tesseract is reported but not required (only receipts need it).
+    """
+    checks = {"draining": serve.draining.is_set(), "models": model_registry.chat_model is not None}
+    if budget_store is not None:
+        try:
+            await asyncio.to_thread(budget_store.list_budgets, "")
+            checks["budget_store"] = True
+        except Exception:
+            checks["budget_store"] = False
+    checks["tesseract"] = await asyncio.to_thread(tesseract_version) is not None
+    ready = not checks["draining"] and checks["models"] and checks.get("budget_store", True)
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"status": "ready" if ready else "unavailable", "pid": os.getpid(), **checks})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Counters and latency / size histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
 # Add a route to verify tokens and get user info (add this to your app routes)
 @app.post("/verify-token")
 async def verify_token(user: dict = Depends(get_current_user)):
@@ -129,240 +298,810 @@ async def verify_token(user: dict = Depends(get_current_user)):
     return {"success": True, "user": user}
 
 
+@app.post("/logout")
+async def logout(user: dict = Depends(get_current_user)):
+    """
+    Sign the caller out of this worker: their ID tokens issued so far are refused from now
+    on, including ones still in the token cache.
+    """
+    token_cache.revoke(user["uid"])
+    return {"success": True}
+
+
 USE_AUTH = False  # Set to True when ready for production
 
-# If you're using a security dependency, modify it to be optional
-# This function can replace the get_current_user function
-async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = None):
+optional_security = HTTPBearer(auto_error=False)
+
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
     """
-    A development version that doesn't require authentication
+    Returns the verified Firebase user when USE_AUTH is on,
+    otherwise a mock user for development.
     """
-    # Just return a mock user for development
+    if USE_AUTH:
+        if credentials is None:
+            raise HTTPException(
+                status_code=401,
+                detail="Missing authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return await get_current_user(credentials)
     return {
         "uid": "dev-user-id",
         "email": "dev-user@example.com"
     }
 
+
+async def resolve_session(user_id: str, session_id: Optional[str], budget_id: Optional[str],
+                          state_dict: Optional[Dict[str, Any]]) -> BudgetSession:
+    """
+    Find the caller's chat session.
+    - If the client uploaded the full Budget (old protocol), that state wins and the
+      session is (re)started from it, once any turn in progress on it has finished.
+    - Otherwise the session_id must point at a live session; a 409 tells the client
+      to fall back to uploading the full state.
+    """
+    if state_dict is not None and state_dict.get("Budget") is not None:
+        if "conversations" not in state_dict["Budget"]:
+            state_dict["Budget"]["conversations"] = []
+        ensure_item_ids(state_dict["Budget"].setdefault("items", []))
+        session = session_store.get(session_id, user_id) if session_id else None
+        if session is None:
+            return session_store.create(user_id, budget_id, state_dict)
+        # A turn already running on this session holds the lock across the model call; wait
+        # for it, so it does not finish against the replaced state or a dropped chat.
+        async with session.lock:
+            session.reset(state_dict)
+        return session
+
+    session = session_store.get(session_id, user_id) if session_id else None
+    if session is None and budget_id and budget_store is not None:
+        # No live session, but the budget is stored server-side: load it by id.
+        stored_state = await asyncio.to_thread(budget_store.load_budget, user_id, budget_id)
+        if stored_state is not None:
+            session = session_store.create(user_id, budget_id, stored_state)
+            session.stored_items = [dict(item) for item in stored_state["Budget"]["items"]]
+            return session
+    if session is None:
+        raise HTTPException(status_code=409, detail="Unknown or expired session_id; resend the full Budget state.")
+    return session
+
+
+async def persist_budget(session: BudgetSession):
+    """
+    Write the session's budget to the budget store (in a thread; session lock held), if there
+    is one and the budget has an id. Only the items changed since the last write are sent.
+    A failed write is logged and does not fail the turn; the session still holds the state.
+    """
+    if budget_store is None or not session.budget_id:
+        return
+    items = session.state["Budget"]["items"]
+    changes = diff_items(session.stored_items, items) if session.stored_items is not None else None
+    try:
+        await asyncio.to_thread(budget_store.save_budget, session.user_id, session.budget_id,
+                                session.state, None, changes)
+        session.stored_items = [dict(item) for item in items]
+    except BudgetStoreError as e:
+        log.warning("Budget not saved", budget_id=session.budget_id, error=str(e))
+    except Exception as e:
+        metrics.incr("budget_store.errors")
+        log.error("Budget store write failed", budget_id=session.budget_id, error=str(e))
+
+
+def start_turn(session: BudgetSession, client_revision: Optional[int],
+               operations: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Begin a turn on a session (session lock held): apply the client's own item operations and
+    remember the items the client now holds, so the reply can be sent as a delta.
+    Operations against an old revision get a 409, like an expired session.
+    """
+    budget = session.state["Budget"]
+    ensure_item_ids(budget.setdefault("items", []))
+    in_sync = client_revision is not None and client_revision == session.revision
+    items_before = budget["items"]
+    if operations:
+        if not in_sync:
+            raise HTTPException(status_code=409, detail="Budget revision is out of date; resend the full Budget state.")
+        try:
+            budget["items"], _ = apply_operations(budget["items"], operations, strict=True)
+        except DeltaError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid item operation: {e}")
+    return {"in_sync": in_sync, "items": [dict(item) for item in budget["items"]], "items_before": items_before}
+
+
+def abort_turn(session: BudgetSession, turn: Dict[str, Any]):
+    """
+    Undo start_turn's item operations when the turn is turned away before the model saw it
+    (ModelOverloaded), so the client's retry with the same revision applies them once.
+    """
+    session.state["Budget"]["items"] = turn["items_before"]
+
+
+async def finish_turn(session: BudgetSession, turn: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    End a turn (session lock held): recompute the surplus, bump and save the session, and
+    build the response body. Clients that sent the current revision get only the changes:
+    {"session_id", "revision", "delta": {"operations", "budget_limit", "budget_surplus",
+    "warnings", "analytics", "conversation"}}; everyone else gets the full state as before.
+    """
+    calculate_surplus(session.state)
+    session.revision += 1
+    session_store.save(session)
+    await persist_budget(session)
+    body = {"session_id": session.session_id, "revision": session.revision}
+    budget = session.state["Budget"]
+    if not turn["in_sync"]:
+        return {**session.state, **body}
+    conversations = budget.get("conversations") or []
+    body["delta"] = {
+        "operations": diff_items(turn["items"], budget["items"]),
+        "budget_limit": budget.get("budget_limit"),
+        "budget_surplus": budget.get("budget_surplus"),
+        "warnings": budget.get("warnings") or [],
+        "analytics": budget.get("analytics"),
+        "conversation": conversations[-1] if conversations else None,
+    }
+    return body
+
+
+def start_chat_session(model, state_dict: Dict[str, Any], summary: Optional[str] = None,
+                       summarised_turns: int = 0):
+    """
+    Start a chat session for the given state: the static system prompt, the summary of
+    older turns and the recent conversation turns (see history_manager.chat_history).
+    """
+    conversations = state_dict["Budget"].get("conversations") or []
+    return model.start_chat(history=history_manager.chat_history(conversations, summary, summarised_turns))
+
+
+def get_chat_session(model, session: BudgetSession):
+    """
+    Return the session's live chat, rebuilding it from history only when it was lost
+    (new session, full-state upload or reload from disk).
+    """
+    if session.chat is None:
+        session.chat = start_chat_session(model, session.state, session.summary, session.summarised_turns)
+        # A rebuilt chat has not seen the budget yet, so the next prompt sends it in full.
+        session.prompt_builder = PromptBuilder(compare_legacy=settings.PROMPT_COMPARE_LEGACY)
+    return session.chat
+
+async def compact_history(session: BudgetSession):
+    """
+    Fold turns that overflow the history window into the session's running summary
+    (session lock held). The live chat is then rebuilt from the summary and recent turns,
+    with a new prompt builder, since the turn that carried the full budget may be gone.
+    """
+    conversations = session.state["Budget"].get("conversations") or []
+    summary, summarised_turns = await history_manager.compact(conversations, session.summary,
+                                                              session.summarised_turns)
+    if summarised_turns != session.summarised_turns:
+        session.summary = summary
+        session.summarised_turns = summarised_turns
+        session.chat = None
+        session.prompt_builder = None
+
+
+def answer_locally(session: BudgetSession, user_input: str) -> Optional[str]:
+    """
+    Handle a turn without the model when possible (session lock held): simple edit commands
+    through the intent router, read-only questions through the response cache.
+    Returns the reply, or None when the turn needs the model.
+    """
+    if settings.INTENT_ROUTER:
+        reply = apply_command(user_input, session.state)
+        if reply is not None:
+            return reply
+    return answer_from_cache(session, user_input)
+
+
+def answer_from_cache(session: BudgetSession, user_input: str) -> Optional[str]:
+    """
+    Answer a read-only question without the model (session lock held): from the items
+    directly, or from an earlier reply to the same question on the same budget.
+    The turn is recorded in the conversation like a model turn. Returns None on a miss.
+    """
+    reply = response_cache.lookup(session.session_id, session.state, user_input)
+    if reply is None:
+        return None
+    session.state["Budget"].setdefault("conversations", []).append({
+        "user_message": user_input,
+        "ai_response": reply,
+    })
+    return reply
+
+
+def remember_reply(session: BudgetSession, user_input: str, state_hash: str):
+    """
+    Cache the model's reply to a turn that left the items and limit unchanged.
+    """
+    if budget_hash(session.state) != state_hash:
+        return
+    conversations = session.state["Budget"].get("conversations") or []
+    # "Operation completed." stands in for a reply that could not be parsed; never reuse it.
+    if conversations and conversations[-1].get("ai_response") != "Operation completed.":
+        response_cache.store(session.session_id, session.state, user_input, conversations[-1].get("ai_response"))
+
+
+async def idempotent_response(user: dict, idempotency_key: str, request_fingerprint: str, call) -> Response:
+    """
+    Answer a request sent with an Idempotency-Key: the stored response of an earlier attempt
+    (marked with Idempotent-Replayed: true), or call()'s result, stored for retries.
+    """
+    body, replayed = await idempotency_store.run(user["uid"], idempotency_key, request_fingerprint, call)
+    return Response(content=body, media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+
 # Now update your routes to use this function instead of strict authentication
 @app.post("/chat")
+async def send_one_chat(current_state: ChatRequest = Body(...), user: dict = Depends(get_optional_user),
+                        idempotency_key: Optional[str] = Header(None)):
+    """
+    One chat turn. A retry sent with the same Idempotency-Key header gets the first
+    attempt's response instead of running the turn again.
+    """
+    if idempotency_key:
+        return await idempotent_response(user, idempotency_key, fingerprint("/chat", current_state.dict()),
+                                         lambda: chat_turn(current_state, user))
+    return await chat_turn(current_state, user)
 
-def send_one_chat(current_state: ChatRequest = Body(...)):
-    # No authentication dependency
 
+async def chat_turn(current_state: ChatRequest, user: dict) -> Dict[str, Any]:
     try:
         # Log the request for debugging
-        log_message("DEBUG: Chat endpoint hit")
-        
-        # Rest of your existing code...
-        state_dict = current_state.dict()
+        log.debug("Chat endpoint hit")
+
+        state_dict = current_state.dict(exclude={"session_id", "budget_id"})
+        if state_dict["Budget"] is None:
+            state_dict = None
+        session = await resolve_session(user["uid"], current_state.session_id, current_state.budget_id, state_dict)
+
+        async with session.lock:
+            turn = start_turn(session, current_state.revision, current_state.operations)
+            user_input = current_state.conversation or ""
+            session.state["conversation"] = user_input
+
+            if answer_locally(session, user_input) is None:
+                await compact_history(session)
+                model = model_registry.get_chat_model()
+                chat_session = get_chat_session(model, session)
+                state_hash = budget_hash(session.state)
+                try:
+                    await process_chat_logic(session.state, user_input, chat_session, session.prompt_builder)
+                except ModelOverloaded:
+                    abort_turn(session, turn)
+                    raise
+                remember_reply(session, user_input, state_hash)
+
+            # Calculate budget surplus, save, and answer with the state or its changes
+            return await finish_turn(session, turn)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("Chat failed", error=str(e))
+        raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
-        # Ensure conversations array exists
-        if "conversations" not in state_dict["Budget"]:
-            state_dict["Budget"]["conversations"] = []
-            
 
-        # Configure the generative AI model.
-        model = configure_genai()
+@app.post("/chat/stream")
+async def stream_chat(current_state: ChatRequest = Body(...), user: dict = Depends(get_optional_user)):
+    """
+    Same request as /chat, answered as Server-Sent Events while the model is still generating:
+    "delta" events carry new text of the conversation.ai_response reply, then a "done" event
+    carries the updated state (same body as /chat), or an "error" event.
+    """
+    log.debug("Chat stream endpoint hit")
+    state_dict = current_state.dict(exclude={"session_id", "budget_id"})
+    if state_dict["Budget"] is None:
+        state_dict = None
+    session = await resolve_session(user["uid"], current_state.session_id, current_state.budget_id, state_dict)
+    if current_state.operations and current_state.revision != session.revision:
+        # Checked again under the lock; this catches the common case before the stream starts.
+        raise HTTPException(status_code=409, detail="Budget revision is out of date; resend the full Budget state.")
+    return StreamingResponse(
+        chat_stream_events(session, current_state.conversation or "", current_state.revision, current_state.operations),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def require_budget_store():
+    if budget_store is None:
+        raise HTTPException(status_code=503, detail="Server-side budget storage is disabled")
+    return budget_store
+
+
+@app.get("/budgets")
+async def list_budgets(user: dict = Depends(get_optional_user)):
+    """
+    The caller's stored budgets, most recently updated first (without items).
+    """
+    return {"budgets": await asyncio.to_thread(require_budget_store().list_budgets, user["uid"])}
+
 
-        # Initialize chat session only if there is no conversation history.
-        # Otherwise, re-create the chat session with the existing conversation.
-        if not state_dict["Budget"].get("conversations"):
-            chat_session = initialize_chat(model, state_dict)
-        else:
-            # Rebuild chat history from previous conversation turns.
-            chat_history = []
-            for conversation in state_dict["Budget"]["conversations"]:
-                chat_history.append({
-                    "role": "user",
-                    "parts": [{"text": conversation.get("user_message", "")}]
-                })
-                chat_history.append({
-                    "role": "model",
-                    "parts": [{"text": conversation.get("ai_response", "")}]
-                })
-            # Add the new user input to the history.
-            chat_history.append({
-                "role": "user",
-                "parts": [{"text": state_dict.get("conversation", "")}]
-            })
-
-            chat_session = model.start_chat(history=chat_history)
-
-        # Generate the prompt using the current state.
-        prompt = generate_prompt(state_dict, state_dict.get("conversation", ""))
-        
-        # Generate response from the AI.
-        response = chat_session.send_message(prompt)
-        ai_response = response.text
+@app.get("/budgets/{budget_id}")
+async def get_budget(budget_id: str, user: dict = Depends(get_optional_user)):
+    """
+    A stored budget in the same {"Budget": {...}} shape /chat returns.
+    """
+    state = await asyncio.to_thread(require_budget_store().load_budget, user["uid"], budget_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown budget_id")
+    return state
 
-        # Try to parse the AI response.
-        try:
-            parsed_ai_response = json.loads(ai_response)
-        except json.JSONDecodeError:
-            parsed_ai_response = {"ai_response": ai_response}
-            
-        # Extract the conversation reply.
-        if "conversation" in parsed_ai_response and isinstance(parsed_ai_response["conversation"], dict):
-            ai_reply = parsed_ai_response["conversation"].get("ai_response", "Operation completed, but error returning from the agent. Ask to see your budget through chat.")
-        else:
-            ai_reply = "Operation completed."
-        
-        # Append the new conversation turn to the conversation history.
-        if "conversations" not in state_dict["Budget"]:
-            state_dict["Budget"]["conversations"] = []
-        state_dict["Budget"]["conversations"].append({
-            "user_message": state_dict.get("conversation", ""),
-            "ai_response": ai_reply
-        })
-        
-        # Update budget items if provided in the AI response.
-        if ("Budget" in parsed_ai_response 
-                and isinstance(parsed_ai_response["Budget"], dict) 
-                and "items" in parsed_ai_response["Budget"]):
-            state_dict["Budget"]["items"] = parsed_ai_response["Budget"]["items"]
 
-        
-        state_dict["Budget"]["budget_limit"] = parsed_ai_response["Budget"]["budget_limit"]
-        
-        # Calculate budget surplus
-        state_dict = calculate_surplus(state_dict)
-        
+@app.delete("/budgets/{budget_id}")
+async def delete_budget(budget_id: str, user: dict = Depends(get_optional_user)):
+    if not await asyncio.to_thread(require_budget_store().delete_budget, user["uid"], budget_id):
+        raise HTTPException(status_code=404, detail="Unknown budget_id")
+    return {"deleted": budget_id}
+
+
+@app.get("/items")
+async def query_items(budget_id: Optional[str] = None, category: Optional[str] = None,
+                      due_after: Optional[float] = None, due_before: Optional[float] = None,
+                      limit: int = 500, user: dict = Depends(get_optional_user)):
+    """
+    The caller's stored items, optionally for one budget, one category and/or a due date
+    range (epoch seconds, due_after inclusive, due_before exclusive).
+    """
+    if not 1 <= limit <= 5000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 5000")
+    items = await asyncio.to_thread(require_budget_store().query_items, user["uid"], budget_id, category,
+                                    due_after, due_before, limit)
+    return {"items": items}
+
+
+@app.get("/history")
+async def conversation_history(session_id: str, offset: int = 0, limit: int = 50,
+                               user: dict = Depends(get_optional_user)):
+    """
+    Page through a session's full conversation archive, oldest first. The model only sees
+    the running summary and recent turns; the archive keeps every turn.
+    """
+    session = session_store.get(session_id, user["uid"])
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    if offset < 0 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 500")
+    conversations = session.state["Budget"].get("conversations") or []
+    return {
+        "session_id": session.session_id,
+        "summary": session.summary,
+        "summarised_turns": session.summarised_turns,
+        **history_manager.page(conversations, offset, limit),
+    }
 
-        return state_dict
 
+def schedule_index(session: BudgetSession, today: date) -> ScheduleIndex:
+    """
+    The session's ScheduleIndex, rebuilt only when the budget revision or the day changes.
+    """
+    key = (session.revision, today)
+    cached = session.schedule_index
+    if cached is None or cached[0] != key:
+        start = time.perf_counter()
+        cached = session.schedule_index = (key, ScheduleIndex(session.state["Budget"].get("items") or [], today))
+        metrics.record_timing("projection.index", time.perf_counter() - start)
+    return cached[1]
+
+
+@app.get("/projection")
+async def projection(session_id: Optional[str] = None, budget_id: Optional[str] = None, months: int = 12,
+                     start: Optional[str] = None, upcoming_days: int = 30, events: int = 0,
+                     user: dict = Depends(get_optional_user)):
+    """
+    Spending projected from each item's recurrence_schedule and due_date, per month for
+    months months from start (default today, UTC), without a model call. Also returns the
+    items due in the next upcoming_days days and, if events > 0, the first events entries
+    of the cash-flow timeline.
+    """
+    if not 1 <= months <= 600 or not 0 <= upcoming_days <= 3660 or not 0 <= events <= 5000:
+        raise HTTPException(status_code=400,
+                            detail="months must be 1-600, upcoming_days 0-3660 and events 0-5000")
+    today = datetime.now(timezone.utc).date()
+    try:
+        start_day = date.fromisoformat(start) if start else today
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start must be a YYYY-MM-DD date")
+    session = await resolve_session(user["uid"], session_id, budget_id, None)
+    began = time.perf_counter()
+    index = schedule_index(session, today)
+    result = index.projection(start_day, months)
+    result["upcoming"] = index.upcoming(upcoming_days)
+    if events:
+        result["events"] = list(itertools.islice(index.timeline(start_day, date.fromisoformat(result["end"])), events))
+    metrics.record_timing("projection.total", time.perf_counter() - began)
+    return {"session_id": session.session_id, "revision": session.revision, **result}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chat_stream_events(session: BudgetSession, user_input: str, client_revision: Optional[int] = None,
+                             operations: Optional[List[Dict[str, Any]]] = None):
+    """
+    Async generator behind /chat/stream. The session lock is held for the whole turn,
+    like /chat, so turns on one session stay in order.
+    """
+    start = time.perf_counter()
+    first_delta = True
+    try:
+        async with session.lock:
+            turn = start_turn(session, client_revision, operations)
+            session.state["conversation"] = user_input
+            local_reply = answer_locally(session, user_input)
+            if local_reply is not None:
+                yield sse_event("delta", {"text": local_reply})
+                final_state = await finish_turn(session, turn)
+                metrics.record_timing("chat.stream.total", time.perf_counter() - start)
+                yield sse_event("done", final_state)
+                return
+
+            await compact_history(session)
+            model = model_registry.get_chat_model()
+            chat_session = get_chat_session(model, session)
+            state_hash = budget_hash(session.state)
+            prompt = session.prompt_builder.build(session.state, user_input)
+
+            extractor = AiResponseExtractor()
+            chunks = []
+            try:
+                async for chunk in stream_chat_message(chat_session, prompt):
+                    chunks.append(chunk)
+                    delta = extractor.feed(chunk)
+                    if delta:
+                        if first_delta:
+                            first_delta = False
+                            metrics.record_timing("chat.stream.first_token", time.perf_counter() - start)
+                        yield sse_event("delta", {"text": delta})
+            except ModelOverloaded:
+                abort_turn(session, turn)
+                raise
+
+            await apply_ai_response(session.state, user_input, "".join(chunks), session.prompt_builder)
+            remember_reply(session, user_input, state_hash)
+            final_state = await finish_turn(session, turn)
+    except HTTPException as e:
+        error = {"status": e.status_code, "detail": e.detail}
+        if isinstance(e, ModelOverloaded):
+            error["retry_after"] = e.retry_after
+        yield sse_event("error", error)
+        return
     except Exception as e:
-        log_message(f"DEBUG: Exception encountered: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
+        log.error("Chat stream failed", error=str(e))
+        # The chat history may hold a half-finished turn; rebuild it on the next request.
+        session.chat = None
+        session.prompt_builder = None
+        yield sse_event("error", {"detail": f"Error processing chat: {str(e)}"})
+        return
+    metrics.record_timing("chat.stream.total", time.perf_counter() - start)
+    yield sse_event("done", final_state)
+
+
 @app.post("/receipt")
 async def process_receipt(
     receipt: UploadFile = File(...),
-    current_state: str = Form(...),
-    command: Optional[str] = Form(None)#,
-    #user: dict = Depends(get_current_user)
+    current_state: Optional[str] = Form(None),
+    command: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    budget_id: Optional[str] = Form(None),
+    revision: Optional[int] = Form(None),
+    user: dict = Depends(get_optional_user),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    log_message("DEBUG: /receipt endpoint hit")
-    temp_file_path = None
+    """
+    Add a receipt photo to the budget. A retry sent with the same Idempotency-Key header
+    gets the first attempt's response instead of adding the receipt again.
+    """
+    image_buffer = await read_upload(receipt, settings.RECEIPT_MAX_BYTES)
+    log.debug("Receipt uploaded", bytes=image_buffer.getbuffer().nbytes)
+    if idempotency_key:
+        # Keyed on the image bytes: a retry with a different photo must not replay this one.
+        request_fingerprint = fingerprint("/receipt", current_state, command, session_id, budget_id, revision,
+                                          content_key(image_buffer.getbuffer()))
+        return await idempotent_response(user, idempotency_key, request_fingerprint, lambda: receipt_turn(
+            image_buffer, current_state, command, session_id, budget_id, revision, user))
+    return JSONResponse(content=await receipt_turn(image_buffer, current_state, command, session_id, budget_id,
+                                                   revision, user))
+
+
+async def receipt_turn(image_buffer: io.BytesIO, current_state: Optional[str], command: Optional[str],
+                       session_id: Optional[str], budget_id: Optional[str], revision: Optional[int],
+                       user: dict) -> Dict[str, Any]:
+    log.debug("Receipt endpoint hit")
     try:
-        log_message("DEBUG: Received current_state (raw): " + current_state)
+        if current_state:
+            log.debug("Received current_state", current_state=current_state)
         if command:
-            log_message("DEBUG: Received command: " + command)
-        
-        # Convert JSON string to dict
-        state_data = json.loads(current_state)
+            log.debug("Received command", command=command)
         
         # Parse the JSON string from the form field into a dict.
-        state_data = json.loads(current_state)
-        
-        # Save the uploaded file temporarily
-        temp_file_path = f"temp_{receipt.filename}"
-        contents = await receipt.read()
-        
-        log_message(f"DEBUG: Receipt Size: {len(contents)} bytes")
-        
-        with open(receipt.filename, 'wb') as f:
-            f.write(contents)
-        
-        with open(temp_file_path, "wb") as buffer:
-            buffer.write(contents)
-        
-        log_message(f"DEBUG: Temporary file saved: {temp_file_path}")
-        
-        # Open the image and convert it to a stream
-        with Image.open(temp_file_path) as img:
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-        
-        log_message("DEBUG: Image converted to byte stream")
-        
-        # Extract text from the image stream
-        receipt_text = extract_text_from_image_stream(img_byte_arr)
+        state_data = json.loads(current_state) if current_state else None
+        session = await resolve_session(user["uid"], session_id, budget_id, state_data)
+
+        async with workers.receipt_slots():
+            # Decode once from memory, OCR and parse with the receipt model,
+            # or take the result from the receipt cache for a repeated upload.
+            receipt_text = await read_receipt(image_buffer)
         
-        log_message(f"DEBUG: Extracted receipt_text (raw): {receipt_text}")
+        log.debug("Extracted receipt text", receipt_text=receipt_text)
         
         if isinstance(receipt_text, bytes):
             receipt_text = receipt_text.decode('utf-8', errors='replace')
-            log_message(f"DEBUG: Decoded receipt_text: {receipt_text}")
-        else:
-            log_message("DEBUG: receipt_text is already a string")
+            log.debug("Decoded receipt text", receipt_text=receipt_text)
+
+        local_receipt = load_local_receipt(receipt_text)
+        if local_receipt is not None:
+            # The local parser was confident: add the receipt without a model round-trip.
+            async with session.lock:
+                turn = start_turn(session, revision)
+                add_local_receipts(session.state, [local_receipt])
+                return await finish_turn(session, turn)
 
         # Combine the OCR text with any extra instructions:
         additional_subprompt = "\nPlease add the above receipt items as budget items."
         full_prompt = receipt_text + additional_subprompt
 
-        # Put it into the conversation key so the helper sees it as "user input"
-        state_data["conversation"] = full_prompt
-        
-        # Call the chat logic function
-        updated_state = process_chat_logic(state_data, state_data["conversation"])
+        async with session.lock:
+            turn = start_turn(session, revision)
+            # Put it into the conversation key so the helper sees it as "user input"
+            session.state["conversation"] = full_prompt
 
-        # Return the updated state
-        print(json.dumps(updated_state,indent=2))
-        updated_state = calculate_surplus(updated_state)
-        return JSONResponse(content=updated_state)
+            # Call the chat logic function on the session's live chat, compacted like /chat's
+            await compact_history(session)
+            model = model_registry.get_chat_model()
+            chat_session = get_chat_session(model, session)
+            await process_chat_logic(session.state, full_prompt, chat_session, session.prompt_builder)
 
+            # Return the updated state, or its changes
+            return await finish_turn(session, turn)
+
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
-        log_message("DEBUG: JSON decode error occurred")
+        log.warning("Invalid JSON in current_state")
         raise HTTPException(status_code=400, detail="Invalid JSON in current_state")
     except Exception as e:
-        log_message(f"DEBUG: Exception occurred: {str(e)}")
+        log.error("Receipt failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Error processing receipt: {str(e)}")
+
+
+@app.post("/receipts/batch")
+async def process_receipt_batch(
+    receipts: List[UploadFile] = File(...),
+    current_state: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    budget_id: Optional[str] = Form(None),
+    revision: Optional[int] = Form(None),
+    user: dict = Depends(get_optional_user)
+):
+    """
+    Process many receipt images in one request. OCR runs in parallel on the process pool,
+    the OCR texts are parsed by the receipt model in batches, and the budget is updated
+    with a single chat turn. Progress is streamed back as newline-delimited JSON events:
+    received, ocr, parsed and error per receipt, then done with the updated state.
+    """
+    log.debug("Receipt batch endpoint hit", files=len(receipts))
+    if len(receipts) > settings.RECEIPT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {settings.RECEIPT_BATCH_MAX_FILES} receipts per batch")
+    try:
+        state_data = json.loads(current_state) if current_state else None
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON in current_state")
+    session = await resolve_session(user["uid"], session_id, budget_id, state_data)
+
+    # Read every upload before streaming starts; the form's files are closed with the request.
+    uploads = []
+    for receipt in receipts:
+        uploads.append((receipt.filename, await read_upload(receipt, settings.RECEIPT_MAX_BYTES)))
+
+    return StreamingResponse(receipt_batch_events(session, uploads, revision), media_type="application/x-ndjson")
+
+
+async def receipt_batch_events(session: BudgetSession, uploads, client_revision: Optional[int] = None):
+    """
+    Async generator behind /receipts/batch. Yields one JSON line per event.
+    """
+    def event(**fields):
+        return json.dumps(fields) + "\n"
+
+    async def ocr_one(index, filename, buffer):
+        try:
+            key = content_key(buffer.getbuffer())
+            entry = receipt_cache.get(key)
+            if entry is not None and (entry["parsed"] or entry["ocr_text"]):
+                return {"index": index, "filename": filename, "key": key, "cached": True,
+                        "ocr_text": entry["ocr_text"], "parsed": entry["parsed"]}
+            ocr_text, phash = await workers.run_in_process(ocr_receipt_bytes, buffer.getvalue())
+            parsed = parse_locally(ocr_text)
+            receipt_cache.put(key, phash, ocr_text=ocr_text, parsed=parsed)
+            return {"index": index, "filename": filename, "key": key, "cached": False,
+                    "ocr_text": ocr_text, "parsed": parsed}
+        except Exception as e:
+            return {"index": index, "filename": filename, "error": str(e)}
+
+    async def parse_batch(batch):
+        try:
+            parsed_texts = await ai_filter_receipt_texts_async([result["ocr_text"] for result in batch])
+        except Exception as e:
+            return [dict(result, error=str(e)) for result in batch]
+        for result, parsed in zip(batch, parsed_texts):
+            receipt_cache.put(result["key"], parsed=parsed)
+            result["parsed"] = parsed
+        return batch
+
+    def parsed_event(result):
+        try:
+            receipt = json.loads(result["parsed"])
+        except (TypeError, ValueError):
+            receipt = result["parsed"]
+        return event(event="parsed", index=result["index"], filename=result["filename"], receipt=receipt)
+
+    yield event(event="received", count=len(uploads))
+
+    parsed_results = []
+    parse_tasks = []
+    to_parse = []
+    async with workers.receipt_slots():
+        ocr_tasks = [asyncio.ensure_future(ocr_one(i, name, buffer)) for i, (name, buffer) in enumerate(uploads)]
+        for next_done in asyncio.as_completed(ocr_tasks):
+            result = await next_done
+            if "error" in result:
+                yield event(event="error", stage="ocr", index=result["index"], filename=result["filename"], detail=result["error"])
+                continue
+            yield event(event="ocr", index=result["index"], filename=result["filename"], cached=result["cached"])
+            if result["parsed"]:
+                parsed_results.append(result)
+                yield parsed_event(result)
+                continue
+            # Start parsing as soon as a full batch of OCR texts is ready.
+            to_parse.append(result)
+            if len(to_parse) >= settings.RECEIPT_BATCH_LLM_SIZE:
+                parse_tasks.append(asyncio.ensure_future(parse_batch(to_parse)))
+                to_parse = []
+        if to_parse:
+            parse_tasks.append(asyncio.ensure_future(parse_batch(to_parse)))
+
+    for next_done in asyncio.as_completed(parse_tasks):
+        for result in await next_done:
+            if "error" in result:
+                yield event(event="error", stage="parse", index=result["index"], filename=result["filename"], detail=result["error"])
+            else:
+                parsed_results.append(result)
+                yield parsed_event(result)
+
+    if not parsed_results:
+        yield event(event="done", error="No receipts could be processed", session_id=session.session_id)
+        return
+
+    # Confident local parses are added directly; one chat turn adds all the other receipts.
+    parsed_results.sort(key=lambda result: result["index"])
+    local_receipts = []
+    model_results = []
+    for result in parsed_results:
+        local_receipt = load_local_receipt(result["parsed"])
+        if local_receipt is not None:
+            local_receipts.append(local_receipt)
+        else:
+            model_results.append(result)
+    try:
+        async with session.lock:
+            turn = start_turn(session, client_revision)
+            if local_receipts:
+                add_local_receipts(session.state, local_receipts)
+            if model_results:
+                full_prompt = "\n\n".join(result["parsed"] for result in model_results)
+                full_prompt += "\nPlease add the above receipt items as budget items."
+                session.state["conversation"] = full_prompt
+                await compact_history(session)
+                model = model_registry.get_chat_model()
+                chat_session = get_chat_session(model, session)
+                await process_chat_logic(session.state, full_prompt, chat_session, session.prompt_builder)
+            final_state = await finish_turn(session, turn)
+    except ModelOverloaded as e:
+        yield event(event="error", stage="chat", status=e.status_code, detail=e.detail, retry_after=e.retry_after)
+        yield event(event="done", error="The assistant is busy; try again shortly", session_id=session.session_id)
+        return
+    except Exception as e:
+        log.error("Receipt batch failed", error=str(e))
+        yield event(event="error", stage="chat", detail=str(e))
+        yield event(event="done", error="Error updating the budget", session_id=session.session_id)
+        return
+    yield event(event="done", state=final_state)
+
+
+def load_local_receipt(receipt_text) -> Optional[Dict[str, Any]]:
+    """
+    Return the receipt dict if receipt_text is a confident local parse (see receipt_parser), else None.
+    """
+    try:
+        receipt = json.loads(receipt_text)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(receipt, dict) and receipt_parser.is_confident(receipt, settings.RECEIPT_LOCAL_PARSE_MIN_CONFIDENCE):
+        return receipt
+    return None
+
+
+def add_local_receipts(state_dict: Dict[str, Any], receipts) -> Dict[str, Any]:
+    """
+    Add locally parsed receipts to the budget without a chat turn, with a templated reply.
+    The prompt builder is not committed, so the next chat prompt tells the model about the new items.
+    """
+    budget = state_dict["Budget"]
+    added = [item for receipt in receipts for item in receipt_parser.to_budget_items(receipt)]
+    budget["items"], _ = apply_operations(budget.setdefault("items", []), [{"op": "add", "item": item} for item in added])
+    metrics.incr("receipt_parser.local_applied", len(receipts))
+
+    summary = ", ".join(f"{item['item_name']} (${item['amount']:.2f}, {item['category']})" for item in added)
+    user_message = "Please add the above receipt items as budget items."
+    state_dict["conversation"] = user_message
+    budget.setdefault("conversations", []).append({
+        "user_message": user_message,
+        "ai_response": f"I added {summary} to your budget. How else can I help with your budget?",
+    })
+    return calculate_surplus(state_dict)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> io.BytesIO:
+    """
+    Stream an upload into a single in-memory buffer in chunks, enforcing a size limit.
+    The upload is closed afterwards so its own buffer can be freed.
+    """
+    buffer = io.BytesIO()
+    try:
+        with metrics.timer("receipt.upload_read"):
+            while True:
+                chunk = await upload.read(settings.UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if buffer.tell() + len(chunk) > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Receipt upload larger than {max_bytes} bytes")
+                buffer.write(chunk)
     finally:
-        # Cleanup temp file if desired
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            log_message(f"DEBUG: Temporary file deleted: {temp_file_path}")
+        await upload.close()
+    if buffer.tell() == 0:
+        raise HTTPException(status_code=400, detail="Empty receipt upload")
+    buffer.seek(0)
+    return buffer
 
 
-def process_chat_logic(state_dict: Dict[str, Any], user_input: str) -> Dict[str, Any]:
+async def process_chat_logic(state_dict: Dict[str, Any], user_input: str, chat_session=None,
+                       prompt_builder: Optional[PromptBuilder] = None) -> Dict[str, Any]:
     """
     This function replicates the AI chat flow without requiring a FastAPI route.
     - state_dict: Current state of the Budget & conversation (dict).
     - user_input: The new user message to add to the conversation.
+    - chat_session: A live chat session (e.g. from the session store). When omitted,
+      one is rebuilt from the conversation history in state_dict.
+    - prompt_builder: The builder that belongs to chat_session. Must be given together with it.
 
     Returns:
         An updated `state_dict` with the AI response appended to .Budget.conversations.
     """
-    # 1. Configure the model
-    model = configure_genai()
+    # 1. Configure the model and 2. build or rebuild the chat session if the caller has none
+    if chat_session is None:
+        model = model_registry.get_chat_model()
+        chat_session = start_chat_session(model, state_dict)
+        prompt_builder = PromptBuilder(compare_legacy=settings.PROMPT_COMPARE_LEGACY)
 
-    # 2. Build or rebuild the chat session
-    if not state_dict["Budget"].get("conversations"):
-        # No existing conversation, so initialize
-        chat_session = initialize_chat(model, state_dict)
-    else:
-        # Rebuild from previous conversation
-        chat_history = []
-        for conversation in state_dict["Budget"]["conversations"]:
-            chat_history.append({
-                "role": "user",
-                "parts": [{"text": conversation.get("user_message", "")}]
-            })
-            chat_history.append({
-                "role": "model",
-                "parts": [{"text": conversation.get("ai_response", "")}]
-            })
-
-        # Now add the new user input
-        chat_history.append({
-            "role": "user",
-            "parts": [{"text": user_input}]
-        })
-
-        chat_session = model.start_chat(history=chat_history)
-
-    # 3. Generate the prompt
-    prompt = generate_prompt(state_dict, user_input)
+    # 3. Generate the prompt (only the state the chat has not seen yet)
+    prompt = prompt_builder.build(state_dict, user_input)
 
     # 4. Send the prompt to the model
-    response = chat_session.send_message(prompt)
-    ai_response = response.text
+    ai_response = await send_chat_message(chat_session, prompt)
+    return await apply_ai_response(state_dict, user_input, ai_response, prompt_builder)
 
-    # 5. Parse AI response
-    try:
-        parsed_ai_response = json.loads(ai_response)
-    except json.JSONDecodeError:
-        parsed_ai_response = {"ai_response": ai_response}
+
+async def apply_ai_response(state_dict: Dict[str, Any], user_input: str, ai_response: str,
+                            prompt_builder: PromptBuilder) -> Dict[str, Any]:
+    """
+    Steps 5-10 of process_chat_logic: parse the model's reply text and merge it into state_dict.
+    Shared with the streaming endpoint, which collects the reply text itself.
+    """
+    # 5. Parse, repair and validate the AI response; a reply that cannot be fixed changes nothing
+    parsed_ai_response = await parse_chat_reply(ai_response) or {}
 
     # 6. Extract conversation AI reply
     if (
@@ -381,57 +1120,32 @@ def process_chat_logic(state_dict: Dict[str, Any], user_input: str) -> Dict[str,
         "ai_response": ai_reply
     })
 
-    # 8. Check for updated budget items
-    if ("Budget" in parsed_ai_response 
-        and isinstance(parsed_ai_response["Budget"], dict) 
-        and "items" in parsed_ai_response["Budget"]):
-        state_dict["Budget"]["items"] = parsed_ai_response["Budget"]["items"]
+    # 8. Apply the model's item operations (or, if it sent a whole items list anyway, take that)
+    budget_reply = parsed_ai_response.get("Budget")
+    if isinstance(budget_reply, dict) and isinstance(budget_reply.get("operations"), list):
+        items, problems = apply_operations(state_dict["Budget"].get("items") or [], budget_reply["operations"])
+        if problems:
+            metrics.incr("budget_delta.skipped_operations", len(problems))
+            log.warning("Skipped invalid item operations from the model", problems=problems)
+        state_dict["Budget"]["items"] = items
+    elif isinstance(budget_reply, dict) and isinstance(budget_reply.get("items"), list):
+        state_dict["Budget"]["items"] = ensure_item_ids(budget_reply["items"])
+
+    # 9. Check budget limit, keeping the current one if the model left it out
+    if isinstance(parsed_ai_response.get("Budget"), dict) and "budget_limit" in parsed_ai_response["Budget"]:
+        state_dict["Budget"]["budget_limit"] = parsed_ai_response["Budget"]["budget_limit"]
 
-    # 9. Check budget limit
-    state_dict["Budget"]["budget_limit"] = parsed_ai_response.get("Budget", {}).get("budget_limit")
+    # 10. Remember what the model now knows, so the next prompt only carries changes
+    prompt_builder.commit(state_dict)
 
     # Return the updated state
     return state_dict
 
 
-def parse_receipt_text(text):
-    """
-    Parses the OCR-extracted text from a receipt.
-    Assumes each line with an item has a format like:
-      ItemName  <whitespace> $Cost
-    Returns a list of budget items.
-    """
-    items = []
-    lines = text.splitlines()
-    # Regular expression to capture an item name and a cost.
-    pattern = re.compile(r'(.+?)\s+\$?(\d+\.\d{2})')
-    
-    for line in lines:
-        match = pattern.search(line)
-        if match:
-            item_name = match.group(1).strip()
-            try:
-                amount = float(match.group(2))
-            except ValueError:
-
-                continue  # Skip lines that don't parse correctly
-            # Append the item to the list; adjust additional fields as needed.
-
-            items.append({
-                "item_name": item_name,
-                "amount": amount,
-                "category": "Receipt",
-                "importance_rank": None,
-                "recurrence_schedule": None,
-                "due_date": None
-            })
-    return items
-
-
 if __name__ == "__main__":
     # Make sure the static directory exists
     if not os.path.exists("static"):
         os.makedirs("static")
     
-    # Start the server
+    # Start a single-worker development server; production runs through serve.py.
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
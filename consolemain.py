@@ -1,13 +1,104 @@
 import os
-import json,re
+import json
 import google.generativeai as genai
 
 
-def load_config():
+# Generation settings for the budget chat model.
+CHAT_MODEL_NAME = "gemini-2.0-flash-exp"
+CHAT_GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    # "max_output_tokens": 8192 * 64,
+    "response_mime_type": "application/json",
+}
+
+
+# Response schema the model must follow. Kept as a module constant so it is built once.
+STRICT_SCHEMA = """
+{
+    "title": "BudgetRequest",
+    "type": "object",
+    "properties": {
+        "Budget": {
+            "title": "Budget",
+            "type": "object",
+            "properties": {
+                "budget_limit": {"type": "number"},
+                "budget_surplus": {"type": "number"},
+                "items": {
+                    "title": "items",
+                    "type": "array",
+                    "items": {
+                        "title": "BudgetItem",
+                        "type": "object",
+                        "properties": {
+                            "item_name": {"type": "string"},
+                            "amount": {"type": "number"},
+                            "category": {"type": "string"},
+                            "importance_rank": {
+                                "type": "integer",
+                                "enum": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+                                "enumNames": [
+                                    "Negligible",
+                                    "Very Low",
+                                    "Low",
+                                    "Moderate Low",
+                                    "Moderate",
+                                    "Moderate High",
+                                    "High",
+                                    "Very High",
+                                    "Critical",
+                                    "Essential"
+                                ]
+                            },
+                            "recurrence_schedule": {"type": ["string", "null"]},
+                            "due_date": {"type": ["number", "null"]}
+                        },
+                        "required": [
+                            "item_name",
+                            "amount",
+                            "category",
+                            "importance_rank"
+                        ]
+                    }
+                },
+                "warnings": {"type": "array", "items": {"type": "string"}},
+                "conversations": {
+                    "title": "Conversations",
+                    "type": "array",
+                    "items": {
+                        "title": "dialogue",
+                        "type": "object",
+                        "properties": {
+                            "user_message": {"type": "string"},
+                            "ai_response": {"type": "string"}
+                        },
+                        "required": ["user_message", "ai_response"]
+                    }
+                }
+            },
+            "required": ["budget_limit", "budget_surplus", "items", "warnings", "conversations"]
+        },
+        "conversation": {
+            "title": "Conversation",
+            "type": "object",
+            "properties": {
+                "user_message": {"type": "string", "title": "User Message"},
+                "ai_response": {"type": "string", "title": "AI Response"}
+            },
+            "required": ["user_message", "ai_response"]
+        }
+    },
+    "required": ["Budget"]
+}
+"""
+
+
+def load_config(config_path="config.json"):
     """
     Load API keys and other configurations from config.json.
     """
-    config_path = "config.json"
     if not os.path.exists(config_path):
         raise FileNotFoundError(
             f"{config_path} not found. Please create the file with the necessary configurations."
@@ -21,85 +112,7 @@ def generate_prompt(previous_budget: dict, user_input: str):
     Create a prompt for Google Generative AI based on the previous budget and user input.
     This improved version is more robust against prompt engineering and strictly adheres to the schema.
     """
-    # Define strict schema inline to prevent any modification attempts
-    strict_schema = """
-    {
-        "title": "BudgetRequest",
-        "type": "object",
-        "properties": {
-            "Budget": {
-                "title": "Budget",
-                "type": "object",
-                "properties": {
-                    "budget_limit": {"type": "number"},
-                    "budget_surplus": {"type": "number"},
-                    "items": {
-                        "title": "items",
-                        "type": "array",
-                        "items": {
-                            "title": "BudgetItem",
-                            "type": "object",
-                            "properties": {
-                                "item_name": {"type": "string"},
-                                "amount": {"type": "number"},
-                                "category": {"type": "string"},
-                                "importance_rank": {
-                                    "type": "integer",
-                                    "enum": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-                                    "enumNames": [
-                                        "Negligible",
-                                        "Very Low",
-                                        "Low",
-                                        "Moderate Low",
-                                        "Moderate",
-                                        "Moderate High",
-                                        "High",
-                                        "Very High",
-                                        "Critical",
-                                        "Essential"
-                                    ]
-                                },
-                                "recurrence_schedule": {"type": ["string", "null"]},
-                                "due_date": {"type": ["number", "null"]}
-                            },
-                            "required": [
-                                "item_name",
-                                "amount",
-                                "category",
-                                "importance_rank"
-                            ]
-                        }
-                    },
-                    "warnings": {"type": "array", "items": {"type": "string"}},
-                    "conversations": {
-                        "title": "Conversations",
-                        "type": "array",
-                        "items": {
-                            "title": "dialogue",
-                            "type": "object",
-                            "properties": {
-                                "user_message": {"type": "string"},
-                                "ai_response": {"type": "string"}
-                            },
-                            "required": ["user_message", "ai_response"]
-                        }
-                    }
-                },
-                "required": ["budget_limit", "budget_surplus", "items", "warnings", "conversations"]
-            },
-            "conversation": {
-                "title": "Conversation",
-                "type": "object",
-                "properties": {
-                    "user_message": {"type": "string", "title": "User Message"},
-                    "ai_response": {"type": "string", "title": "AI Response"}
-                },
-                "required": ["user_message", "ai_response"]
-            }
-        },
-        "required": ["Budget"]
-    }
-    """
+    strict_schema = STRICT_SCHEMA
     
     # Sanitize previous budget to prevent JSON injection
     sanitized_budget = str(json.dumps(previous_budget, indent=2)).replace('{', '{{').replace('}', '}}')
@@ -202,17 +215,9 @@ def configure_genai():
     config = load_config()
     genai.configure(api_key=config["GEMINI_API_KEY"])
 
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 40,
-        # "max_output_tokens": 8192 * 64,
-        "response_mime_type": "application/json",
-    }
-
     model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash-exp",
-        generation_config=generation_config,
+        model_name=CHAT_MODEL_NAME,
+        generation_config=CHAT_GENERATION_CONFIG,
     )
     return model
 
@@ -285,36 +290,6 @@ def send_one_chat(current_state):
             #print("\nExiting chat. Goodbye!")
             break
 
-def parse_receipt_text(text):
-    """
-    Parses the OCR-extracted text from a receipt.
-    Assumes each line with an item has a format like:
-      ItemName  <whitespace> $Cost
-    Returns a list of budget items.
-    """
-    items = []
-    lines = text.splitlines()
-    # Regular expression to capture an item name and a cost.
-    pattern = re.compile(r'(.+?)\s+\$?(\d+\.\d{2})')
-    
-    for line in lines:
-        match = pattern.search(line)
-        if match:
-            item_name = match.group(1).strip()
-            try:
-                amount = float(match.group(2))
-            except ValueError:
-                continue  # Skip lines that don’t parse correctly
-            items.append({
-                "item_name": item_name,
-                "amount": amount,
-                "category": "Receipt",
-                "importance_rank": None,
-                "recurrence_schedule": None,
-                "due_date": None
-            })
-    return items
-
 def main():
     """
     Main function to execute the budgeting assistant.
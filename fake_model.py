@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from prompt_builder import estimate_tokens
+
+# Replies used when there is no recording for a role. The chat reply changes nothing, so a
+# benchmark's budget stays the size it started at.
+DEFAULT_REPLIES = {
+    "chat": json.dumps({
+        "conversation": {"user_message": "", "ai_response": "Here is an overview of your budget. Your largest "
+                         "costs are housing and groceries; trimming subscriptions would free up some room. "
+                         "Is there anything else I can do for you?"},
+        "Budget": {"operations": []},
+    }),
+    "receipt": json.dumps({
+        "items": [{"name": "Groceries", "price": 42.17, "quantity": 1, "category": "Groceries"}],
+        "tax": 2.11, "total": 44.28, "date": "2025-01-15",
+    }),
+    "generate": json.dumps({"summary": "The user is reviewing their monthly budget and looking for savings."}),
+}
+
+
+def _key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _text(content: Any) -> str:
+    """
+    Text of a prompt or history entry in any of the shapes the SDK accepts.
+    """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return "".join(_text(part) for part in content.get("parts", [])) if "parts" in content else str(content.get("text", ""))
+    if isinstance(content, (list, tuple)):
+        return "".join(_text(part) for part in content)
+    return str(getattr(content, "text", "") or "")
+
+
+class Recordings:
+    """
+    Model replies recorded from live traffic (see model_client.record), one JSON object
+    per line: {"role", "prompt_sha256", "text"}. A prompt recorded before gets its own reply
+    back; any other prompt gets the role's recorded replies in turn.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.by_prompt: Dict[str, str] = {}
+        self.by_role: Dict[str, List[str]] = {}
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.by_prompt[record["prompt_sha256"]] = record["text"]
+                        self.by_role.setdefault(record["role"], []).append(record["text"])
+        self._cycles = {role: itertools.cycle(texts) for role, texts in self.by_role.items()}
+        self._lock = threading.Lock()
+
+    def reply(self, role: str, prompt: str) -> str:
+        text = self.by_prompt.get(_key(prompt))
+        if text is not None:
+            return text
+        with self._lock:
+            cycle = self._cycles.get(role)
+            return next(cycle) if cycle is not None else DEFAULT_REPLIES.get(role, DEFAULT_REPLIES["chat"])
+
+
+class FakeQuota:
+    """
+    Requests-per-minute quota shared by the fake models, like a project's Gemini quota: a
+    call over it fails with ResourceExhausted (429), so rate-limit handling can be load tested.
+    """
+
+    def __init__(self, requests_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def check(self):
+        if not self.requests_per_minute:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._calls and self._calls[0] <= now - 60:
+                self._calls.popleft()
+            if len(self._calls) >= self.requests_per_minute:
+                raise google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+            self._calls.append(now)
+
+
+class FakeResponse:
+    """
+    Stands in for a GenerateContentResponse: .text, and async iteration over chunks
+    when it was requested with stream=True.
+    """
+
+    def __init__(self, text: str, chunks: Optional[List[str]] = None, chunk_delay: float = 0.0, on_done=None):
+        self.text = text
+        self._chunks = chunks or [text]
+        self._chunk_delay = chunk_delay
+        self._on_done = on_done
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._chunk_delay)
+            yield FakeResponse(chunk)
+        if self._on_done is not None:
+            self._on_done(self.text)
+
+
+class FakeModel:
+    """
+    Offline stand-in for genai.GenerativeModel with the same calls the app makes
+    (start_chat, generate_content_async). Replies come from recordings, and each call takes
+    about as long as a real one would: first_token_seconds, plus the prompt and history
+    at prefill_tokens_per_second, plus the reply at tokens_per_second. No network access.
+    Calls over the quota fail the way Gemini's do.
+    """
+
+    def __init__(self, role: str, recordings: Recordings, first_token_seconds: float = 0.4,
+                 tokens_per_second: float = 150.0, prefill_tokens_per_second: float = 20000.0,
+                 quota: Optional[FakeQuota] = None):
+        self.role = role
+        self.model_name = f"fake/{role}"
+        self.recordings = recordings
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.quota = quota or FakeQuota()
+        self.calls = 0
+
+    def start_chat(self, history=None) -> "FakeChat":
+        return FakeChat(self, list(history or []))
+
+    def _prefill_seconds(self, text: str) -> float:
+        return estimate_tokens(text) / self.prefill_tokens_per_second if self.prefill_tokens_per_second else 0.0
+
+    def _decode_seconds(self, text: str) -> float:
+        return estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _reply(self, role: str, prompt: str, context: str = ""):
+        self.quota.check()
+        self.calls += 1
+        text = self.recordings.reply(role, prompt)
+        delay = self.first_token_seconds + self._prefill_seconds(context + prompt)
+        return text, delay
+
+    async def _respond(self, role: str, prompt: str, context: str, stream: bool, on_done=None) -> FakeResponse:
+        text, delay = self._reply(role, prompt, context)
+        if not stream:
+            await asyncio.sleep(delay + self._decode_seconds(text))
+            if on_done is not None:
+                on_done(text)
+            return FakeResponse(text)
+        await asyncio.sleep(delay)
+        # Chunks of about 20 tokens, like the SDK's stream.
+        chunks = [text[start:start + 80] for start in range(0, len(text), 80)] or [""]
+        return FakeResponse(text, chunks, self._decode_seconds(chunks[0]), on_done)
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs) -> FakeResponse:
+        return await self._respond("generate", _text(prompt), "", stream)
+
+    def generate_content(self, prompt, **kwargs) -> FakeResponse:
+        text, delay = self._reply("generate", _text(prompt))
+        time.sleep(delay + self._decode_seconds(text))
+        return FakeResponse(text)
+
+
+class FakeChat:
+    """
+    Chat session of a FakeModel. Keeps its history like the SDK's ChatSession, and the whole
+    history counts towards each call's prefill time.
+    """
+
+    def __init__(self, model: FakeModel, history: List[Any]):
+        self.model = model
+        self.history = history
+
+    def _context(self) -> str:
+        return "".join(_text(entry) for entry in self.history)
+
+    def _remember(self, prompt: str, text: str):
+        self.history += [{"role": "user", "parts": [{"text": prompt}]}, {"role": "model", "parts": [{"text": text}]}]
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs) -> FakeResponse:
+        prompt = _text(content)
+        return await self.model._respond(self.model.role, prompt, self._context(), stream,
+                                         on_done=lambda text: self._remember(prompt, text))
+
+    def send_message(self, content, **kwargs) -> FakeResponse:
+        prompt = _text(content)
+        text, delay = self.model._reply(self.model.role, prompt, self._context())
+        time.sleep(delay + self.model._decode_seconds(text))
+        self._remember(prompt, text)
+        return FakeResponse(text)
@@ -1,36 +1,243 @@
 import os
 import json
+import asyncio
+import base64
+import hashlib
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth, credentials, initialize_app
+from firebase_admin import credentials, initialize_app
+from google.auth import jwt
+
+import settings
+from metrics import metrics
 
 # Initialize Firebase Admin with your project credentials
 # You'll need to download your Firebase service account key from the Firebase Console
 # Save it as firebase_credentials.json
 cred_path = "firebase_credentials.json"
+project_id = settings.FIREBASE_PROJECT_ID
 
 if os.path.exists(cred_path):
     cred = credentials.Certificate(cred_path)
     firebase_app = initialize_app(cred)
+    project_id = project_id or cred.project_id
 else:
     print("WARNING: Firebase credentials not found. Auth verification will fail.")
 
 # Security scheme for token verification
 security = HTTPBearer()
 
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class KeySet:
+    """
+    The public certificates Firebase ID tokens are signed with, by key id.
+    Fetched from Google (or read from a local JSON file of {kid: PEM certificate}, to test
+    offline) and refreshed by a background thread before the Cache-Control max-age runs
+    out, so requests never wait on the fetch. A token signed with an unknown key id
+    triggers one early refresh, rate-limited to one per min_refresh_interval seconds.
+    """
+
+    def __init__(self, url: str, path: Optional[str] = None, min_refresh_interval: float = 60.0):
+        self.url = url
+        self.path = path
+        self.min_refresh_interval = min_refresh_interval
+        self.certs: Dict[str, str] = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _fetch(self) -> Tuple[Dict[str, str], float]:
+        if self.path:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f), 3600.0
+        with urllib.request.urlopen(self.url, timeout=10) as response:
+            max_age = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+            return json.loads(response.read()), float(max_age.group(1)) if max_age else 3600.0
+
+    def refresh(self) -> bool:
+        """
+        Fetch the certificates now. On failure the previous ones are kept.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                certs, max_age = self._fetch()
+            except Exception:
+                self.failures += 1
+                metrics.incr("auth.key_refresh_errors")
+                return False
+            self.certs = certs
+            self.fetched_at = time.time()
+            self.expires_at = self.fetched_at + max_age
+            self.refreshes += 1
+            metrics.record_timing("auth.key_refresh", time.perf_counter() - start)
+            return True
+
+    def get(self, key_id: Optional[str]) -> Dict[str, str]:
+        """
+        Certificates to verify a token signed with key_id. Blocking when nothing has been
+        fetched yet or the key is unknown, so call it off the event loop.
+        """
+        if not self.certs or (key_id not in self.certs and time.time() - self.fetched_at > self.min_refresh_interval):
+            self.refresh()
+        return self.certs
+
+    def start(self):
+        """
+        Prefetch the certificates and keep them fresh from a daemon thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._run, name="auth-keys", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._wake.is_set():
+            if self.refresh():
+                # Refresh at 90% of the lifetime, so the old keys never expire first.
+                delay = max(self.min_refresh_interval, (self.expires_at - time.time()) * 0.9)
+            else:
+                delay = self.min_refresh_interval
+            self._wake.wait(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": len(self.certs), "expires_in": round(max(0.0, self.expires_at - time.time())),
+                "refreshes": self.refreshes, "failures": self.failures}
+
+
+class TokenCache:
+    """
+    Verified ID tokens by SHA-256 of the token, each kept until the token's own exp.
+    A repeat caller costs one dict lookup instead of a signature check. LRU-bounded.
+    revoke() signs a user out of this worker: their cached tokens are dropped and tokens
+    issued before it are refused, even though their signature and exp are still valid.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, expires_at: float, user: Dict[str, Any]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def revoke(self, uid: str, at: Optional[float] = None):
+        """
+        Refuse uid's tokens issued before at (default now) and forget the cached ones.
+        Whole seconds, like iat and Firebase's own tokensValidAfterTime, so a token issued
+        right after signing out is accepted.
+        """
+        with self._lock:
+            self._revoked[uid] = int(time.time() if at is None else at)
+            for key in [key for key, (_, user) in self._entries.items() if user.get("uid") == uid]:
+                del self._entries[key]
+
+    def is_revoked(self, uid: str, issued_at: float) -> bool:
+        revoked_at = self._revoked.get(uid)
+        return revoked_at is not None and issued_at < revoked_at
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "revoked_users": len(self._revoked)}
+
+
+key_set = KeySet(settings.AUTH_CERTS_URL, settings.AUTH_CERTS_PATH)
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+
+def _key_id(token: str) -> Optional[str]:
+    header = token.split(".", 1)[0]
+    return json.loads(base64.urlsafe_b64decode(header + "=" * (-len(header) % 4))).get("kid")
+
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """
+    Check a Firebase ID token's signature and claims, the same checks as
+    firebase_admin.auth.verify_id_token (without the revocation lookup).
+    Blocking: run it on a worker thread.
+    """
+    if not project_id:
+        raise ValueError("No Firebase project id; add firebase_credentials.json or set BUDGIT_FIREBASE_PROJECT_ID")
+    start = time.perf_counter()
+    claims = jwt.decode(token, certs=key_set.get(_key_id(token)), audience=project_id)
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise ValueError("Token has an unexpected issuer")
+    subject = claims.get("sub")
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise ValueError("Token has an invalid subject")
+    metrics.record_timing("auth.verify", time.perf_counter() - start)
+    return claims
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
     Verify Firebase ID token and return the user.
     This can be used as a dependency in FastAPI routes.
+    Tokens seen before are answered from token_cache; new ones are verified off the event loop.
     """
     token = credentials.credentials
+    key = TokenCache.key(token)
+    user = token_cache.get(key)
+    if user is not None:
+        return user
     try:
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token.get("uid")
-        return {"uid": uid, "email": decoded_token.get("email")}
+        # Not on the OCR pool: a burst of receipts must not hold up sign-ins.
+        decoded_token = await asyncio.to_thread(verify_token, token)
     except Exception as e:
+        metrics.incr("auth.rejected")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+    if token_cache.is_revoked(decoded_token["sub"], float(decoded_token.get("iat") or 0)):
+        metrics.incr("auth.rejected")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials: token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user = {"uid": decoded_token.get("sub"), "email": decoded_token.get("email")}
+    token_cache.put(key, float(decoded_token["exp"]), user)
+    return user
@@ -0,0 +1,155 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import settings
+from metrics import metrics
+from model_client import generate_text
+from model_registry import model_registry
+from prompt_builder import estimate_tokens, system_history
+from response_validator import parse_json_reply
+
+# Longest slice of one message that goes into a summary request or the local fallback summary.
+_SUMMARY_INPUT_CHARS = 600
+
+
+def turn_tokens(turn: Dict[str, Any]) -> int:
+    return estimate_tokens(str(turn.get("user_message", ""))) + estimate_tokens(str(turn.get("ai_response", "")))
+
+
+def build_chat_history(conversations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Convert stored conversation turns into Gemini chat history.
+    """
+    chat_history = []
+    for conversation in conversations:
+        chat_history.append({
+            "role": "user",
+            "parts": [{"text": conversation.get("user_message", "")}]
+        })
+        chat_history.append({
+            "role": "model",
+            "parts": [{"text": conversation.get("ai_response", "")}]
+        })
+    return chat_history
+
+
+def window_start(conversations: List[Dict[str, Any]], first: int = 0,
+                 max_turns: Optional[int] = None, token_budget: Optional[int] = None) -> int:
+    """
+    Index of the oldest turn (not before first) that fits in the verbatim window: at most
+    max_turns turns, newest first, within token_budget tokens.
+    """
+    max_turns = settings.HISTORY_RECENT_TURNS if max_turns is None else max_turns
+    token_budget = settings.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    start, tokens = len(conversations), 0
+    while start > first and len(conversations) - start < max_turns:
+        tokens += turn_tokens(conversations[start - 1])
+        if tokens > token_budget:
+            break
+        start -= 1
+    return start
+
+
+def chat_history(conversations: List[Dict[str, Any]], summary: Optional[str] = None,
+                 summarised_turns: int = 0) -> List[Dict[str, Any]]:
+    """
+    History for a new chat: the system turn, the running summary of older turns (if any)
+    and the turns after it verbatim. Turns beyond the window that have not been summarised
+    yet (e.g. a budget uploaded with a long history) are left out rather than replayed.
+    """
+    history = system_history()
+    if summary:
+        history += [
+            {"role": "user", "parts": [{"text": f"<SUMMARY_OF_EARLIER_CONVERSATION>\n{summary}\n"
+                                                "</SUMMARY_OF_EARLIER_CONVERSATION>"}]},
+            {"role": "model", "parts": [{"text": "Understood."}]},
+        ]
+    start = window_start(conversations, first=summarised_turns,
+                         max_turns=2 * settings.HISTORY_RECENT_TURNS)
+    return history + build_chat_history(conversations[start:])
+
+
+def needs_compaction(conversations: List[Dict[str, Any]], summarised_turns: int) -> bool:
+    """
+    True when the turns after the summary overflow the window: twice HISTORY_RECENT_TURNS
+    turns, or more than HISTORY_TOKEN_BUDGET tokens. Compacting back down to
+    HISTORY_RECENT_TURNS means the summary is rewritten only every few turns.
+    """
+    pending = conversations[summarised_turns:]
+    if len(pending) > 2 * settings.HISTORY_RECENT_TURNS:
+        return True
+    return sum(turn_tokens(turn) for turn in pending) > settings.HISTORY_TOKEN_BUDGET
+
+
+def _clip(text: Any) -> str:
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= _SUMMARY_INPUT_CHARS else text[:_SUMMARY_INPUT_CHARS] + "..."
+
+
+def local_summary(summary: Optional[str], turns: List[Dict[str, Any]]) -> str:
+    """
+    Fallback when the model cannot summarise: the previous summary plus the user's requests,
+    trimmed from the oldest end to HISTORY_SUMMARY_TOKENS.
+    """
+    lines = ([summary] if summary else []) + [f"User asked: {_clip(turn.get('user_message'))}" for turn in turns]
+    text = "\n".join(lines)
+    limit = settings.HISTORY_SUMMARY_TOKENS * 4
+    return text if len(text) <= limit else "..." + text[-limit:]
+
+
+async def summarise(summary: Optional[str], turns: List[Dict[str, Any]]) -> str:
+    """
+    Fold turns into the running summary with one short model call (no chat history).
+    Falls back to local_summary if the call fails or the reply has no summary.
+    """
+    transcript = "\n".join(
+        f"User: {_clip(turn.get('user_message'))}\nAssistant: {_clip(turn.get('ai_response'))}" for turn in turns
+    )
+    prompt = (
+        "Update the running summary of a budgeting chat with the new turns below. Keep decisions, "
+        "preferences, goals and open questions; leave out item amounts, since the current budget is "
+        f"sent separately. Use at most {settings.HISTORY_SUMMARY_TOKENS * 3 // 4} words. "
+        'Answer as JSON: {"summary": string}.\n'
+        f"<SUMMARY>\n{summary or 'none'}\n</SUMMARY>\n<TURNS>\n{transcript}\n</TURNS>"
+    )
+    start = time.perf_counter()
+    try:
+        value, _ = parse_json_reply(await generate_text(model_registry.get_chat_model(), prompt))
+    except Exception:
+        value = None
+    metrics.record_timing("history.summarise", time.perf_counter() - start)
+    if isinstance(value, dict) and isinstance(value.get("summary"), str) and value["summary"].strip():
+        return value["summary"].strip()[:settings.HISTORY_SUMMARY_TOKENS * 4]
+    metrics.incr("history.summary_fallback")
+    return local_summary(summary, turns)
+
+
+async def compact(conversations: List[Dict[str, Any]], summary: Optional[str],
+                  summarised_turns: int) -> Tuple[Optional[str], int]:
+    """
+    Roll the turns that no longer fit the window into the summary.
+    Returns (summary, summarised_turns); unchanged if there is nothing to compact.
+    """
+    summarised_turns = min(summarised_turns, len(conversations))
+    if not needs_compaction(conversations, summarised_turns):
+        return summary, summarised_turns
+    keep_from = window_start(conversations, first=summarised_turns)
+    # Very long uploaded histories: only the turns closest to the window are summarised.
+    first, tokens = keep_from, 0
+    while first > summarised_turns and tokens < 4 * settings.HISTORY_TOKEN_BUDGET:
+        first -= 1
+        tokens += turn_tokens(conversations[first])
+    summary = await summarise(summary, conversations[first:keep_from])
+    metrics.incr("history.compactions")
+    return summary, keep_from
+
+
+def page(conversations: List[Dict[str, Any]], offset: int, limit: int) -> Dict[str, Any]:
+    """
+    One page of the full conversation archive, oldest first.
+    """
+    return {
+        "total": len(conversations),
+        "offset": offset,
+        "turns": conversations[offset:offset + limit],
+    }
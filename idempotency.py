@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+import settings
+from metrics import metrics
+
+# Longest Idempotency-Key accepted.
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Hash of a request's parameters, to spot an idempotency key reused for a different request.
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.body: Optional[bytes] = None
+        self.expires_at = 0.0
+
+
+class IdempotencyStore:
+    """
+    Responses to requests sent with an Idempotency-Key header, by (user, key), so a client
+    retrying a /chat or /receipt request gets the response of the first attempt instead of
+    running the turn twice. A retry that arrives while the first attempt is still running
+    waits for it. Only successful responses are kept (for ttl_seconds, in an LRU bounded by
+    total body bytes); after an error the key can be used again.
+    Per server process: with several workers, a retry is only recognised by the worker
+    that answered the first attempt.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.replays = 0
+
+    def _drop(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.body is not None:
+            self._bytes -= len(entry.body)
+
+    async def run(self, user_id: str, key: str, request_fingerprint: str,
+                  call: Callable[[], Awaitable[Any]]) -> Tuple[bytes, bool]:
+        """
+        The JSON body for this request: the stored one if the key was seen before (the
+        bool is then True), otherwise call()'s result, serialised and stored.
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+        store_key = (user_id, key)
+        while True:
+            entry = self._entries.get(store_key)
+            if entry is not None and entry.body is not None and entry.expires_at <= time.time():
+                self._drop(store_key)
+                entry = None
+            if entry is None:
+                break
+            if entry.fingerprint != request_fingerprint:
+                raise HTTPException(status_code=422,
+                                    detail="Idempotency-Key was already used for a different request")
+            self._entries.move_to_end(store_key)
+            try:
+                body = await asyncio.shield(entry.future)
+            except asyncio.CancelledError:
+                if entry.future.cancelled():
+                    # The first attempt was abandoned before it finished: run the request here.
+                    continue
+                raise
+            self.replays += 1
+            metrics.incr("idempotency.replayed")
+            return body, True
+
+        entry = self._entries[store_key] = _Entry(request_fingerprint)
+        try:
+            body = json.dumps(await call()).encode("utf-8")
+        except BaseException as e:
+            if self._entries.get(store_key) is entry:
+                del self._entries[store_key]
+            # Retries already waiting get the same error; later ones run the request again.
+            if isinstance(e, asyncio.CancelledError):
+                entry.future.cancel()
+            else:
+                entry.future.set_exception(e)
+                entry.future.exception()
+            raise
+        entry.future.set_result(body)
+        if self._entries.get(store_key) is not entry:
+            return body, False
+        if len(body) > self.max_bytes:
+            del self._entries[store_key]
+            return body, False
+        entry.body = body
+        entry.expires_at = time.time() + self.ttl_seconds
+        self._bytes += len(body)
+        # Evict the least recently used finished responses; requests still running stay.
+        for old_key in [old_key for old_key, old in self._entries.items() if old.body is not None]:
+            if self._bytes <= self.max_bytes:
+                break
+            self._drop(old_key)
+        return body, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "replays": self.replays}
+
+
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_MAX_BYTES, settings.IDEMPOTENCY_TTL_SECONDS)
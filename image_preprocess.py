@@ -0,0 +1,159 @@
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+from metrics import metrics
+
+
+def target_width() -> int:
+    """
+    Pixel width a receipt should have for OCR: paper width times the target DPI.
+    """
+    return int(settings.OCR_RECEIPT_WIDTH_INCHES * settings.OCR_TARGET_DPI)
+
+
+def decode_for_ocr(image_stream) -> Image.Image:
+    """
+    Decode an upload once. For JPEG photos the decoder is asked (via draft) to produce a
+    grayscale image at a reduced scale, which is much cheaper than a full-size RGB decode.
+    The draft keeps at least twice the target width, so cropping still has room.
+    """
+    image = Image.open(image_stream)
+    if image.format == "JPEG" and "grayscale" in settings.OCR_PREPROCESS_STAGES:
+        min_width = target_width() * 2
+        if image.width > min_width:
+            scale = min_width / image.width
+            image.draft("L", (min_width, int(image.height * scale)))
+    image.load()
+    return image
+
+
+def to_grayscale(image: Image.Image) -> Image.Image:
+    """
+    Convert to 8-bit grayscale. Transparent areas become white paper rather than black.
+    """
+    if image.mode == "L":
+        return image
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    return image.convert("L")
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """
+    Otsu's threshold for an 8-bit grayscale array, computed from its histogram in one pass.
+    """
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    omega = np.cumsum(hist) / gray.size
+    mu = np.cumsum(hist * np.arange(256)) / gray.size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    return int(np.argmax(np.nan_to_num(between)))
+
+
+def _longest_run(mask: np.ndarray, max_gap: int = 0) -> Optional[Tuple[int, int]]:
+    """
+    Start and end (exclusive) of the longest run of True values in a 1-D mask.
+    Gaps of up to max_gap False values inside a run are bridged.
+    """
+    if not mask.any():
+        return None
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    starts, ends = edges[::2], edges[1::2]
+    if max_gap > 0 and len(starts) > 1:
+        # Merge runs whose separating gap is small.
+        keep = np.concatenate(([True], starts[1:] - ends[:-1] > max_gap))
+        groups = np.flatnonzero(keep)
+        starts = starts[keep]
+        ends = np.maximum.reduceat(ends, groups)
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def find_receipt_box(gray: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Locate the receipt (bright paper) in a photo. Works on a small thumbnail: the longest
+    band of columns containing paper, then the longest band of rows containing paper within
+    those columns, form the bounding box. Returns None when the image is already just the
+    receipt or nothing convincing was found.
+    """
+    thumb = gray.copy()
+    thumb.thumbnail((256, 256))
+    arr = np.asarray(thumb)
+    paper = arr > otsu_threshold(arr)
+    h, w = arr.shape
+
+    col_run = _longest_run(paper.mean(axis=0) > 0.15, max_gap=max(1, w // 30))
+    if col_run is None:
+        return None
+    row_run = _longest_run(paper[:, col_run[0]:col_run[1]].mean(axis=1) > 0.15, max_gap=max(1, h // 30))
+    if row_run is None:
+        return None
+
+    box_fraction = ((col_run[1] - col_run[0]) * (row_run[1] - row_run[0])) / float(w * h)
+    if box_fraction > 0.9 or box_fraction < 0.05:
+        return None
+
+    scale_x, scale_y = gray.width / float(w), gray.height / float(h)
+    margin_x, margin_y = int(gray.width * 0.02), int(gray.height * 0.02)
+    return (
+        max(0, int(col_run[0] * scale_x) - margin_x),
+        max(0, int(row_run[0] * scale_y) - margin_y),
+        min(gray.width, int(col_run[1] * scale_x) + margin_x),
+        min(gray.height, int(row_run[1] * scale_y) + margin_y),
+    )
+
+
+def crop_to_receipt(image: Image.Image) -> Image.Image:
+    box = find_receipt_box(image if image.mode == "L" else to_grayscale(image))
+    return image.crop(box) if box else image
+
+
+def downscale(image: Image.Image) -> Image.Image:
+    """
+    Shrink the image so the receipt is about OCR_TARGET_DPI. Never upscales.
+    """
+    width = target_width()
+    if image.width <= width * 1.1:
+        return image
+    height = max(1, int(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def binarize(image: Image.Image) -> Image.Image:
+    """
+    Global Otsu threshold to pure black text on white paper. Not in the default stages:
+    Tesseract binarises adaptively itself, and thresholding first drops anti-aliasing
+    that small print needs.
+    """
+    arr = np.asarray(image if image.mode == "L" else to_grayscale(image))
+    threshold = otsu_threshold(arr)
+    return Image.fromarray(np.where(arr > threshold, 255, 0).astype(np.uint8))
+
+
+STAGES = {
+    "grayscale": to_grayscale,
+    "crop": crop_to_receipt,
+    "downscale": downscale,
+    "binarize": binarize,
+}
+
+
+def preprocess_for_ocr(image: Image.Image, stages=None) -> Tuple[Image.Image, Dict[str, float]]:
+    """
+    Run the configured preprocessing stages (settings.OCR_PREPROCESS_STAGES by default)
+    in order. Returns the processed image and the seconds spent in each stage.
+    """
+    timings = {}
+    for name in (settings.OCR_PREPROCESS_STAGES if stages is None else stages):
+        start = time.perf_counter()
+        image = STAGES[name](image)
+        timings[name] = time.perf_counter() - start
+        metrics.record_timing(f"ocr.preprocess.{name}", timings[name])
+    return image, timings
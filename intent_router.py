@@ -0,0 +1,193 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from budget_delta import apply_operations
+from metrics import metrics
+from receipt_parser import guess_category
+from response_cache import CLOSING
+
+# Pieces shared by the command patterns below. Matching is case-insensitive on the raw message.
+_POLITE = r"^\s*(?:(?:please|pls|can you|could you|would you|hey|ok|okay)[\s,]+)*"
+_END = r"(?:[\s,]+(?:please|pls|thanks|thank you))?[\s.!]*$"
+_AMOUNT = r"\$?\s*(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)(?:\s*(?:dollars|bucks|\$))?"
+_SCHEDULE = (r"(?:\s+(?P<schedule>monthly|weekly|yearly|annually|daily|(?:per|a|every|each)\s+"
+             r"(?:month|week|year|day)))?")
+_CATEGORY = r"(?:\s+(?:under|in|as|category)\s+(?P<category>[a-z][\w &'-]{0,39}?))?"
+_BUDGET = r"(?:\s+(?:to|from|in|on)\s+(?:my\s+|the\s+)?(?:budget|list|expenses))?"
+_NAME = r"(?:an?\s+|my\s+|the\s+)?(?P<name>[a-z][\w &'.-]{0,59}?)"
+
+_ADD = [
+    re.compile(_POLITE + r"(?:add|put|include)\s+" + _NAME + r"(?:\s*[:=-]\s*|\s+(?:for|at|of|costing)\s+|\s+)"
+               + _AMOUNT + _SCHEDULE + _CATEGORY + _BUDGET + _CATEGORY.replace("category>", "category2>") + _END,
+               re.IGNORECASE),
+    re.compile(_POLITE + r"(?:add|put|include)\s+" + _AMOUNT + r"\s+(?:for|of|on)\s+" + _NAME + _SCHEDULE
+               + _CATEGORY + _BUDGET + _CATEGORY.replace("category>", "category2>") + _END, re.IGNORECASE),
+]
+_REMOVE = re.compile(_POLITE + r"(?:delete|remove|drop|cancel|get rid of)\s+" + _NAME
+                     + r"(?:\s+(?:item|expense|subscription))?" + _BUDGET + _END, re.IGNORECASE)
+_LIMIT = re.compile(_POLITE + r"(?:set|change|update|make|raise|lower|increase|decrease)\s+(?:my\s+|the\s+)?"
+                    r"(?:monthly\s+)?budget(?:\s+limit)?\s+(?:to|=|at)\s+" + _AMOUNT + _END, re.IGNORECASE)
+_UPDATE = re.compile(_POLITE + r"(?:set|change|update|make)\s+" + _NAME + r"(?:\s+(?:amount|cost|price))?"
+                     r"\s+(?:to|=|at)\s+" + _AMOUNT + _SCHEDULE + _END, re.IGNORECASE)
+
+# Item names are matched word by word. Words that point back at the conversation instead of
+# naming an item are left to the model, which knows what "it" was.
+_WORD = re.compile(r"[a-z0-9][\w'&.-]*")
+_REFERENCES = {"it", "its", "that", "this", "these", "those", "them", "they", "one", "ones", "last",
+               "first", "previous", "other", "same", "everything", "all", "both", "each", "something"}
+
+_SCHEDULES = {"day": "Daily", "week": "Weekly", "month": "Monthly", "year": "Yearly", "annually": "Yearly"}
+DEFAULT_IMPORTANCE = 5
+
+
+def _amount(match) -> float:
+    return float(match.group("amount").replace(",", ""))
+
+
+def _schedule(match) -> Optional[str]:
+    text = (match.group("schedule") or "").lower()
+    for word, schedule in _SCHEDULES.items():
+        if word in text:
+            return schedule
+    return None
+
+
+def _display_name(name: str) -> str:
+    name = " ".join(name.split())
+    return name.title() if name.islower() else name
+
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def _find_item(items: List[Dict[str, Any]], name: str) -> Optional[Dict[str, Any]]:
+    """
+    The one item called name (case-insensitive), or failing that the one item whose name
+    contains every word of it as a whole word (words of at least 3 letters only). None when
+    name refers back to the conversation ("it", "that one"), when nothing matches or when
+    several items do, so the model can ask.
+    """
+    words = _WORD.findall(name.lower())
+    if not words or _REFERENCES.intersection(words):
+        return None
+    wanted = " ".join(words)
+    exact = [item for item in items if " ".join(_WORD.findall(str(item.get("item_name", "")).lower())) == wanted]
+    if len(exact) == 1:
+        return exact[0]
+    if exact or min(len(word) for word in words) < 3:
+        return None
+    partial = [item for item in items if set(words) <= set(_WORD.findall(str(item.get("item_name", "")).lower()))]
+    return partial[0] if len(partial) == 1 else None
+
+
+def _category(match, name: str, items: List[Dict[str, Any]]) -> str:
+    """
+    The category the user named, else the one used by an item of the same name or by an
+    existing category of that name, else a keyword guess.
+    """
+    category = match.group("category") or match.group("category2")
+    if category:
+        return _display_name(category.strip())
+    for item in items:
+        if str(item.get("item_name", "")).lower() == name.lower() and item.get("category"):
+            return item["category"]
+    for item in items:
+        if str(item.get("category", "")).lower() == name.lower():
+            return item["category"]
+    return guess_category(name, default="Other")
+
+
+def parse_command(message: str, state_dict: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Turn a simple edit command into {"intent", "operations", "budget_limit"?, "summary"}.
+    Handles "add groceries $120", "add $15 for Netflix monthly", "delete Netflix",
+    "set my budget to 3000" and "change rent to 1450". Returns None for anything ambiguous
+    or unrecognised, which is then left to the model.
+    """
+    text = (message or "").strip()
+    if not text or "\n" in text or len(text) > 120:
+        return None
+    budget = state_dict.get("Budget") or {}
+    items = budget.get("items") or []
+
+    match = _LIMIT.match(text)
+    if match:
+        limit = _amount(match)
+        return {"intent": "limit", "operations": [], "budget_limit": limit,
+                "summary": f"Set your budget limit to {_money(limit)}."}
+
+    for pattern in _ADD:
+        match = pattern.match(text)
+        if match:
+            name = _display_name(match.group("name"))
+            if " and " in f" {name.lower()} ":
+                return None
+            amount = _amount(match)
+            item = {
+                "item_name": name,
+                "amount": amount,
+                "category": _category(match, name, items),
+                "importance_rank": DEFAULT_IMPORTANCE,
+                "recurrence_schedule": _schedule(match),
+                "due_date": None,
+            }
+            schedule = f" {item['recurrence_schedule'].lower()}" if item["recurrence_schedule"] else ""
+            return {"intent": "add", "operations": [{"op": "add", "item": item}],
+                    "summary": f"Added {name} ({_money(amount)}{schedule}, {item['category']}) to your budget."}
+
+    match = _REMOVE.match(text)
+    if match:
+        item = _find_item(items, match.group("name"))
+        if item is None:
+            return None
+        return {"intent": "remove", "operations": [{"op": "remove", "id": item["id"]}],
+                "summary": f"Removed {item['item_name']} ({_money(float(item.get('amount') or 0))}) from your budget."}
+
+    match = _UPDATE.match(text)
+    if match:
+        item = _find_item(items, match.group("name"))
+        if item is None:
+            return None
+        fields = {"amount": _amount(match)}
+        if _schedule(match):
+            fields["recurrence_schedule"] = _schedule(match)
+        return {"intent": "update", "operations": [{"op": "update", "id": item["id"], "item": fields}],
+                "summary": f"Changed {item['item_name']} from {_money(float(item.get('amount') or 0))} "
+                           f"to {_money(fields['amount'])}."}
+    return None
+
+
+def apply_command(message: str, state_dict: Dict[str, Any]) -> Optional[str]:
+    """
+    Apply a simple edit command to state_dict["Budget"] (items with ids) and record the turn
+    in the conversation. Returns the templated reply, or None if the message is not a simple
+    command and should go to the model. Counted as intent_router.<intent> / .fallthrough.
+    """
+    command = parse_command(message, state_dict)
+    if command is None:
+        metrics.incr("intent_router.fallthrough")
+        return None
+    budget = state_dict["Budget"]
+    items, problems = apply_operations(budget.get("items") or [], command["operations"])
+    if problems:
+        metrics.incr("intent_router.fallthrough")
+        return None
+    budget["items"] = items
+    if "budget_limit" in command:
+        budget["budget_limit"] = command["budget_limit"]
+
+    total = round(sum(float(item.get("amount") or 0) for item in items), 2)
+    limit = budget.get("budget_limit")
+    reply = command["summary"]
+    if limit is not None:
+        surplus = round(limit - total, 2)
+        if surplus >= 0:
+            reply += f" Your surplus is now {_money(surplus)}."
+        else:
+            reply += f" You are now over budget by {_money(-surplus)}."
+    reply += CLOSING
+
+    budget.setdefault("conversations", []).append({"user_message": message, "ai_response": reply})
+    metrics.incr(f"intent_router.{command['intent']}")
+    return reply
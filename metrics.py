@@ -0,0 +1,153 @@
+import bisect
+import contextvars
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# Histogram bucket upper bounds: stage latencies (seconds), and sizes (bytes or tokens).
+TIMING_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(4 ** power for power in range(3, 12))
+
+# Stages timed while handling the current request: [(name, seconds)]. Set by the request
+# middleware; worker threads see the same list when started through workers.run_cpu.
+trace_var: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("trace", default=None)
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Histogram:
+    """
+    Counts per bucket (the last one is +Inf), with the sum and max of the observed values.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    """
+    Process-wide counters, timing histograms and size histograms, reported on GET /stats
+    and in Prometheus text format on GET /metrics.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._timings: Dict[str, Histogram] = {}
+        self._sizes: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def record_timing(self, name: str, seconds: float):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Histogram(TIMING_BUCKETS)
+            timing.observe(seconds)
+
+    def observe(self, name: str, value: float):
+        """
+        Record a size (prompt bytes, reply tokens, ...).
+        """
+        with self._lock:
+            sizes = self._sizes.get(name)
+            if sizes is None:
+                sizes = self._sizes[name] = Histogram(SIZE_BUCKETS)
+            sizes.observe(value)
+
+    def add_stage(self, name: str, seconds: float):
+        """
+        Record a stage: in the timing histogram and, inside a request, in the request's
+        trace (Server-Timing header and access log).
+        """
+        self.record_timing(name, seconds)
+        trace = trace_var.get()
+        if trace is not None:
+            trace.append((name, seconds))
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Time a block as a stage (see add_stage).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: {
+                        "count": timing.count,
+                        "avg_ms": round(timing.total / timing.count * 1000, 3),
+                        "max_ms": round(timing.max * 1000, 3),
+                    }
+                    for name, timing in self._timings.items()
+                },
+                "sizes": {
+                    name: {"count": sizes.count, "avg": round(sizes.total / sizes.count, 1), "max": sizes.max}
+                    for name, sizes in self._sizes.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """
+        Everything in the Prometheus text exposition format: counters as budgit_<name>_total,
+        timings as budgit_<name>_seconds histograms and sizes as budgit_<name> histograms.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f"budgit_{_METRIC_NAME.sub('_', name)}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for suffix, histograms in (("_seconds", self._timings), ("", self._sizes)):
+                for name, histogram in sorted(histograms.items()):
+                    metric = f"budgit_{_METRIC_NAME.sub('_', name)}{suffix}"
+                    lines.append(f"# TYPE {metric} histogram")
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                    lines.append(f"{metric}_sum {histogram.total:.6f}")
+                    lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def stage_totals(trace: List[Tuple[str, float]]) -> Dict[str, float]:
+    """
+    Milliseconds per stage name in a request's trace, in first-seen order.
+    """
+    totals: Dict[str, float] = {}
+    for name, seconds in trace:
+        totals[name] = totals.get(name, 0.0) + seconds * 1000
+    return totals
+
+
+def server_timing(trace: List[Tuple[str, float]]) -> str:
+    """
+    A request's stages as a Server-Timing header value.
+    """
+    return ", ".join(f"{_METRIC_NAME.sub('_', name)};dur={ms:.1f}" for name, ms in stage_totals(trace).items())
+
+
+metrics = Metrics()
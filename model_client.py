@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import settings
+from metrics import metrics
+from model_registry import model_registry
+from prompt_builder import estimate_tokens
+from scheduler import model_scheduler
+
+
+_record_lock = threading.Lock()
+# Model calls in flight, by call_key(), for coalescing.
+_in_flight: Dict[str, "Flight"] = {}
+
+
+def record(role: str, prompt: str, text: str):
+    """
+    Append a live reply to MODEL_RECORD_PATH for the fake backend to replay
+    (fake_model.Recordings). Only a hash of the prompt is kept, not the user's budget.
+    """
+    if not settings.MODEL_RECORD_PATH or settings.MODEL_BACKEND == "fake":
+        return
+    line = json.dumps({"role": role, "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                       "text": text}) + "\n"
+    with _record_lock, open(settings.MODEL_RECORD_PATH, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def _canonical(value: Any):
+    """
+    JSON form of what the SDK keeps in histories and generation configs (proto-plus
+    messages, GenerationConfig objects); anything else by its repr.
+    """
+    to_dict = getattr(type(value), "to_dict", None)
+    if to_dict is not None:
+        return to_dict(value)
+    return getattr(value, "__dict__", None) or repr(value)
+
+
+def call_content(chat_session, prompt: str, kwargs: Dict[str, Any], stream: bool = False) -> str:
+    """
+    Everything a model reply depends on, as JSON: the model, its generation config, the
+    chat history, the prompt and the call's own options. Its length also stands in for
+    the call's input size when admitting it against the token quota.
+    """
+    model = getattr(chat_session, "model", chat_session)
+    content = [getattr(model, "model_name", None), getattr(model, "_generation_config", None),
+               getattr(chat_session, "history", None) if chat_session is not model else None,
+               prompt, kwargs, stream]
+    return json.dumps(content, sort_keys=True, separators=(",", ":"), default=_canonical)
+
+
+def call_key(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """
+    One upstream model call shared by every identical call made while it runs. It runs as
+    its own task, so a caller that goes away (client disconnect) only cancels it when no
+    other caller is left. Streamed text is kept as it arrives, so a caller that joins late
+    still gets every chunk.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.listeners = 0
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._changed.set()
+        if _in_flight.get(self.key) is self:
+            del _in_flight[self.key]
+
+    def _leave(self):
+        self.listeners -= 1
+        if self.listeners == 0 and not self.done:
+            self.task.cancel()
+
+    async def result(self) -> str:
+        try:
+            await asyncio.shield(self.task)
+        finally:
+            self._leave()
+        return "".join(self.chunks)
+
+    async def stream(self):
+        position = 0
+        try:
+            while True:
+                changed = self._changed
+                while position < len(self.chunks):
+                    yield self.chunks[position]
+                    position += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self._leave()
+
+
+def _join(key: str, produce) -> Tuple[Flight, bool]:
+    """
+    The flight for key, started with produce(flight) if there is none. Also returns
+    whether the caller started it (and so owns the chat session the SDK updated).
+    """
+    flight = _in_flight.get(key) if settings.MODEL_COALESCE else None
+    if flight is not None:
+        flight.listeners += 1
+        metrics.incr("llm.coalesced")
+        return flight, False
+    flight = Flight(key)
+    flight.listeners = 1
+
+    async def run():
+        try:
+            await produce(flight)
+        except BaseException as e:
+            flight.finish(e)
+            raise
+        flight.finish()
+
+    if settings.MODEL_COALESCE:
+        _in_flight[key] = flight
+    flight.task = asyncio.ensure_future(run())
+    # The error also reaches every caller; this only keeps asyncio from logging it as unretrieved.
+    flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return flight, True
+
+
+def _remember_turn(chat_session, prompt: str, text: str):
+    """
+    Add a turn to a chat session whose call was answered by another session's flight,
+    as the SDK would have after its own call.
+    """
+    chat_session.history = list(chat_session.history) + [
+        {"role": "user", "parts": [{"text": prompt}]},
+        {"role": "model", "parts": [{"text": text}]},
+    ]
+
+
+def _finished(role: str, prompt: str, text: str, started: float, usage=None):
+    """
+    Bookkeeping after a model call: the llm.<role> stage time, prompt and reply sizes
+    (token counts from the SDK's usage metadata when present, else estimated; the prompt
+    count then covers the chat history too), and the optional recording.
+    """
+    metrics.add_stage(f"llm.{role}", time.perf_counter() - started)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+    reply_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text)
+    metrics.observe(f"llm.{role}.prompt_bytes", len(prompt.encode("utf-8")))
+    metrics.observe(f"llm.{role}.prompt_tokens", prompt_tokens)
+    metrics.observe(f"llm.{role}.response_bytes", len(text.encode("utf-8")))
+    metrics.observe(f"llm.{role}.response_tokens", reply_tokens)
+    record(role, prompt, text)
+
+
+async def send_chat_message(chat_session, prompt: str, **kwargs) -> str:
+    """
+    Send one message on a chat session with the SDK's async API and return the response text.
+    The chat session's history is updated by the SDK once the response arrives.
+    Extra keyword arguments (e.g. generation_config) are passed through to the SDK.
+    Identical calls in flight at the same time (same model, config, history and prompt, e.g.
+    a double-submitted request) share one upstream request; see Flight. The request is
+    admitted by the scheduler, which may raise ModelOverloaded (a 429).
+    """
+    role = model_registry.role(getattr(chat_session, "model", None))
+    content = call_content(chat_session, prompt, kwargs)
+
+    async def call():
+        started = time.perf_counter()
+        response = await chat_session.send_message_async(prompt, **kwargs)
+        return response, started
+
+    async def produce(flight: Flight):
+        response, started = await model_scheduler.run(role, estimate_tokens(content), call)
+        flight.publish(response.text)
+        _finished(role, prompt, response.text, started, getattr(response, "usage_metadata", None))
+
+    flight, owner = _join(call_key(content), produce)
+    text = await flight.result()
+    if not owner:
+        _remember_turn(chat_session, prompt, text)
+    return text
+
+
+async def stream_chat_message(chat_session, prompt: str, **kwargs):
+    """
+    Send one message with streaming enabled and yield the response text chunk by chunk.
+    The SDK adds the turn to the chat history once the stream has been read to the end.
+    Identical streams in flight at the same time share one upstream request. Rate-limit
+    errors are only retried before any text has been sent on.
+    """
+    role = model_registry.role(getattr(chat_session, "model", None))
+    content = call_content(chat_session, prompt, kwargs, stream=True)
+
+    async def produce(flight: Flight):
+        usage = None
+        started = time.perf_counter()
+
+        async def call():
+            nonlocal usage, started
+            started = time.perf_counter()
+            response = await chat_session.send_message_async(prompt, stream=True, **kwargs)
+            async for chunk in response:
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. only a finish reason).
+                    continue
+                if text:
+                    flight.publish(text)
+
+        await model_scheduler.run(role, estimate_tokens(content), call, can_retry=lambda: not flight.chunks)
+        _finished(role, prompt, "".join(flight.chunks), started, usage)
+
+    flight, owner = _join(call_key(content), produce)
+    async for text in flight.stream():
+        yield text
+    if not owner:
+        _remember_turn(chat_session, prompt, "".join(flight.chunks))
+
+
+async def generate_text(model, prompt: str, **kwargs) -> str:
+    """
+    One-off request outside any chat session (no history is sent or kept).
+    Identical requests in flight at the same time share one upstream request.
+    """
+    content = call_content(model, prompt, kwargs)
+
+    async def call():
+        started = time.perf_counter()
+        response = await model.generate_content_async(prompt, **kwargs)
+        return response, started
+
+    async def produce(flight: Flight):
+        response, started = await model_scheduler.run("generate", estimate_tokens(content), call)
+        flight.publish(response.text)
+        _finished("generate", prompt, response.text, started, getattr(response, "usage_metadata", None))
+
+    flight, _ = _join(call_key(content), produce)
+    return await flight.result()
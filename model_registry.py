@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import google.generativeai as genai
+
+import settings
+from fake_model import FakeModel, FakeQuota, Recordings
+from consolemain import load_config, CHAT_MODEL_NAME, CHAT_GENERATION_CONFIG
+
+
+# Generation settings for the receipt parser model.
+RECEIPT_MODEL_NAME = "gemini-2.0-flash-exp"
+RECEIPT_GENERATION_CONFIG = {
+    "temperature": 0.8,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the configured Gemini models.
+
+    config.json is read and genai.configure() is called once, instead of on every
+    request. The registry re-checks the config file's modification time at most
+    every `reload_interval` seconds and rebuilds the models when it changed.
+    Chat sessions created before a reload keep using the model they were started with.
+    """
+
+    def __init__(self, config_path: str = "config.json", reload_interval: float = 5.0):
+        self.config_path = config_path
+        self.reload_interval = reload_interval
+        self.config: Optional[Dict[str, Any]] = None
+        self.chat_model = None
+        self.receipt_model = None
+        self.init_seconds: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.reload_count = 0
+        self._config_mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        """
+        Load the config and build both models. Must be called with the lock held.
+        """
+        start = time.perf_counter()
+        if settings.MODEL_BACKEND == "fake":
+            self._build_fake()
+            self.init_seconds = time.perf_counter() - start
+            return
+        config_mtime = os.stat(self.config_path).st_mtime if os.path.exists(self.config_path) else None
+        config = load_config(self.config_path)
+        genai.configure(api_key=config["GEMINI_API_KEY"])
+
+        self.chat_model = genai.GenerativeModel(
+            model_name=config.get("CHAT_MODEL", CHAT_MODEL_NAME),
+            generation_config=CHAT_GENERATION_CONFIG,
+        )
+        self.receipt_model = genai.GenerativeModel(
+            model_name=config.get("RECEIPT_MODEL", RECEIPT_MODEL_NAME),
+            generation_config=RECEIPT_GENERATION_CONFIG,
+        )
+        self.config = config
+        self._config_mtime = config_mtime
+        self._last_check = time.monotonic()
+        self.loaded_at = time.time()
+        if self.init_seconds is not None:
+            self.reload_count += 1
+        self.init_seconds = time.perf_counter() - start
+
+    def _build_fake(self):
+        """
+        Offline models from fake_model.py instead of Gemini; config.json is not needed.
+        """
+        recordings = Recordings(settings.FAKE_MODEL_RECORDINGS)
+        options = {
+            "first_token_seconds": settings.FAKE_MODEL_FIRST_TOKEN_MS / 1000,
+            "tokens_per_second": settings.FAKE_MODEL_TOKENS_PER_SECOND,
+            "prefill_tokens_per_second": settings.FAKE_MODEL_PREFILL_TOKENS_PER_SECOND,
+            "quota": FakeQuota(settings.FAKE_MODEL_REQUESTS_PER_MINUTE),
+        }
+        self.chat_model = FakeModel("chat", recordings, **options)
+        self.receipt_model = FakeModel("receipt", recordings, **options)
+        self.config = {}
+        self._last_check = time.monotonic()
+        self.loaded_at = time.time()
+
+    def role(self, model) -> str:
+        """
+        "receipt" for the receipt parser model, "chat" for anything else.
+        """
+        return "receipt" if model is not None and model is self.receipt_model else "chat"
+
+    def load(self):
+        """
+        Build the models now (called once at startup).
+        """
+        with self._lock:
+            self._build()
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self.chat_model is not None and (now - self._last_check < self.reload_interval
+                                            or settings.MODEL_BACKEND == "fake"):
+            return
+        with self._lock:
+            if self.chat_model is None:
+                self._build()
+                return
+            if now - self._last_check < self.reload_interval:
+                return
+            self._last_check = now
+            try:
+                mtime = os.stat(self.config_path).st_mtime
+            except OSError:
+                # Keep serving with the models we have if the file disappears.
+                return
+            if mtime != self._config_mtime:
+                self._build()
+
+    def get_chat_model(self):
+        self._ensure_loaded()
+        return self.chat_model
+
+    def get_receipt_model(self):
+        self._ensure_loaded()
+        return self.receipt_model
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": settings.MODEL_BACKEND,
+            "loaded": self.chat_model is not None,
+            "init_seconds": self.init_seconds,
+            "loaded_at": self.loaded_at,
+            "reload_count": self.reload_count,
+        }
+
+
+model_registry = ModelRegistry(reload_interval=settings.CONFIG_RELOAD_INTERVAL_SECONDS)
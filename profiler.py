@@ -0,0 +1,110 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import settings
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread every interval seconds from a background thread
+    (sys._current_frames, so no tracing overhead in the profiled code) and writes them in
+    collapsed-stack format ("frame;frame;frame count" per line), which flamegraph.pl and
+    speedscope read. Other requests running at the same time show up in the samples too.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                thread_name = names.get(ident)
+                if thread_name is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    thread_name = names.get(ident, str(ident))
+                self.samples[";".join([thread_name] + stack[::-1])] += 1
+
+    def write(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def finish(self, path: str) -> int:
+        """
+        Stop sampling and write the profile to path. Joins a thread and writes a file, so
+        async callers run it in a thread. Returns the number of samples taken.
+        """
+        self.stop()
+        self.write(path)
+        return sum(self.samples.values())
+
+
+# One profiled request at a time: each one samples every thread, so overlapping profiles
+# would only slow the server down and repeat each other.
+_profile_slot = threading.Lock()
+
+
+def start_profile(request_id: str, header: Optional[str]):
+    """
+    Start profiling a request sent with "X-Profile: <BUDGIT_PROFILE_TOKEN>", when
+    BUDGIT_PROFILE_DIR and the token are both set and no other request is being profiled.
+    Returns (profiler, path), or (None, None). Pass them to finish_profile() afterwards.
+    """
+    token = settings.PROFILE_TOKEN
+    if not settings.PROFILE_DIR or not token or not header:
+        return None, None
+    if not hmac.compare_digest(header.encode("utf-8"), token.encode("utf-8")):
+        return None, None
+    if not _profile_slot.acquire(blocking=False):
+        return None, None
+    profiler = SamplingProfiler(settings.PROFILE_INTERVAL_MS / 1000)
+    profiler.start()
+    return profiler, profile_path(request_id)
+
+
+def finish_profile(profiler: SamplingProfiler, path: str) -> int:
+    """
+    Stop and write a profile from start_profile() and free the slot for the next one.
+    Blocking; run it in a thread.
+    """
+    try:
+        return profiler.finish(path)
+    finally:
+        _profile_slot.release()
+
+
+def profile_path(request_id: str) -> Optional[str]:
+    """
+    Where the profile of a request goes, or None when per-request profiling is off.
+    """
+    if not settings.PROFILE_DIR:
+        return None
+    safe_id = "".join(char for char in request_id if char.isalnum() or char in "-_")[:64] or "request"
+    return os.path.join(settings.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_id}.collapsed")
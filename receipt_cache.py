@@ -0,0 +1,235 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+import settings
+from metrics import metrics
+
+
+def content_key(data) -> str:
+    """
+    Cache key for an upload: SHA-256 of the raw image bytes (bytes or memoryview).
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 16) -> bytes:
+    """
+    Difference hash (dHash) of an image: compare neighbouring pixels of a tiny grayscale
+    copy. Re-encoded or slightly resized copies of the same photo hash to (nearly) the same bits.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    arr = np.asarray(small, dtype=np.int16)
+    return np.packbits(arr[:, 1:] > arr[:, :-1]).tobytes()
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    return sum(len(value) for value in (entry.get("ocr_text"), entry.get("parsed")) if value) + 64
+
+
+class ReceiptCache:
+    """
+    Two-tier cache of receipt OCR text and parsed items JSON, keyed by content_key().
+    - Tier 1: in-memory LRU bounded by total bytes.
+    - Tier 2: optional SQLite file bounded by total bytes, least recently used rows evicted first.
+    Optionally, entries also carry a perceptual hash so near-duplicate photos can be matched.
+    """
+
+    def __init__(self, memory_bytes: int, db_path: Optional[str] = None, disk_bytes: int = 0,
+                 max_hash_distance: int = 0):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_hash_distance = max_hash_distance
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        # Perceptual hashes of every cached entry, for near-duplicate lookups: row i of
+        # _hash_bits (the first _hash_count rows are in use) belongs to _hash_keys[i].
+        self._hash_rows: Dict[str, int] = {}
+        self._hash_keys: List[str] = []
+        self._hash_bits = np.zeros((0, 0), dtype=bool)
+        self._hash_count = 0
+        self.db_path = db_path
+        self._db = None
+
+    def _database(self):
+        """
+        Open the SQLite tier on first use (so importing this module, e.g. in OCR worker
+        processes, does not touch the file). Lock must be held.
+        """
+        if self._db is None and self.db_path:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS receipt_cache ("
+                " key TEXT PRIMARY KEY, phash BLOB, ocr_text TEXT, parsed TEXT,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS receipt_cache_last_access ON receipt_cache (last_access)")
+            self._db.commit()
+            for key, phash in self._db.execute("SELECT key, phash FROM receipt_cache WHERE phash IS NOT NULL"):
+                self._index_hash(key, phash)
+        return self._db
+
+    def _index_hash(self, key: str, phash: Optional[bytes]):
+        if not phash or key in self._hash_rows:
+            return
+        bits = np.unpackbits(np.frombuffer(phash, dtype=np.uint8)).astype(bool)
+        if self._hash_count and self._hash_bits.shape[1] != bits.size:
+            return
+        if self._hash_count == len(self._hash_bits) or self._hash_bits.shape[1] != bits.size:
+            # Grow by half (at least 64 rows), so adding n hashes copies O(n) rows in total.
+            grown = np.zeros((max(64, self._hash_count * 3 // 2), bits.size), dtype=bool)
+            if self._hash_count:
+                grown[:self._hash_count] = self._hash_bits[:self._hash_count]
+            self._hash_bits = grown
+        self._hash_bits[self._hash_count] = bits
+        self._hash_rows[key] = self._hash_count
+        self._hash_keys.append(key)
+        self._hash_count += 1
+
+    def _unindex_hash(self, key: str):
+        position = self._hash_rows.pop(key, None)
+        if position is None:
+            return
+        # Move the last row into the freed one.
+        self._hash_count -= 1
+        last_key = self._hash_keys.pop()
+        if position != self._hash_count:
+            self._hash_bits[position] = self._hash_bits[self._hash_count]
+            self._hash_keys[position] = last_key
+            self._hash_rows[last_key] = position
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        """
+        Put an entry in the memory tier and evict the least recently used ones over budget.
+        Must be called with the lock held.
+        """
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= _entry_size(old)
+        self._memory[key] = entry
+        self._memory_used += _entry_size(entry)
+        while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= _entry_size(evicted)
+            if not self.db_path:
+                self._unindex_hash(evicted["key"])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an exact match. Returns a dict with ocr_text and parsed (either may be None).
+        """
+        entry, tier = self._lookup(key)
+        metrics.incr(f"receipt_cache.hit.{tier}" if entry is not None else "receipt_cache.miss")
+        return entry
+
+    def _lookup(self, key: str):
+        with self._lock:
+            return self._lookup_locked(key)
+
+    def _lookup_locked(self, key: str):
+        """
+        The entry and the tier it came from, or (None, None). A disk hit is brought back
+        into memory. Lock must be held.
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry, "memory"
+        db = self._database()
+        if db is not None:
+            row = db.execute(
+                "SELECT phash, ocr_text, parsed FROM receipt_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE receipt_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                db.commit()
+                entry = {"key": key, "phash": row[0], "ocr_text": row[1], "parsed": row[2]}
+                self._remember(key, entry)
+                return entry, "disk"
+        return None, None
+
+    def find_similar(self, phash: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Look up a near-duplicate by perceptual hash (Hamming distance <= max_hash_distance).
+        """
+        if self.max_hash_distance <= 0 or not phash:
+            return None
+        bits = np.unpackbits(np.frombuffer(phash, dtype=np.uint8)).astype(bool)
+        with self._lock:
+            self._database()
+            if not self._hash_count or self._hash_bits.shape[1] != bits.size:
+                return None
+            distances = np.count_nonzero(self._hash_bits[:self._hash_count] != bits, axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] > self.max_hash_distance:
+                return None
+            key = self._hash_keys[best]
+        entry, _ = self._lookup(key)
+        if entry is not None:
+            metrics.incr("receipt_cache.hit.similar")
+        return entry
+
+    def put(self, key: str, phash: Optional[bytes] = None, ocr_text: Optional[str] = None,
+            parsed: Optional[str] = None):
+        """
+        Store (or extend) an entry. OCR text and parsed JSON can be added in separate calls;
+        fields not given are kept from the cached entry, whichever tier it is in.
+        """
+        with self._lock:
+            cached, _ = self._lookup_locked(key)
+            entry = dict(cached or {"key": key, "phash": None, "ocr_text": None, "parsed": None})
+            entry["phash"] = phash or entry["phash"]
+            entry["ocr_text"] = ocr_text if ocr_text is not None else entry["ocr_text"]
+            entry["parsed"] = parsed if parsed is not None else entry["parsed"]
+            self._remember(key, entry)
+            self._index_hash(key, entry["phash"])
+            db = self._database()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO receipt_cache (key, phash, ocr_text, parsed, size, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry["phash"], entry["ocr_text"], entry["parsed"], _entry_size(entry), time.time()),
+                )
+                self._evict_disk()
+                db.commit()
+
+    def _evict_disk(self):
+        """
+        Delete least recently used rows until the table fits in disk_bytes. Lock must be held.
+        """
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM receipt_cache").fetchone()[0]
+        while total > self.disk_bytes:
+            row = self._db.execute("SELECT key, size FROM receipt_cache ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM receipt_cache WHERE key = ?", (row[0],))
+            evicted = self._memory.pop(row[0], None)
+            if evicted is not None:
+                self._memory_used -= _entry_size(evicted)
+            self._unindex_hash(row[0])
+            total -= row[1]
+            metrics.incr("receipt_cache.evicted")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {"memory_entries": len(self._memory), "memory_bytes": self._memory_used}
+            db = self._database()
+            if db is not None:
+                count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM receipt_cache").fetchone()
+                stats.update({"disk_entries": count, "disk_bytes": size})
+            return stats
+
+
+receipt_cache = ReceiptCache(
+    memory_bytes=settings.RECEIPT_CACHE_MEMORY_BYTES,
+    db_path=settings.RECEIPT_CACHE_PATH,
+    disk_bytes=settings.RECEIPT_CACHE_DISK_BYTES,
+    max_hash_distance=settings.RECEIPT_CACHE_HASH_DISTANCE,
+)
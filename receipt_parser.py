@@ -0,0 +1,250 @@
+import calendar
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+# All patterns are compiled once at import; parse_receipt() runs on every upload.
+
+# A money amount at the end of a line: "$1,234.56", "3.99", "3,99", "-2.00", "2.00-",
+# optionally followed by a one/two letter tax flag ("3.99 A", "3.99 TX") or a SALE marker.
+_PRICE_AT_END = re.compile(
+    r"(?P<neg>-)?\$?\s?(?P<amount>\d{1,3}(?:,\d{3})+\.\d{2}|\d+[.,]\d{2})(?P<trailing_neg>-)?"
+    r"(?:\s+(?:[A-Z]{1,2}|SALE))?\s*$"
+)
+# "2 @ 1.50", "2 x 1.50", "2X 1.50" in front of the line price.
+_QUANTITY_AT = re.compile(r"(?P<qty>\d+(?:\.\d+)?)\s*(?:@|[xX]\b)\s*\$?(?P<unit>\d+[.,]\d{2})")
+# "2 x Milk" / "2x Milk" / "3 Bananas" at the start of the name.
+_LEADING_QUANTITY = re.compile(r"^(?P<qty>\d{1,3})\s*(?:[xX]\s+|\s+)(?=[A-Za-z])")
+# "1.25 lb @ 2.99 /lb" style weighed items.
+_WEIGHT = re.compile(
+    r"(?P<qty>\d+(?:\.\d+)?)\s*(?:lb|lbs|kg|g|oz)\b(?:\s*@\s*\$?\d+[.,]\d{2}\s*/\s*(?:lb|kg|g|oz)\b)?",
+    re.IGNORECASE,
+)
+
+_SUBTOTAL = re.compile(r"\bsub\s*-?\s*total\b", re.IGNORECASE)
+_TOTAL = re.compile(r"\b(?:grand\s+)?total\b|\bbalance\s+due\b|\bamount\s+due\b|\btotal\s+due\b", re.IGNORECASE)
+_TAX = re.compile(r"\b(?:sales\s+)?tax\b|\b(?:hst|gst|pst|qst|vat)\b", re.IGNORECASE)
+_DISCOUNT = re.compile(r"\b(?:discount|coupon|savings|you\s+saved|promo|markdown)\b", re.IGNORECASE)
+# Payment and change lines repeat the total; they are not purchases.
+_IGNORED = re.compile(
+    r"\b(?:cash|change|tender(?:ed)?|visa|mastercard|master\s*card|amex|debit|credit|card|payment|paid|"
+    r"auth|approval|balance|points|rewards|tip|gratuity|refund|account|acct|ref|trans(?:action)?|items?\s+sold)\b",
+    re.IGNORECASE,
+)
+
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+_DATE_ISO = re.compile(r"\b(?P<y>20\d{2})[-/.](?P<m>\d{1,2})[-/.](?P<d>\d{1,2})\b")
+_DATE_NUMERIC = re.compile(r"\b(?P<a>\d{1,2})[-/.](?P<b>\d{1,2})[-/.](?P<y>\d{4}|\d{2})\b")
+_DATE_WORDS = re.compile(
+    r"\b(?:(?P<d1>\d{1,2})\s+)?(?P<mon>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+    r"\s+(?:(?P<d2>\d{1,2}),?\s+)?(?P<y>\d{4})\b",
+    re.IGNORECASE,
+)
+
+# Keywords used to give the receipt a budget category without asking the model.
+_CATEGORY_KEYWORDS = [
+    ("Groceries", re.compile(r"\b(?:grocery|groceries|market|supermarket|foods?|produce|milk|bread|eggs|walmart|costco|kroger|safeway|aldi|loblaws|sobeys)\b", re.IGNORECASE)),
+    ("Dining", re.compile(r"\b(?:restaurant|cafe|coffee|pizza|burger|grill|bar|diner|starbucks|mcdonald'?s|tim\s+hortons|server|table)\b", re.IGNORECASE)),
+    ("Transportation", re.compile(r"\b(?:gas|fuel|petro|shell|esso|chevron|unleaded|diesel|parking|transit)\b", re.IGNORECASE)),
+    ("Health", re.compile(r"\b(?:pharmacy|drugs?|rx|clinic|shoppers|cvs|walgreens)\b", re.IGNORECASE)),
+    ("Utilities", re.compile(r"\b(?:hydro|electric|water|internet|wireless|mobile|utility)\b", re.IGNORECASE)),
+]
+
+MONEY_TOLERANCE = 0.02
+
+
+def _to_amount(text: str) -> float:
+    """
+    "1,234.56" / "3.99" / "3,99" -> float. The last separator is the decimal point.
+    """
+    digits = re.sub(r"[,.]", "", text)
+    return int(digits) / 100.0
+
+
+def _line_price(line: str):
+    """
+    Split a line into (text before the price, price) or return None if it has no trailing price.
+    """
+    match = _PRICE_AT_END.search(line)
+    if match is None:
+        return None
+    amount = _to_amount(match.group("amount"))
+    if match.group("neg") or match.group("trailing_neg"):
+        amount = -amount
+    return line[:match.start()].rstrip(" .:$\t"), amount
+
+
+def _clean_name(name: str) -> str:
+    name = re.sub(r"\s{2,}", " ", name)
+    # Drop SKU/UPC codes and stray punctuation left around item names.
+    name = re.sub(r"\b\d{5,}\b", "", name)
+    return name.strip(" .:-*#\t")
+
+
+def parse_date(text: str) -> Optional[date]:
+    """
+    First purchase date on the receipt, in any of the common layouts
+    (2024-03-05, 03/05/2024, 03/05/24, Mar 5, 2024, 5 Mar 2024). Numeric dates are read
+    month first unless that is impossible.
+    """
+    candidates = []
+    for match in _DATE_ISO.finditer(text):
+        candidates.append((match.start(), int(match.group("y")), int(match.group("m")), int(match.group("d"))))
+    for match in _DATE_NUMERIC.finditer(text):
+        a, b, year = int(match.group("a")), int(match.group("b")), int(match.group("y"))
+        year = year + 2000 if year < 100 else year
+        month, day = (a, b) if a <= 12 else (b, a)
+        candidates.append((match.start(), year, month, day))
+    for match in _DATE_WORDS.finditer(text):
+        day = match.group("d1") or match.group("d2")
+        if day:
+            candidates.append((match.start(), int(match.group("y")), _MONTHS[match.group("mon").lower()[:3]], int(day)))
+    for _, year, month, day in sorted(candidates):
+        try:
+            return date(year, month, day)
+        except ValueError:
+            continue
+    return None
+
+
+def guess_category(text: str, default: str = "Shopping") -> str:
+    for category, pattern in _CATEGORY_KEYWORDS:
+        if pattern.search(text):
+            return category
+    return default
+
+
+def parse_receipt(text: str) -> Dict[str, Any]:
+    """
+    Parse raw OCR text from a receipt without a model call.
+
+    Returns a dict in the same shape the receipt model answers with
+    ({"items": [{"name", "price", "quantity", "category"}], "tax", "total", "date"}), plus:
+    - merchant: the first line of text, usually the store name
+    - subtotal: when printed on the receipt
+    - confidence: 0..1, how sure the parser is that the items and totals are complete
+    - source: "local"
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+
+    items: List[Dict[str, Any]] = []
+    subtotal = tax = total = None
+    priced_lines = 0
+    unparsed_lines = 0
+    # Some layouts print the item name on its own line and "2 @ 1.50  3.00" below it.
+    pending_name = None
+
+    for line in lines:
+        priced = _line_price(line)
+        if priced is None:
+            pending_name = line
+            continue
+        label, amount = priced
+        priced_lines += 1
+        previous_name, pending_name = pending_name, None
+
+        if _SUBTOTAL.search(label):
+            subtotal = amount
+        elif _TAX.search(label):
+            tax = (tax or 0.0) + amount
+        elif _TOTAL.search(label) and not _DISCOUNT.search(label):
+            # Keep the first total; later "total" lines are usually tender/savings totals.
+            if total is None:
+                total = amount
+        elif _IGNORED.search(label):
+            continue
+        elif total is not None:
+            # Anything priced after the total is payment detail, not a purchase.
+            continue
+        elif _DISCOUNT.search(label):
+            items.append({"name": _clean_name(label) or "Discount", "price": -abs(amount), "quantity": 1})
+        else:
+            quantity = 1
+            quantity_match = _QUANTITY_AT.search(label) or _WEIGHT.search(label)
+            if quantity_match is not None:
+                quantity = float(quantity_match.group("qty"))
+                quantity = int(quantity) if quantity.is_integer() else quantity
+                label = label[:quantity_match.start()] + label[quantity_match.end():]
+            else:
+                leading = _LEADING_QUANTITY.match(label)
+                if leading is not None:
+                    quantity = int(leading.group("qty"))
+                    label = label[leading.end():]
+            name = _clean_name(label)
+            if not name and quantity_match is not None and previous_name:
+                name = _clean_name(previous_name)
+            if not name or not re.search(r"[A-Za-z]{2}", name):
+                unparsed_lines += 1
+                continue
+            items.append({"name": name, "price": amount, "quantity": quantity})
+
+    purchase_date = parse_date(text)
+    merchant = _clean_name(lines[0]) if lines else ""
+    category = guess_category(text)
+    for item in items:
+        item["category"] = category
+
+    return {
+        "merchant": merchant,
+        "items": items,
+        "subtotal": subtotal,
+        "tax": tax,
+        "total": total,
+        "date": purchase_date.isoformat() if purchase_date else None,
+        "confidence": _confidence(items, subtotal, tax, total, priced_lines, unparsed_lines),
+        "source": "local",
+    }
+
+
+def _confidence(items, subtotal, tax, total, priced_lines, unparsed_lines) -> float:
+    """
+    Score a parse by how well the numbers on the receipt agree with each other.
+    Items that add up to the printed subtotal/total are very unlikely to be an OCR accident.
+    """
+    if not items or total is None or total <= 0:
+        return 0.0
+    items_sum = round(sum(item["price"] for item in items), 2)
+    tolerance = max(MONEY_TOLERANCE, total * 0.005)
+
+    if abs(items_sum + (tax or 0.0) - total) <= tolerance:
+        score = 0.95
+    elif subtotal is not None and abs(items_sum - subtotal) <= tolerance:
+        # Items are complete, but the tax/total lines did not line up (e.g. unread fees).
+        score = 0.75
+    elif subtotal is not None and abs(subtotal + (tax or 0.0) - total) <= tolerance:
+        # The summary is consistent but some item lines were missed or misread.
+        score = 0.5
+    else:
+        score = 0.2
+
+    # Priced lines we could not make sense of mean the OCR text is noisy.
+    if priced_lines:
+        score -= 0.5 * unparsed_lines / priced_lines
+    return round(max(0.0, min(1.0, score)), 3)
+
+
+def is_confident(receipt: Optional[Dict[str, Any]], min_confidence: float) -> bool:
+    return bool(receipt) and receipt.get("source") == "local" and receipt.get("confidence", 0.0) >= min_confidence
+
+
+def to_budget_items(receipt: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn a locally parsed receipt into budget items the way the chat model is asked to:
+    the whole receipt, tax and fees included, becomes one item in its category.
+    """
+    due_date = None
+    if receipt.get("date"):
+        due_date = calendar.timegm(date.fromisoformat(receipt["date"]).timetuple())
+    name = receipt.get("merchant") or "Receipt"
+    if receipt.get("date"):
+        name = f"{name} ({receipt['date']})"
+    category = receipt["items"][0]["category"] if receipt.get("items") else guess_category(name)
+    return [{
+        "item_name": name,
+        "amount": round(receipt["total"], 2),
+        "category": category,
+        "importance_rank": 5,
+        "recurrence_schedule": None,
+        "due_date": due_date,
+    }]
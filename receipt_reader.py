@@ -1,22 +1,193 @@
 #!/usr/bin/env python3
 
+import asyncio
+import difflib
+import io
 import json
+import os
 import sys
+import time
 from PIL import Image
 import pytesseract
-import google.generativeai as genai
-from consolemain import load_config
+from image_preprocess import decode_for_ocr, preprocess_for_ocr
+from metrics import metrics
+from receipt_cache import receipt_cache, content_key, perceptual_hash
+import workers
+from model_registry import model_registry, RECEIPT_GENERATION_CONFIG
+from model_client import send_chat_message
+import receipt_parser
+from response_validator import parse_json_reply, strip_code_fence
+import settings
+
+if settings.TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_CMD
+elif os.name == "nt":
+    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+# "System" instructions for the receipt parser, placed in a user message
+RECEIPT_SYSTEM_INSTRUCTIONS = (
+    "You are an expert receipt parser. Your job is to take raw text from a store "
+    "receipt and parse out individual purchased items, their price, quantity, and "
+    "any other relevant data. Always respond in valid JSON with the structure:\n"
+    "{\n"
+    "  'items': [\n"
+    "    {\n"
+    "       'name': 'string',\n"
+    "       'price': number,\n"
+    "       'quantity': number,\n"
+    "       'category': 'string'  // optional\n"
+    "    },\n"
+    "  ],\n"
+    "  'tax': number, // if found\n"
+    "  'total': number // if found\n"
+    "}\n\n"
+    "If you cannot detect a certain value (like quantity or category), you may default "
+    "them to 1 or leave them blank, but ensure the JSON structure remains valid. "
+    "Do not include any commentary outside the JSON response."
+    "Make sure to group similar items together. If there is a large purchase and a small purchase, and both are of the same category, combine and sum them as one item."
+    "If you see a line named Total or total, take its corresponding value instead of the sum if the items can be all grouped together."
+    "Always group together add-on fees and taxes with the corresponding product/service. Never ever seperate tax from the item."
+    "Make sure to include the date the payment is due on/was completed on."
+)
+
+
+def ocr_image(image):
+    """
+    Runs the preprocessing pipeline (grayscale, crop, downscale by default; see
+    image_preprocess.py) and then Tesseract on a decoded PIL image. Returns the raw OCR text.
+    """
+    image, _ = preprocess_for_ocr(image)
+    with metrics.timer("ocr.tesseract"):
+        return pytesseract.image_to_string(image)
+
+
+def tesseract_version():
+    """
+    The installed Tesseract version, or None when it cannot be run (receipts then fail).
+    """
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return None
+
+
+def ocr_image_stream(image_stream):
+    """
+    Decodes an image stream (file-like object, e.g. an in-memory io.BytesIO) once and runs OCR on it.
+    This is CPU-bound and blocking; async callers should run it on workers.run_cpu().
+    """
+    with metrics.timer("ocr.decode"):
+        image = decode_for_ocr(image_stream)
+    return ocr_image(image)
+
+
+def decode_receipt(image_stream):
+    """
+    Decode an upload for OCR, plus its perceptual hash when near-duplicate caching is on.
+    """
+    with metrics.timer("ocr.decode"):
+        image = decode_for_ocr(image_stream)
+    phash = perceptual_hash(image) if receipt_cache.max_hash_distance > 0 else None
+    return image, phash
+
+
+async def read_receipt(image_buffer):
+    """
+    Receipt pipeline for an in-memory upload (io.BytesIO): cache lookup, decode, OCR and
+    the parse (local parser first, Gemini if it is not confident). Returns the parsed receipt JSON text.
+    Cached receipts skip OCR and the model call; a cached OCR text skips only OCR.
+    """
+    key = content_key(image_buffer.getbuffer())
+    entry = receipt_cache.get(key)
+    if entry is not None and entry["parsed"]:
+        return entry["parsed"]
+
+    ocr_text = entry["ocr_text"] if entry is not None else None
+    if ocr_text is None:
+        # Image decoding and Tesseract are CPU-bound; keep them off the event loop.
+        image, phash = await workers.run_cpu(decode_receipt, image_buffer)
+        similar = receipt_cache.find_similar(phash)
+        if similar is not None and similar["parsed"]:
+            receipt_cache.put(key, phash, ocr_text=similar["ocr_text"], parsed=similar["parsed"])
+            return similar["parsed"]
+        ocr_text = await workers.run_cpu(ocr_image, image)
+        receipt_cache.put(key, phash, ocr_text=ocr_text)
+
+    parsed = parse_locally(ocr_text)
+    if parsed is None:
+        parsed = await ai_filter_receipt_text_async(ocr_text)
+    receipt_cache.put(key, parsed=parsed)
+    return parsed
+
+
+def parse_locally(ocr_text):
+    """
+    Try the regex receipt parser. Returns its JSON text when the parse is confident enough
+    (settings.RECEIPT_LOCAL_PARSE_MIN_CONFIDENCE) to skip the model, otherwise None.
+    """
+    with metrics.timer("receipt_parser.local"):
+        receipt = receipt_parser.parse_receipt(ocr_text)
+    if receipt_parser.is_confident(receipt, settings.RECEIPT_LOCAL_PARSE_MIN_CONFIDENCE):
+        metrics.incr("receipt_parser.local_hit")
+        return json.dumps(receipt)
+    metrics.incr("receipt_parser.llm_fallback")
+    return None
+
+
+def ocr_receipt_bytes(data: bytes):
+    """
+    Decode and OCR raw image bytes. Returns (ocr_text, perceptual_hash).
+    Takes and returns only picklable values so it can run on the process pool.
+    """
+    try:
+        image, phash = decode_receipt(io.BytesIO(data))
+        if phash is None:
+            phash = perceptual_hash(image)
+        return ocr_image(image), phash
+    except Exception as e:
+        # Some library exceptions (e.g. pytesseract's) cannot be unpickled in the parent
+        # process, which would break the whole pool; re-raise as a plain RuntimeError.
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+async def ai_filter_receipt_texts_async(texts):
+    """
+    Parse several receipts' OCR text with a single Gemini call.
+    Returns one parsed JSON string per input text, in order. If the batched reply does not
+    line up with the inputs, each receipt is parsed on its own instead.
+    """
+    if len(texts) == 1:
+        return [await ai_filter_receipt_text_async(texts[0])]
+
+    prompt = (
+        f"Parse each of the following {len(texts)} receipts separately. Respond with a JSON array "
+        f"containing exactly {len(texts)} objects, one per receipt and in the same order, "
+        "each with the structure described above.\n"
+    )
+    prompt += "".join(f"<RECEIPT {i}>\n{text}\n</RECEIPT {i}>\n" for i, text in enumerate(texts, start=1))
+
+    generation_config = dict(RECEIPT_GENERATION_CONFIG)
+    generation_config["max_output_tokens"] = RECEIPT_GENERATION_CONFIG["max_output_tokens"] * len(texts)
+    try:
+        response_text = await send_chat_message(start_receipt_chat(), prompt, generation_config=generation_config)
+        parsed, _ = parse_json_reply(response_text)
+        if isinstance(parsed, list) and len(parsed) == len(texts):
+            metrics.incr("receipt_batch.llm_batched")
+            return [json.dumps(receipt) for receipt in parsed]
+    except (ValueError, TypeError):
+        pass
+
+    metrics.incr("receipt_batch.llm_fallback")
+    return list(await asyncio.gather(*(ai_filter_receipt_text_async(text) for text in texts)))
 
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 def extract_text_from_image_stream(image_stream):
     """
     Takes an image stream (a file-like object) and returns text extracted from the image,
-    then passes it to an AI parser for JSON conversion.
+    then parses it to JSON locally, or with the AI parser if the local parse is not confident.
     """
-    image = Image.open(image_stream)
-    ocr_text = pytesseract.image_to_string(image)
-    return ai_filter_receipt_text(ocr_text)
+    ocr_text = ocr_image_stream(image_stream)
+    return parse_locally(ocr_text) or ai_filter_receipt_text(ocr_text)
     #return ocr_text
 
 def ai_filter_receipt_text(text):
@@ -24,55 +195,33 @@ def ai_filter_receipt_text(text):
     Sends raw OCR text from a receipt to Gemini via google.generativeai,
     embedding the 'system' prompt in a user message (like your snippet).
     Expects valid JSON in response or a fallback structure if parsing fails.
+    Runs ai_filter_receipt_text_async on its own event loop, so the call goes through the
+    model scheduler's rate limits and retries like the server's.
     """
-    # 1. Load config & configure Gemini
-    config = load_config()
-    genai.configure(api_key=config["GEMINI_API_KEY"])
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash-exp",
-        generation_config={
-            "temperature": 0.8,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        },
-    )
+    return asyncio.run(ai_filter_receipt_text_async(text))
 
-    # 2. "System" instructions, placed in a user message
-    system_instructions = (
-        "You are an expert receipt parser. Your job is to take raw text from a store "
-        "receipt and parse out individual purchased items, their price, quantity, and "
-        "any other relevant data. Always respond in valid JSON with the structure:\n"
-        "{\n"
-        "  'items': [\n"
-        "    {\n"
-        "       'name': 'string',\n"
-        "       'price': number,\n"
-        "       'quantity': number,\n"
-        "       'category': 'string'  // optional\n"
-        "    },\n"
-        "  ],\n"
-        "  'tax': number, // if found\n"
-        "  'total': number // if found\n"
-        "}\n\n"
-        "If you cannot detect a certain value (like quantity or category), you may default "
-        "them to 1 or leave them blank, but ensure the JSON structure remains valid. "
-        "Do not include any commentary outside the JSON response."
-        "Make sure to group similar items together. If there is a large purchase and a small purchase, and both are of the same category, combine and sum them as one item."
-        "If you see a line named Total or total, take its corresponding value instead of the sum if the items can be all grouped together."
-        "Always group together add-on fees and taxes with the corresponding product/service. Never ever seperate tax from the item."
-        "Make sure to include the date the payment is due on/was completed on."
-    )
 
-    # 3. Initialize the chat session (like your snippet: "System prompt: ... Respond understood.")
-    chat_session = model.start_chat(
+async def ai_filter_receipt_text_async(text):
+    """
+    Same as ai_filter_receipt_text, but uses the SDK's async API so it does not block the event loop.
+    """
+    chat_session = start_receipt_chat()
+    response_text = await send_chat_message(chat_session, text)
+    return strip_code_fence(response_text)
+
+
+def start_receipt_chat():
+    """
+    Start a receipt parser chat primed with the system instructions.
+    """
+    model = model_registry.get_receipt_model()
+    return model.start_chat(
         history=[
             {
                 "role": "user",
                 "parts": [
                     {
-                        "text": f"System prompt: {system_instructions}\n"
+                        "text": f"System prompt: {RECEIPT_SYSTEM_INSTRUCTIONS}\n"
                                  "Respond 'Understood.' if you got it."
                     }
                 ],
@@ -84,26 +233,80 @@ def ai_filter_receipt_text(text):
         ]
     )
 
-    # 4. Now send the actual receipt text as the new user message
-    response = chat_session.send_message(text)
+def normalize_ocr_text(text):
+    """
+    Collapse runs of whitespace and drop blank lines, so layout differences don't count as errors.
+    """
+    return "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
 
-    raw_response = response.text.strip()[7:-3]
 
-    # 5. Parse the response as JSON if possible
-    #print(raw_response)
-    
-    return raw_response
+def text_accuracy(text, reference):
+    """
+    Similarity (0..1) of OCR output to a reference transcription, after normalising whitespace.
+    """
+    return difflib.SequenceMatcher(None, normalize_ocr_text(text), normalize_ocr_text(reference)).ratio()
+
+
+def _best_ocr(image, stages, repeat):
+    """
+    Best-of-`repeat` wall time for preprocessing (when stages is not None) plus Tesseract.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processed, timings = preprocess_for_ocr(image, stages) if stages is not None else (image, {})
+        text = pytesseract.image_to_string(processed)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, processed, timings, text)
+    return best
+
+
+def compare_preprocessing(image_file_path, reference_path=None, repeat=3):
+    """
+    OCR an image with and without preprocessing and report the timings and how similar
+    the two texts are. When a reference transcription exists (reference_path, or the
+    image path with a .txt extension), each text's accuracy against it is reported too.
+    """
+    with open(image_file_path, "rb") as image_file:
+        original = Image.open(image_file)
+        original.load()
+    if reference_path is None:
+        candidate = os.path.splitext(image_file_path)[0] + ".txt"
+        reference_path = candidate if os.path.exists(candidate) else None
+
+    raw_seconds, _, _, raw_text = _best_ocr(original, None, repeat)
+    processed_seconds, processed, timings, processed_text = _best_ocr(original, settings.OCR_PREPROCESS_STAGES, repeat)
+
+    similarity = difflib.SequenceMatcher(None, raw_text, processed_text).ratio()
+    report = {
+        "image": image_file_path,
+        "stages": settings.OCR_PREPROCESS_STAGES,
+        "tesseract": tesseract_version(),
+        "size": original.size,
+        "processed_size": processed.size,
+        "raw_ocr_seconds": round(raw_seconds, 4),
+        "preprocessed_ocr_seconds": round(processed_seconds, 4),
+        "speedup": round(raw_seconds / processed_seconds, 2) if processed_seconds else None,
+        "stage_seconds": {name: round(seconds, 4) for name, seconds in timings.items()},
+        "text_similarity": round(similarity, 3),
+    }
+    if reference_path:
+        with open(reference_path, encoding="utf-8") as reference_file:
+            reference = reference_file.read()
+        report["reference"] = reference_path
+        report["raw_accuracy"] = round(text_accuracy(raw_text, reference), 3)
+        report["preprocessed_accuracy"] = round(text_accuracy(processed_text, reference), 3)
+    return report
+
 
 def main():
-    image_file_path = "84pxOL1.jpg"
+    image_file_path = sys.argv[1] if len(sys.argv) > 1 else "reciept_test_1.png"
+    reference_path = sys.argv[2] if len(sys.argv) > 2 else None
     try:
-        with open(image_file_path, "rb") as image_file:
-            extracted_info = extract_text_from_image_stream(image_file)
-            #print("Extracted Info (JSON or fallback):")
-            #print(extracted_info)
+        print(json.dumps(compare_preprocessing(image_file_path, reference_path), indent=2))
     except Exception as e:
-        #print(f"An error occurred while processing the image: {e}")
-
+        print(f"An error occurred while processing the image: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,402 @@
+import calendar
+import heapq
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from budget_analytics import ItemColumns
+
+# Named schedules -> (unit, step). Units are "days" or "months".
+_NAMED = {
+    "daily": ("days", 1),
+    "weekly": ("days", 7),
+    "biweekly": ("days", 14),
+    "fortnightly": ("days", 14),
+    "monthly": ("months", 1),
+    "bimonthly": ("months", 2),
+    "quarterly": ("months", 3),
+    "semiannually": ("months", 6),
+    "semiannual": ("months", 6),
+    "biannually": ("months", 6),
+    "yearly": ("months", 12),
+    "annually": ("months", 12),
+    "annual": ("months", 12),
+}
+_EVERY = re.compile(r"^(?:every|each)\s+(?:(?P<count>\d+|other)\s+)?(?P<unit>day|week|month|quarter|year)s?$")
+_CRON_FIELD = re.compile(r"^[\d*/,\-]+$")
+# Days and months in the 400-year Gregorian cycle.
+_CYCLE_DAYS = 146097
+_CYCLE_MONTHS = 4800
+_UNIT_STEPS = {"day": ("days", 1), "week": ("days", 7), "month": ("months", 1), "quarter": ("months", 3),
+               "year": ("months", 12)}
+
+
+class Schedule:
+    """
+    A parsed recurrence_schedule.
+    - unit "days" / "months" with step: every step days or months from the anchor date
+      (month steps keep the anchor's day of month, clamped to shorter months).
+    - unit "cron": day-level cron fields (day of month, month, day of week).
+    """
+
+    def __init__(self, unit: str, step: int = 1, cron: Optional[Tuple[set, set, set, bool, bool]] = None):
+        self.unit = unit
+        self.step = step
+        self.cron = cron
+
+    def matches(self, day: date) -> bool:
+        days_of_month, months, weekdays, any_day_of_month, any_weekday = self.cron
+        if day.month not in months:
+            return False
+        in_month = day.day in days_of_month
+        # cron weekdays: 0 or 7 is Sunday; Python: Monday is 0.
+        on_weekday = (day.weekday() + 1) % 7 in weekdays
+        if any_day_of_month or any_weekday:
+            return in_month and on_weekday
+        return in_month or on_weekday
+
+    def day_mask(self, ordinals: np.ndarray) -> np.ndarray:
+        """
+        Vectorised matches() over an array of day ordinals.
+        """
+        days_of_month, months, weekdays, any_day_of_month, any_weekday = self.cron
+        dates = (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+        month_starts = dates.astype("datetime64[M]")
+        month_table = np.zeros(13, dtype=bool)
+        month_table[list(months)] = True
+        day_table = np.zeros(32, dtype=bool)
+        day_table[list(days_of_month)] = True
+        weekday_table = np.zeros(7, dtype=bool)
+        weekday_table[list(weekdays)] = True
+        in_month = day_table[(dates - month_starts.astype("datetime64[D]")).astype(np.int64) + 1]
+        # 1970-01-01 was a Thursday (cron weekday 4).
+        on_weekday = weekday_table[(ordinals - _EPOCH_ORDINAL + 4) % 7]
+        day_match = (in_month & on_weekday) if any_day_of_month or any_weekday else (in_month | on_weekday)
+        return month_table[month_starts.astype(np.int64) % 12 + 1] & day_match
+
+    def __repr__(self):
+        return f"Schedule({self.unit!r}, {self.step})"
+
+
+def _cron_values(field: str, low: int, high: int) -> set:
+    values = set()
+    for part in field.split(","):
+        body, _, step = part.partition("/")
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            start, end = (int(value) for value in body.split("-", 1))
+        else:
+            start = end = int(body)
+            if step:
+                end = high
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return {value for value in values if low <= value <= high}
+
+
+@lru_cache(maxsize=1024)
+def parse_schedule(text: Optional[str]) -> Optional[Schedule]:
+    """
+    Parse a recurrence_schedule string: "weekly", "Bi-Weekly", "every 2 weeks",
+    "every other month", "quarterly", "annually", "semi-monthly" or a 5-field cron
+    expression ("0 9 1,15 * *"; minute and hour are ignored). None means one-time or unknown.
+    """
+    if not text:
+        return None
+    text = " ".join(str(text).strip().lower().split())
+    compact = text.replace("-", "").replace(" ", "")
+    if compact in _NAMED:
+        return Schedule(*_NAMED[compact])
+    if compact in ("semimonthly", "twiceamonth", "twicemonthly"):
+        return Schedule("cron", cron=({1, 15}, set(range(1, 13)), set(range(7)), False, True))
+    match = _EVERY.match(text)
+    if match:
+        unit, step = _UNIT_STEPS[match.group("unit")]
+        count = match.group("count")
+        count = 2 if count == "other" else int(count or 1)
+        return Schedule(unit, step * count) if count > 0 else None
+    fields = text.split()
+    if len(fields) == 5 and all(_CRON_FIELD.match(field) for field in fields):
+        try:
+            days_of_month = _cron_values(fields[2], 1, 31)
+            months = _cron_values(fields[3], 1, 12)
+            weekdays = {value % 7 for value in _cron_values(fields[4], 0, 7)}
+        except ValueError:
+            return None
+        if days_of_month and months and weekdays:
+            return Schedule("cron", cron=(days_of_month, months, weekdays, fields[2] == "*", fields[4] == "*"))
+    return None
+
+
+@lru_cache(maxsize=1024)
+def monthly_factor(text: Optional[str]) -> float:
+    """
+    Average occurrences per month of a recurrence_schedule, the rate /projection settles to
+    over a long horizon; 0 for one-time or unknown schedules. Cron schedules are counted over
+    a whole 400-year Gregorian cycle, after which dates and weekdays repeat.
+    """
+    schedule = parse_schedule(text)
+    if schedule is None:
+        return 0.0
+    if schedule.unit == "days":
+        return _CYCLE_DAYS / _CYCLE_MONTHS / schedule.step
+    if schedule.unit == "months":
+        return 1.0 / schedule.step
+    first = date(2000, 1, 1).toordinal()
+    return np.count_nonzero(schedule.day_mask(np.arange(first, first + _CYCLE_DAYS, dtype=np.int64))) / _CYCLE_MONTHS
+
+
+def add_months(day: date, months: int, day_of_month: Optional[int] = None) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    last = calendar.monthrange(year, month + 1)[1]
+    return date(year, month + 1, min(day_of_month or day.day, last))
+
+
+def occurrences(schedule: Optional[Schedule], anchor: Optional[date], start: date, end: date) -> Iterator[date]:
+    """
+    Lazily yield the dates in [start, end) on which an item falls due. One-time items
+    (no schedule) fall due once, on their anchor (due date), if it is in range.
+    """
+    if schedule is None:
+        if anchor is not None and start <= anchor < end:
+            yield anchor
+        return
+    anchor = anchor or start
+    if schedule.unit == "days":
+        gap = (start - anchor).days
+        day = anchor + timedelta(days=max(0, -(-gap // schedule.step)) * schedule.step)
+        step = timedelta(days=schedule.step)
+        while day < end:
+            yield day
+            day += step
+    elif schedule.unit == "months":
+        months = (start.year - anchor.year) * 12 + start.month - anchor.month
+        k = max(0, months // schedule.step)
+        while True:
+            day = add_months(anchor, k * schedule.step, anchor.day)
+            if day >= end:
+                return
+            if day >= start:
+                yield day
+            k += 1
+    else:
+        day = max(start, anchor)
+        while day < end:
+            if schedule.matches(day):
+                yield day
+            day += timedelta(days=1)
+
+
+# Item kinds in ScheduleIndex.
+_SKIP, _ONCE, _DAYS, _MONTHS, _CRON = range(5)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _month_index(ordinals: np.ndarray) -> np.ndarray:
+    """
+    Day ordinals -> months since 1970-01.
+    """
+    return (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _month_day(months: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    Day ordinal of day days (clamped to the month's length) in months since 1970-01.
+    """
+    first = months.astype("datetime64[M]").astype("datetime64[D]")
+    length = ((months + 1).astype("datetime64[M]").astype("datetime64[D]") - first).astype(np.int64)
+    return first.astype(np.int64) + np.minimum(days, length) - 1 + _EPOCH_ORDINAL
+
+
+def _tagged(days: Iterator[date], index: int) -> Iterator[Tuple[date, int]]:
+    for day in days:
+        yield day, index
+
+
+class ScheduleIndex:
+    """
+    Items of one budget with their schedules parsed (once per distinct schedule string)
+    and anchors as day ordinals in NumPy arrays, plus a sorted index of each item's next
+    due date. Built once per budget revision; projections and upcoming lookups reuse it.
+    Items with neither a schedule nor a due date are left out.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], today: date):
+        self.today = today
+        self.items = items
+        self.columns = columns = ItemColumns(items)
+        parsed = [parse_schedule(schedule) for schedule in columns.schedules]
+        self.schedules = [parsed[code] for code in columns.schedule_codes]
+
+        unit_kinds = np.array([_ONCE if schedule is None else {"days": _DAYS, "months": _MONTHS}.get(schedule.unit, _CRON)
+                               for schedule in parsed] or [_ONCE], dtype=np.int8)
+        unit_steps = np.array([schedule.step if schedule is not None else 0 for schedule in parsed] or [0],
+                              dtype=np.int64)
+        self.kinds = unit_kinds[columns.schedule_codes] if len(items) else np.zeros(0, dtype=np.int8)
+        self.steps = unit_steps[columns.schedule_codes] if len(items) else np.zeros(0, dtype=np.int64)
+
+        due = ItemColumns._numbers([item.get("due_date") for item in items], np.nan)
+        has_due = np.isfinite(due)
+        self.kinds[(self.kinds == _ONCE) & ~has_due] = _SKIP
+        # Recurring items without a due date are anchored on today.
+        anchor_days = np.where(has_due, np.floor(np.where(has_due, due, 0) / 86400), today.toordinal() - _EPOCH_ORDINAL)
+        self.anchors = anchor_days.astype(np.int64) + _EPOCH_ORDINAL
+        self.anchor_months = _month_index(self.anchors)
+        self.anchor_days = self.anchors - _month_day(self.anchor_months, np.ones_like(self.anchors)) + 1
+        self.upcoming_dates, self.upcoming_items = self._build_upcoming()
+
+    def _anchor(self, index: int) -> date:
+        return date.fromordinal(int(self.anchors[index]))
+
+    def _next_due(self, day: date) -> np.ndarray:
+        """
+        Ordinal of every item's first due date on or after day (-1 if none).
+        """
+        target = day.toordinal()
+        steps = np.maximum(self.steps, 1)
+        result = np.full(len(self.items), -1, dtype=np.int64)
+
+        once = self.kinds == _ONCE
+        result[once & (self.anchors >= target)] = self.anchors[once & (self.anchors >= target)]
+
+        days = self.kinds == _DAYS
+        periods = np.maximum(0, -((self.anchors[days] - target) // steps[days]))
+        result[days] = self.anchors[days] + periods * steps[days]
+
+        months = self.kinds == _MONTHS
+        if months.any():
+            month_steps = steps[months]
+            periods = np.maximum(0, -((self.anchor_months[months] - _month_index(np.array([target]))[0]) // month_steps))
+            candidate = self.anchor_months[months] + periods * month_steps
+            due = _month_day(candidate, self.anchor_days[months])
+            late = due < target
+            due[late] = _month_day(candidate[late] + month_steps[late], self.anchor_days[months][late])
+            result[months] = due
+
+        for rows, schedule in self._cron_groups():
+            first = np.maximum(self.anchors[rows], target)
+            low = int(first.min())
+            # Search far enough past the latest start for day/weekday combinations (e.g. Feb 29 on a Monday).
+            span = int(first.max()) - low + 366 * 8
+            matches = np.nonzero(schedule.day_mask(np.arange(low, low + span, dtype=np.int64)))[0] + low
+            positions = np.searchsorted(matches, first)
+            found = positions < len(matches)
+            result[rows[found]] = matches[positions[found]]
+        return result
+
+    def _cron_groups(self):
+        """
+        (item indexes, schedule) for each distinct cron schedule string.
+        """
+        cron = self.kinds == _CRON
+        for code in np.unique(self.columns.schedule_codes[cron]):
+            rows = np.nonzero(cron & (self.columns.schedule_codes == code))[0]
+            yield rows, self.schedules[rows[0]]
+
+    def _build_upcoming(self):
+        """
+        (next due date ordinals, item indexes), sorted by date, for due dates from today on.
+        """
+        next_due = self._next_due(self.today)
+        indexes = np.nonzero(next_due >= 0)[0]
+        order = indexes[np.argsort(next_due[indexes], kind="stable")]
+        return next_due[order], order
+
+    def _event(self, day: date, index: int) -> Dict[str, Any]:
+        item = self.items[index]
+        return {
+            "date": day.isoformat(),
+            "id": item.get("id"),
+            "item_name": item.get("item_name"),
+            "amount": round(float(self.columns.amounts[index]), 2),
+            "category": self.columns.categories[self.columns.category_codes[index]],
+        }
+
+    def upcoming(self, days: int = 30, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Items whose next due date is within the next days days, soonest first (binary search).
+        """
+        stop = int(np.searchsorted(self.upcoming_dates, (self.today + timedelta(days=days)).toordinal()))
+        return [self._event(date.fromordinal(int(self.upcoming_dates[position])), int(self.upcoming_items[position]))
+                for position in range(min(stop, limit))]
+
+    def timeline(self, start: date, end: date) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily merged cash-flow events in [start, end), in date order. Only as many item
+        occurrences are generated as the caller consumes.
+        """
+        streams = [
+            _tagged(occurrences(self.schedules[index], self._anchor(index), start, end), int(index))
+            for index in np.nonzero(self.kinds != _SKIP)[0]
+        ]
+        for day, index in heapq.merge(*streams):
+            yield self._event(day, index)
+
+    def projection(self, start: date, months: int) -> Dict[str, Any]:
+        """
+        Expected spending per calendar month for months months from start (the first
+        month counts from start's day). Day and month schedules are counted in closed
+        form with NumPy over an items x months grid; cron schedules from one day mask per
+        distinct schedule.
+        """
+        month_starts = [add_months(start.replace(day=1), offset) for offset in range(months + 1)]
+        bounds = np.array([start.toordinal()] + [day.toordinal() for day in month_starts[1:]], dtype=np.int64)
+        end = month_starts[-1]
+        counts = np.zeros((len(self.items), months), dtype=np.float64)
+
+        once = np.nonzero((self.kinds == _ONCE) & (self.anchors >= bounds[0]) & (self.anchors < bounds[-1]))[0]
+        counts[once, np.searchsorted(bounds, self.anchors[once], side="right") - 1] = 1
+
+        days = np.nonzero(self.kinds == _DAYS)[0]
+        if len(days):
+            # Occurrences before x: ceil((x - anchor) / step), at least 0.
+            anchors = self.anchors[days][:, None]
+            steps = self.steps[days][:, None]
+            before = np.maximum(0, -((anchors - bounds[None, :]) // steps))
+            counts[days] = np.diff(before, axis=1)
+
+        month_rows = np.nonzero(self.kinds == _MONTHS)[0]
+        if len(month_rows):
+            offsets = (self.anchor_months[month_rows] - _month_index(bounds[:1])[0])[:, None]
+            steps = self.steps[month_rows][:, None]
+            periods = np.arange(months, dtype=np.int64)[None, :]
+            due = (periods >= offsets) & ((periods - offsets) % steps == 0)
+            # In the first, partial month the clamped due day must not be before start.
+            first_due = _month_day(np.full(len(month_rows), _month_index(bounds[:1])[0]), self.anchor_days[month_rows])
+            due[:, 0] &= first_due >= bounds[0]
+            counts[month_rows] = due
+
+        for rows, schedule in self._cron_groups():
+            # matched[k]: matching days before bounds[0] + k. An item counts the matches in
+            # [max(month start, anchor), next month start).
+            mask = schedule.day_mask(np.arange(bounds[0], bounds[-1], dtype=np.int64))
+            matched = np.concatenate(([0], np.cumsum(mask)))
+            starts = np.clip(np.maximum(bounds[None, :-1], self.anchors[rows][:, None]), bounds[0], bounds[-1])
+            counts[rows] = np.maximum(0, matched[bounds[None, 1:] - bounds[0]] - matched[starts - bounds[0]])
+
+        spending = counts * self.columns.amounts[:, None]
+        totals = spending.sum(axis=0)
+        # Sum the rows per category: one bincount over (category, month) cells.
+        cells = self.columns.category_codes[:, None] * months + np.arange(months)[None, :]
+        by_category = np.bincount(cells.ravel(), weights=spending.ravel(),
+                                  minlength=len(self.columns.categories) * months).reshape(-1, months)
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "total": round(float(totals.sum()), 2),
+            "months": [
+                {
+                    "month": month_starts[offset].strftime("%Y-%m"),
+                    "total": round(float(totals[offset]), 2),
+                    "by_category": {
+                        self.columns.categories[code]: round(float(by_category[code, offset]), 2)
+                        for code in np.nonzero(by_category[:, offset])[0]
+                    },
+                }
+                for offset in range(months)
+            ],
+        }
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import re
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+import settings
+from metrics import metrics
+
+_PUNCTUATION = re.compile(r"[^\w\s$%.]|(?<!\d)\.|\.(?!\d)")
+_FILLER = {
+    "please", "pls", "hey", "hi", "hello", "can", "could", "would", "you", "kindly", "thanks",
+    "thank", "just", "the", "a", "an", "my", "me", "i", "for", "now", "again",
+}
+_CONTRACTIONS = {"what's": "what is", "how's": "how is", "where's": "where is", "i'm": "i am"}
+
+# Messages that change the budget (edit verbs, or any amount) are never answered from the cache.
+_EDIT_WORDS = re.compile(
+    r"\b(?:add|set|change|update|remove|delete|increase|decrease|raise|lower|make|put|move|rename|"
+    r"cut|reduce|drop|replace|create|edit|adjust)\b|\d"
+)
+
+# Read-only questions answered from the items alone, without a model call. Each pattern must
+# match the whole normalised message, so questions that merely mention these words ("how much
+# should I spend on groceries?", "should I limit dining out?") still go to the model.
+_ASK = r"(?:(?:what is|what are|how much is|how much are|tell|show|give|list|see|view|display) )?"
+_NOW = r"(?: (?:currently|today|so far|this month|right now|at moment|in total|altogether|overall))?"
+_SURPLUS = re.compile(
+    _ASK + r"(?:current |budget |monthly )?(?:surplus|deficit|leftover|left over|remaining budget|budget remaining)"
+    + _NOW + r"|how much (?:money |budget )?(?:do |is |have |has )*(?:left|remaining)(?: over| in budget)?" + _NOW
+    + r"|(?:am|are we|is budget) over budget" + _NOW
+)
+_TOTAL = re.compile(
+    _ASK + r"(?:total |overall |current |monthly )?(?:spending|expenses|costs|outgoings)(?: total)?" + _NOW
+    + r"|how much (?:do |am |have |are we )?(?:spend|spending|spent)" + _NOW
+)
+_CATEGORY = re.compile(
+    _ASK + r"(?:spending |expenses |costs |budget )?(?:breakdown |summary |totals? |split )?(?:by|per|each) category"
+    + r"|" + _ASK + r"(?:spending |expenses |budget )?category (?:breakdown|summary|totals?|split)"
+    + r"|(?:summarise|summarize|break down|split) (?:spending|expenses|costs|budget) by categor(?:y|ies)"
+)
+_SHOW = re.compile(
+    r"(?:show|list|display|view|see|what is in|what are)(?: all)?"
+    r" (?:budget|items|expenses|budget items|items in budget|expenses in budget)"
+)
+_LIMIT = re.compile(_ASK + r"(?:budget|spending|monthly) limit|how much is budget")
+
+# Cached model replies are only reused for self-contained questions about the budget. Replies
+# that depend on the conversation ("why?", "and the next one?", "explain that") are not.
+_BUDGET_TOPIC = re.compile(
+    r"\b(?:budget|surplus|deficit|spend\w*|spent|expenses?|costs?|items?|categor(?:y|ies)|limit|"
+    r"sav(?:e|ing|ings)|total|bills?|subscriptions?|income|afford|money)\b"
+)
+_CONTEXTUAL = re.compile(
+    r"\b(?:it|its|that|this|those|these|them|they|he|she|why|next|previous|last|above|earlier|explain|"
+    r"more|else|also|instead|other|same|one|ones|so|then|and|or|but|ok|okay|yes|no)\b"
+)
+
+CLOSING = " How else can I help with your budget?"
+
+
+def normalise_message(text: str) -> str:
+    """
+    Cache key form of a chat message: lower case, contractions expanded, punctuation and
+    filler words ("please", "can you", ...) removed, whitespace collapsed.
+    """
+    text = (text or "").lower()
+    for short, long in _CONTRACTIONS.items():
+        text = text.replace(short, long)
+    words = _PUNCTUATION.sub(" ", text).split()
+    return " ".join(word for word in words if word not in _FILLER)
+
+
+def budget_hash(state_dict: Dict[str, Any]) -> str:
+    """
+    Hash of the parts of the budget an answer can depend on (limit and items).
+    """
+    budget = state_dict.get("Budget") or {}
+    content = {"budget_limit": budget.get("budget_limit"), "items": budget.get("items") or []}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def embed(text: str, dimensions: int = 256) -> np.ndarray:
+    """
+    Local text embedding: hashed word, word-pair and character-trigram counts, L2 normalised.
+    Cheap and deterministic, good enough to match rephrasings of short budget questions.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    words = text.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {text} "
+    features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        vector[zlib.crc32(feature.encode("utf-8")) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _money(value) -> str:
+    return f"${value:,.2f}"
+
+
+def cacheable_question(message: str) -> bool:
+    """
+    Whether a model reply to message may be cached and reused: a read-only question about the
+    budget that stands on its own, without an edit verb, an amount or a reference to earlier turns.
+    """
+    text = normalise_message(message)
+    return bool(text) and not _EDIT_WORDS.search(text) and bool(_BUDGET_TOPIC.search(text)) \
+        and not _CONTEXTUAL.search(text)
+
+
+def local_answer(message: str, state_dict: Dict[str, Any]) -> Optional[str]:
+    """
+    Answer common read-only budget questions (surplus, total spending, category breakdown,
+    item list, budget limit) straight from the items. Returns None for anything else.
+    """
+    text = normalise_message(message)
+    if not text or _EDIT_WORDS.search(text):
+        return None
+    budget = state_dict.get("Budget") or {}
+    items = budget.get("items") or []
+    limit = budget.get("budget_limit")
+    total = round(sum(float(item.get("amount") or 0) for item in items), 2)
+
+    if _CATEGORY.fullmatch(text):
+        if not items:
+            return "Your budget has no items yet." + CLOSING
+        totals = defaultdict(float)
+        for item in items:
+            totals[item.get("category") or "Uncategorised"] += float(item.get("amount") or 0)
+        lines = [f"{category}: {_money(amount)} ({amount / total * 100 if total else 0:.0f}%)"
+                 for category, amount in sorted(totals.items(), key=lambda entry: -entry[1])]
+        return "Here is your spending by category:\n" + "\n".join(lines) + f"\nTotal: {_money(total)}." + CLOSING
+    if _SHOW.fullmatch(text):
+        if not items:
+            return "Your budget has no items yet." + CLOSING
+        lines = [f"{item.get('item_name')}: {_money(float(item.get('amount') or 0))} ({item.get('category') or 'Uncategorised'})"
+                 for item in items]
+        summary = f"Total expenses: {_money(total)}"
+        if limit is not None:
+            summary += f" of a {_money(limit)} limit, leaving {_money(limit - total)}"
+        return "Here is your budget:\n" + "\n".join(lines) + f"\n{summary}." + CLOSING
+    if _SURPLUS.fullmatch(text):
+        if limit is None:
+            return f"You have not set a budget limit yet; your expenses total {_money(total)}." + CLOSING
+        surplus = round(limit - total, 2)
+        if surplus >= 0:
+            return (f"Your budget surplus is {_money(surplus)}: expenses of {_money(total)} "
+                    f"against a limit of {_money(limit)}." + CLOSING)
+        return (f"You are over budget by {_money(-surplus)}: expenses of {_money(total)} "
+                f"against a limit of {_money(limit)}. Consider trimming your lowest-importance items." + CLOSING)
+    if _TOTAL.fullmatch(text):
+        return f"Your expenses total {_money(total)} across {len(items)} items." + CLOSING
+    if _LIMIT.fullmatch(text):
+        if limit is None:
+            return "You have not set a budget limit yet." + CLOSING
+        return f"Your budget limit is {_money(limit)}." + CLOSING
+    return None
+
+
+class _Scope:
+    """
+    Cached replies for one session, all valid for the budget with hash state_hash.
+    """
+
+    def __init__(self, state_hash: str):
+        self.state_hash = state_hash
+        self.replies: "OrderedDict[str, str]" = OrderedDict()
+        self.vectors: Dict[str, np.ndarray] = {}
+
+
+class ResponseCache:
+    """
+    Replies to read-only chat turns, keyed by session, budget hash and normalised message.
+    A scope's entries are dropped as soon as the session's budget hash changes, so a cached
+    answer is never served for a different budget. With similarity > 0, a message that is
+    not cached verbatim can also match an earlier one by local embedding (cosine similarity).
+    """
+
+    def __init__(self, max_sessions: int, max_entries: int, similarity: float = 0.0, local_answers: bool = True):
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.local_answers = local_answers
+        self._scopes: "OrderedDict[str, _Scope]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _scope(self, scope_id: str, state_hash: str) -> _Scope:
+        """
+        The scope for a session, emptied if the budget changed. Lock must be held.
+        """
+        scope = self._scopes.get(scope_id)
+        if scope is None or scope.state_hash != state_hash:
+            if scope is not None and scope.replies:
+                metrics.incr("response_cache.invalidated", len(scope.replies))
+            scope = _Scope(state_hash)
+            self._scopes[scope_id] = scope
+        self._scopes.move_to_end(scope_id)
+        while len(self._scopes) > self.max_sessions:
+            self._scopes.popitem(last=False)
+        return scope
+
+    def lookup(self, scope_id: str, state_dict: Dict[str, Any], message: str) -> Optional[str]:
+        """
+        A reply for message without calling the model, or None.
+        Tries the local read-only answers, then the exact cache, then similar messages.
+        """
+        if self.local_answers:
+            reply = local_answer(message, state_dict)
+            if reply is not None:
+                metrics.incr("response_cache.local")
+                return reply
+        if not cacheable_question(message):
+            return None
+        key = normalise_message(message)
+        state_hash = budget_hash(state_dict)
+        with self._lock:
+            scope = self._scope(scope_id, state_hash)
+            reply = scope.replies.get(key)
+            if reply is not None:
+                scope.replies.move_to_end(key)
+                metrics.incr("response_cache.hit")
+                return reply
+            if self.similarity > 0 and scope.vectors:
+                keys = list(scope.vectors)
+                scores = np.stack([scope.vectors[k] for k in keys]) @ embed(key)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    metrics.incr("response_cache.hit.similar")
+                    return scope.replies[keys[best]]
+        metrics.incr("response_cache.miss")
+        return None
+
+    def store(self, scope_id: str, state_dict: Dict[str, Any], message: str, reply: str):
+        """
+        Remember the reply to a turn that left the budget unchanged, if the message is a
+        self-contained budget question (see cacheable_question).
+        """
+        if not reply or not cacheable_question(message):
+            metrics.incr("response_cache.skipped")
+            return
+        key = normalise_message(message)
+        with self._lock:
+            scope = self._scope(scope_id, budget_hash(state_dict))
+            scope.replies[key] = reply
+            scope.replies.move_to_end(key)
+            if self.similarity > 0:
+                scope.vectors[key] = embed(key)
+            while len(scope.replies) > self.max_entries:
+                evicted, _ = scope.replies.popitem(last=False)
+                scope.vectors.pop(evicted, None)
+        metrics.incr("response_cache.stored")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._scopes), "entries": sum(len(scope.replies) for scope in self._scopes.values())}
+
+
+response_cache = ResponseCache(
+    max_sessions=settings.RESPONSE_CACHE_SESSIONS,
+    max_entries=settings.RESPONSE_CACHE_ENTRIES,
+    similarity=settings.RESPONSE_CACHE_SIMILARITY,
+    local_answers=settings.RESPONSE_CACHE_LOCAL_ANSWERS,
+)
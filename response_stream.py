@@ -0,0 +1,93 @@
+import re
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_FIELD_START = re.compile(r'"ai_response"\s*:\s*"')
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+
+
+def _hex4(text: str):
+    """
+    The value of a 4-digit \\u escape, or None if text is not exactly four hex digits.
+    """
+    return int(text, 16) if _HEX4.fullmatch(text) else None
+
+
+class AiResponseExtractor:
+    """
+    Pulls the conversation.ai_response string out of a chat reply while it is still being
+    generated, so the text can be shown before the whole JSON document has arrived.
+
+    feed() takes the next chunk of raw model output and returns the newly decoded part of
+    the ai_response value (possibly ""). JSON string escapes are decoded, including ones
+    split across chunks. Everything else in the reply is ignored here; the complete text is
+    parsed as usual once the stream ends.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_value = False
+        self.done = False
+        self.text = ""
+
+    def feed(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        self._buffer += chunk
+        if not self._in_value:
+            match = _FIELD_START.search(self._buffer)
+            if match is None:
+                # Keep only a tail long enough to hold a key split across chunks.
+                if len(self._buffer) > 64:
+                    self._buffer = self._buffer[-64:]
+                return ""
+            self._in_value = True
+            self._buffer = self._buffer[match.end():]
+
+        decoded = []
+        buffer, i = self._buffer, 0
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            # Escape sequence; wait for more input if it is incomplete.
+            if i + 1 >= len(buffer):
+                break
+            code = buffer[i + 1]
+            if code == "u":
+                if i + 6 > len(buffer):
+                    break
+                codepoint = _hex4(buffer[i + 2:i + 6])
+                if codepoint is not None and 0xD800 <= codepoint < 0xDC00:
+                    # High surrogate: needs the following \uXXXX low surrogate.
+                    if i + 8 <= len(buffer) and buffer[i + 6:i + 8] != "\\u":
+                        codepoint = None
+                    elif i + 12 > len(buffer):
+                        break
+                    else:
+                        low = _hex4(buffer[i + 8:i + 12])
+                        if low is not None and 0xDC00 <= low < 0xE000:
+                            decoded.append(chr(0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)))
+                            i += 12
+                            continue
+                        codepoint = None
+                if codepoint is None or 0xDC00 <= codepoint < 0xE000:
+                    # Malformed or unpaired escape from the model: show it as written. Only
+                    # the backslash-u is consumed, so a closing quote after it still ends the value.
+                    decoded.append(buffer[i:i + 2])
+                    i += 2
+                else:
+                    decoded.append(chr(codepoint))
+                    i += 6
+            else:
+                decoded.append(_ESCAPES.get(code, code))
+                i += 2
+        self._buffer = buffer[i:]
+        text = "".join(decoded)
+        self.text += text
+        return text
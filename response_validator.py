@@ -0,0 +1,230 @@
+import json
+import re
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+import settings
+from metrics import metrics
+from model_client import generate_text
+from model_registry import model_registry
+from prompt_builder import RESPONSE_SCHEMA
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_NUMBER_TEXT = re.compile(r"^\s*\(?\s*-?\s*[$€£]?\s*-?[\d,]*\.?\d+\s*\)?\s*$")
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    Remove a surrounding markdown code fence (```json ... ```) from a model reply, if present.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def _to_number(value):
+    """
+    Coerce "1,200.50", "$45", "(12.00)" and similar model-written strings to numbers.
+    Anything else is returned unchanged for the type check to reject.
+    """
+    if isinstance(value, str) and _NUMBER_TEXT.match(value):
+        negative = "(" in value or "-" in value
+        number = float(re.sub(r"[^\d.]", "", value))
+        return -number if negative else number
+    return value
+
+
+# Pydantic models mirroring prompt_builder.RESPONSE_SCHEMA. Extra keys are ignored.
+
+class ItemFields(BaseModel):
+    item_name: Optional[str] = None
+    amount: Optional[float] = None
+    category: Optional[str] = None
+    importance_rank: Optional[int] = None
+    recurrence_schedule: Optional[str] = None
+    due_date: Optional[float] = None
+
+    @field_validator("amount", "due_date", mode="before")
+    @classmethod
+    def _numbers(cls, value):
+        return _to_number(value)
+
+    @field_validator("importance_rank", mode="before")
+    @classmethod
+    def _rank(cls, value):
+        value = _to_number(value)
+        if isinstance(value, float):
+            value = int(round(value))
+        if isinstance(value, int):
+            value = min(10, max(1, value))
+        return value
+
+
+class BudgetItem(ItemFields):
+    """
+    An entry of a full items list. The id is kept, so items the model sends back whole
+    keep their identity (see budget_delta.ensure_item_ids).
+    """
+    id: Optional[str] = None
+
+    @field_validator("id", mode="before")
+    @classmethod
+    def _id(cls, value):
+        return str(value) if isinstance(value, int) and not isinstance(value, bool) else value
+
+
+class ItemOperation(BaseModel):
+    op: Literal["add", "update", "remove"]
+    id: Optional[str] = None
+    item: Optional[ItemFields] = None
+
+
+class BudgetReply(BaseModel):
+    budget_limit: Optional[float] = None
+    warnings: List[str] = []
+    operations: Optional[List[ItemOperation]] = None
+    # Older replies (or a model ignoring instructions) may still send the full list.
+    items: Optional[List[BudgetItem]] = None
+
+    @field_validator("budget_limit", mode="before")
+    @classmethod
+    def _limit(cls, value):
+        return _to_number(value)
+
+    @field_validator("warnings", mode="before")
+    @classmethod
+    def _warnings(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return value
+
+
+class ConversationReply(BaseModel):
+    user_message: str = ""
+    ai_response: str
+
+
+class ChatReply(BaseModel):
+    conversation: Optional[ConversationReply] = None
+    Budget: Optional[BudgetReply] = None
+
+    @model_validator(mode="after")
+    def _not_empty(self):
+        if self.conversation is None and self.Budget is None:
+            raise ValueError("reply has neither conversation nor Budget")
+        return self
+
+
+def _candidates(text: str):
+    """
+    Yield (repair_name, text) attempts, cheapest first.
+    """
+    yield None, text
+    stripped = strip_code_fence(text)
+    if stripped != text:
+        yield "code_fence", stripped
+    start = stripped.find("{")
+    if start < 0:
+        return
+    try:
+        # Text before or after the JSON object: take the first complete object.
+        _, end = json.JSONDecoder().raw_decode(stripped[start:])
+        if stripped[start:start + end] != stripped:
+            yield "surrounding_text", stripped[start:start + end]
+    except ValueError:
+        pass
+    end = stripped.rfind("}")
+    if end > start:
+        yield "trailing_comma", _TRAILING_COMMA.sub(r"\1", stripped[start:end + 1])
+
+
+def parse_json_reply(text: str) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    json.loads with local repairs for common model defects: code fences, text around the
+    object and trailing commas. Returns (value, repair_name) or (None, None).
+    """
+    for repair, candidate in _candidates(text or ""):
+        try:
+            return json.loads(candidate), repair
+        except ValueError:
+            continue
+    return None, None
+
+
+def validate_chat_reply(text: str) -> Tuple[Optional[Dict[str, Any]], List[str], Optional[str]]:
+    """
+    Parse, repair and validate a chat model reply against ChatReply.
+    Returns (reply dict or None, repairs applied, error message or None).
+    """
+    repairs = []
+    value, repair = parse_json_reply(text)
+    if repair:
+        repairs.append(repair)
+    if value is None:
+        return None, repairs, "reply is not valid JSON"
+    if isinstance(value, dict) and isinstance(value.get("conversation"), str):
+        value["conversation"] = {"ai_response": value["conversation"]}
+        repairs.append("conversation_string")
+    budget = value.get("Budget") if isinstance(value, dict) else None
+    if isinstance(budget, dict) and isinstance(budget.get("operations"), list):
+        # Drop malformed operations rather than rejecting the whole turn.
+        operations = [operation for operation in budget["operations"]
+                      if isinstance(operation, dict) and operation.get("op") in ("add", "update", "remove")]
+        if len(operations) != len(budget["operations"]):
+            budget["operations"] = operations
+            repairs.append("dropped_operations")
+    try:
+        reply = ChatReply.model_validate(value)
+    except ValidationError as e:
+        return None, repairs, "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()[:5]
+        )
+    return reply.model_dump(exclude_unset=True), repairs, None
+
+
+def record(outcome: str, repairs: List[str]):
+    metrics.incr(f"response_validator.{outcome}")
+    for repair in repairs:
+        metrics.incr(f"response_validator.repair.{repair}")
+
+
+async def parse_chat_reply(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Validated chat reply as a dict (only the fields the model sent), or None if it could
+    not be repaired. Local repairs are tried first. Only when they fail is the model asked,
+    in a single short call without the chat history, to fix its own output against the
+    validation error. The outcome is counted under response_validator.* in /stats.
+    """
+    with metrics.timer("chat.parse"):
+        reply, repairs, error = validate_chat_reply(text)
+    if reply is not None:
+        record("repaired" if repairs else "valid", repairs)
+        return reply
+
+    for _ in range(settings.RESPONSE_REPAIR_RETRIES):
+        metrics.incr("response_validator.retried")
+        prompt = (
+            "Your previous reply does not match the required JSON schema.\n"
+            f"Problem: {error}\n"
+            f"Schema: {RESPONSE_SCHEMA}\n"
+            "Return only the corrected JSON, keeping the same content.\n"
+            f"<REPLY>\n{text}\n</REPLY>"
+        )
+        try:
+            text = await generate_text(model_registry.get_chat_model(), prompt)
+        except Exception as e:
+            error = str(e)
+            break
+        reply, repairs, error = validate_chat_reply(text)
+        if reply is not None:
+            record("retry_fixed", repairs)
+            return reply
+
+    record("invalid", repairs)
+    return None
@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+import settings
+from metrics import metrics
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    _RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                          google_exceptions.ServiceUnavailable)
+except ImportError:
+    _RATE_LIMIT_ERRORS = ()
+
+# Lower runs first. Summaries and reply repairs ("generate") are part of a chat turn.
+PRIORITIES = {"chat": 0, "generate": 0, "receipt": 1}
+
+
+class ModelOverloaded(HTTPException):
+    """
+    A model call that could not be started before its deadline (queue full, quota used up,
+    or still rate limited after the retries). Answered as 429 with Retry-After.
+    """
+
+    def __init__(self, retry_after: float, reason: str):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=429, detail=f"The assistant is busy ({reason}); try again shortly",
+                         headers={"Retry-After": str(self.retry_after)})
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """
+    Quota and overload errors from Gemini (429 / 503), which are worth retrying.
+    """
+    return isinstance(error, _RATE_LIMIT_ERRORS) or getattr(error, "code", None) in (429, 503)
+
+
+class TokenBucket:
+    """
+    Refills at rate units per second up to capacity. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until amount (capped at the capacity, so one large call can still run) is available.
+        """
+        pause = max(0.0, self.paused_until - now)
+        if not self.rate:
+            return pause
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(pause, missing / self.rate if missing > 0 else 0.0)
+
+    def take(self, amount: float, now: float):
+        if self.rate:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def pause(self, seconds: float, now: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Waiter:
+    def __init__(self, priority: int, tokens: float, future: asyncio.Future):
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+
+
+class ModelScheduler:
+    """
+    Admission control in front of every Gemini call of this process:
+    - token buckets for requests and prompt tokens per minute, matched to the project's quota
+      (the quota is shared by the server's worker processes, so each gets its share);
+    - at most max_concurrency calls running at once;
+    - one bounded queue per priority: chat before receipt parsing, first come first served
+      within a priority;
+    - a deadline on the time a call may wait. A call that cannot start in time (queue full,
+      or the estimated wait is longer than its deadline) fails at once with ModelOverloaded;
+    - rate-limit errors are retried with full-jitter exponential backoff, and hold back
+      every other call for the backoff too, so the quota is not hammered.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_concurrency: int,
+                 queue_size: int, burst_seconds: float, workers: int = 1):
+        workers = max(1, workers)
+        request_rate = requests_per_minute / 60 / workers
+        token_rate = tokens_per_minute / 60 / workers
+        self.requests = TokenBucket(request_rate, request_rate * burst_seconds)
+        self.tokens = TokenBucket(token_rate, token_rate * burst_seconds)
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.running = 0
+        self._queue: List[Any] = []
+        self._queued: Dict[int, int] = {}
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.shed = 0
+        self.retries = 0
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _start(self, tokens: float, now: float):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.running += 1
+
+    def _dispatch(self):
+        """
+        Start queued calls in priority order while there is capacity; if the next one has
+        to wait for the buckets, come back when it can run.
+        """
+        self._timer = None
+        while self._queue and self.running < self.max_concurrency:
+            waiter = self._queue[0][2]
+            if waiter.future.done():
+                # Gave up waiting (and was already uncounted).
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            wait = self._wait_time(waiter.tokens, now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._queued[waiter.priority] -= 1
+            self._start(waiter.tokens, now)
+            waiter.future.set_result(None)
+
+    def _shed(self, retry_after: float, reason: str) -> ModelOverloaded:
+        self.shed += 1
+        metrics.incr(f"scheduler.shed.{reason.replace(' ', '_')}")
+        return ModelOverloaded(retry_after, reason)
+
+    def _abandon(self, waiter: _Waiter):
+        waiter.future.cancel()
+        self._queued[waiter.priority] -= 1
+
+    async def acquire(self, role: str, tokens: float, deadline: float):
+        """
+        Wait for a slot to make one call, until deadline (time.monotonic()).
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Calls queued on an earlier event loop (scripts calling asyncio.run repeatedly) are gone.
+            self._loop, self._queue, self._queued, self._timer, self.running = loop, [], {}, None, 0
+        priority = PRIORITIES.get(role, 0)
+        now = time.monotonic()
+        ahead = sum(count for level, count in self._queued.items() if level <= priority)
+        if not ahead and self.running < self.max_concurrency and self._wait_time(tokens, now) == 0:
+            self._start(tokens, now)
+            return
+        if self._queued.get(priority, 0) >= self.queue_size:
+            raise self._shed(self._wait_time(tokens, now) + 1, "queue full")
+        # Rough wait behind the calls queued ahead: their share of the request bucket.
+        estimate = self._wait_time(tokens, now)
+        if self.requests.rate:
+            estimate = max(estimate, ahead / self.requests.rate)
+        if now + estimate > deadline:
+            raise self._shed(estimate, "over quota")
+
+        waiter = _Waiter(priority, tokens, loop.create_future())
+        heapq.heappush(self._queue, (priority, next(self._order), waiter))
+        self._queued[priority] = self._queued.get(priority, 0) + 1
+        if self._timer is None:
+            self._dispatch()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # Started just as the deadline passed; the slot is ours.
+                return
+            self._abandon(waiter)
+            raise self._shed(self._wait_time(tokens, time.monotonic()) + 1, "queue timeout")
+        except BaseException:
+            if waiter.future.done():
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+        finally:
+            metrics.add_stage(f"scheduler.wait.{role}", time.perf_counter() - started)
+
+    def release(self):
+        self.running -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    async def run(self, role: str, tokens: float, call: Callable[[], Awaitable[Any]],
+                  can_retry: Callable[[], bool] = lambda: True):
+        """
+        Run call() (one upstream model request) once admitted, retrying rate-limit errors
+        while can_retry() and the role's queue deadline allow.
+        """
+        deadline = time.monotonic() + (settings.MODEL_RECEIPT_QUEUE_SECONDS if role == "receipt"
+                                       else settings.MODEL_CHAT_QUEUE_SECONDS)
+        for attempt in itertools.count():
+            await self.acquire(role, tokens, deadline)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limited(e) or not can_retry():
+                    raise
+                metrics.incr("scheduler.rate_limited")
+                backoff = min(settings.MODEL_RETRY_MAX_MS, settings.MODEL_RETRY_BASE_MS * 2 ** attempt) / 1000
+                delay = random.uniform(0, backoff)
+                self.requests.pause(delay, time.monotonic())
+                if attempt >= settings.MODEL_RETRY_ATTEMPTS or time.monotonic() + delay > deadline:
+                    raise self._shed(delay, "rate limited") from e
+            finally:
+                self.release()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {"running": self.running, "queued": {str(level): count for level, count in self._queued.items()},
+                "shed": self.shed, "retries": self.retries,
+                "request_wait_ms": round(self.requests.wait_time(1, now) * 1000, 1)}
+
+
+model_scheduler = ModelScheduler(
+    requests_per_minute=settings.MODEL_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.MODEL_TOKENS_PER_MINUTE,
+    max_concurrency=settings.MODEL_MAX_CONCURRENCY,
+    queue_size=settings.MODEL_QUEUE_SIZE,
+    burst_seconds=settings.MODEL_BURST_SECONDS,
+    workers=settings.WORKERS,
+)
@@ -0,0 +1,183 @@
+"""
+Production entry point for the API server (chat_api.app).
+
+    python serve.py
+    python serve.py --bind 0.0.0.0:8080 --bind [::]:8080 --workers 2 --threads 32
+
+The listening sockets are bound once here and shared by every worker process, so the
+workers take connections from the same accept queue. Each worker is a separate process
+with its own event loop, its own pool of threads for blocking calls and its own copy of
+the in-memory caches. Chat sessions are only shared between workers through
+BUDGIT_SESSION_DIR.
+
+On SIGTERM a worker reports not ready on /readyz, keeps serving for BUDGIT_DRAIN_SECONDS
+so load balancers can stop sending it traffic, then stops accepting connections and gives
+in-flight requests up to BUDGIT_GRACEFUL_TIMEOUT_SECONDS to finish.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import settings
+
+# Set on SIGTERM in a worker; /readyz answers 503 from then on.
+draining = threading.Event()
+
+
+def parse_bind(address: str) -> Tuple[str, int]:
+    """
+    "host:port", "[ipv6]:port" or a bare port (all IPv4 interfaces).
+    """
+    host, _, port = address.rpartition(":")
+    return (host.strip("[]") or "0.0.0.0"), int(port)
+
+
+def bind_sockets(addresses: List[str]) -> List[socket.socket]:
+    sockets = []
+    for address in addresses:
+        host, port = parse_bind(address)
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if family == socket.AF_INET6:
+            # Let "0.0.0.0:port" and "[::]:port" be bound side by side.
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.bind((host, port))
+        sock.set_inheritable(True)
+        sockets.append(sock)
+    return sockets
+
+
+def configure_worker(loop: asyncio.AbstractEventLoop):
+    """
+    Per-worker setup, called from the app's lifespan: size the thread pools for blocking
+    calls and install the SIGTERM drain handler.
+    """
+    # asyncio.to_thread and run_in_executor(None, ...) (token verification, ...).
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.BLOCKING_THREADS,
+                                                 thread_name_prefix="budgit-blocking"))
+    # Starlette's run_in_threadpool (sync dependencies, UploadFile reads) goes through anyio.
+    try:
+        import anyio.to_thread
+        anyio.to_thread.current_default_thread_limiter().total_tokens = settings.BLOCKING_THREADS
+    except ImportError:
+        pass
+    install_drain_handler()
+
+
+def install_drain_handler():
+    """
+    Wrap the server's SIGTERM handler (uvicorn's, which starts the graceful shutdown) so
+    the worker first marks itself draining and keeps serving for DRAIN_SECONDS.
+    Signal handlers can only be set from the main thread; elsewhere this does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    shutdown = signal.getsignal(signal.SIGTERM)
+    if not callable(shutdown):
+        return
+
+    timers = []
+
+    def on_sigterm(signum, frame):
+        if draining.is_set():
+            # Skip the rest of the drain. The pending timer is cancelled, since a second call
+            # to uvicorn's handler would force the exit instead of finishing requests.
+            for timer in timers:
+                timer.cancel()
+            shutdown(signum, frame)
+            return
+        draining.set()
+        if settings.DRAIN_SECONDS > 0:
+            timer = threading.Timer(settings.DRAIN_SECONDS, shutdown, (signum, frame))
+            timers.append(timer)
+            timer.start()
+        else:
+            shutdown(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def preload() -> Dict[str, Any]:
+    """
+    Do the slow first-use work at startup instead of on the first requests: start the OCR
+    threads, check Tesseract and open the budget database. Returns what was loaded and how long
+    each step took (the models are built by the lifespan itself).
+    """
+    import receipt_reader
+    import workers
+    from budget_store import budget_store
+
+    report: Dict[str, Any] = {}
+    start = time.perf_counter()
+    executor = workers.get_executor()
+    for future in [executor.submit(time.sleep, 0) for _ in range(settings.OCR_WORKERS)]:
+        future.result()
+    report["ocr_threads_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    start = time.perf_counter()
+    report["tesseract"] = receipt_reader.tesseract_version()
+    report["tesseract_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    if budget_store is not None:
+        start = time.perf_counter()
+        try:
+            budget_store.list_budgets("")
+            report["budget_store_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        except Exception as e:
+            report["budget_store_error"] = str(e)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the Budg-It API server.")
+    parser.add_argument("--bind", action="append",
+                        help="host:port to listen on; repeat for several (default: BUDGIT_BIND)")
+    parser.add_argument("--workers", type=int, default=settings.WORKERS, help="worker processes")
+    parser.add_argument("--threads", type=int, default=settings.BLOCKING_THREADS,
+                        help="threads per worker for blocking calls")
+    parser.add_argument("--graceful-timeout", type=int, default=settings.GRACEFUL_TIMEOUT_SECONDS,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--forwarded-allow-ips", default=settings.FORWARDED_ALLOW_IPS,
+                        help="proxy addresses trusted for X-Forwarded-* headers (\"*\" trusts any)")
+    parser.add_argument("--no-preload", action="store_true", help="skip the startup warm-up")
+    args = parser.parse_args(argv)
+
+    # Workers are spawned and read their settings from the environment, so pass the
+    # command line overrides on that way.
+    os.environ["BUDGIT_BLOCKING_THREADS"] = str(args.threads)
+    # The model quota is split between the workers (scheduler.py).
+    os.environ["BUDGIT_WORKERS"] = str(args.workers)
+    if args.no_preload:
+        os.environ["BUDGIT_PRELOAD"] = "0"
+
+    import uvicorn
+    from uvicorn.supervisors import Multiprocess
+
+    if args.workers > 1 and not settings.SESSION_DIR:
+        print("WARNING: chat sessions are kept in each worker's memory; set BUDGIT_SESSION_DIR so "
+              "follow-up turns work whichever worker they reach.", file=sys.stderr)
+
+    config = uvicorn.Config(
+        "chat_api:app",
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        server_header=False,
+    )
+    sockets = bind_sockets(args.bind or settings.BIND)
+    if args.workers > 1:
+        Multiprocess(config, sockets=sockets).run()
+    else:
+        uvicorn.Server(config).run(sockets=sockets)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
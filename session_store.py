@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import settings
+
+
+class BudgetSession:
+    """
+    Server-side state for one user's chat about one budget.
+    - state: the same {"Budget": {...}, "conversation": ""} dict the client used to upload.
+    - chat: the live Gemini chat session. It is not persisted and is rebuilt from
+      the conversation history whenever the session is loaded from disk.
+    - prompt_builder: tracks what budget state the live chat has already seen.
+    - revision: bumped after every turn, so a client holding the previous revision
+      can be sent only the changes (see budget_delta.py).
+    - summary / summarised_turns: running summary of the first summarised_turns
+      conversation turns, replayed instead of them (see history_manager.py).
+    - schedule_index: ((revision, day), ScheduleIndex) cache for /projection; not persisted.
+    - stored_items: the items as last written to the budget store, so the next write only
+      sends the changes; None when unknown (the next write sends every item). Not persisted.
+    """
+
+    def __init__(self, session_id: str, user_id: str, budget_id: Optional[str], state: Dict[str, Any]):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.budget_id = budget_id
+        self.state = state
+        self.chat = None
+        self.prompt_builder = None
+        self.revision = 0
+        self.summary: Optional[str] = None
+        self.summarised_turns = 0
+        self.schedule_index = None
+        self.stored_items = None
+        # Serialises chat turns on this session; held across awaits, so it must be an asyncio lock.
+        self.lock = asyncio.Lock()
+        self.last_used = time.time()
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def reset(self, state: Dict[str, Any]):
+        """
+        Replace the budget state (full-state fallback) and drop the live chat so it is rebuilt.
+        The history summary is kept only if the new state still starts with the summarised turns.
+        Call with self.lock held, so no turn is running against the state being replaced.
+        """
+        old_turns = (self.state.get("Budget") or {}).get("conversations") or []
+        new_turns = (state.get("Budget") or {}).get("conversations") or []
+        count = self.summarised_turns
+        if not count or new_turns[:count] != old_turns[:count]:
+            self.summary = None
+            self.summarised_turns = 0
+        self.state = state
+        self.chat = None
+        self.prompt_builder = None
+        self.stored_items = None
+        self.revision += 1
+        self.touch()
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "budget_id": self.budget_id,
+            "state": self.state,
+            "revision": self.revision,
+            "summary": self.summary,
+            "summarised_turns": self.summarised_turns,
+            "last_used": self.last_used,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "BudgetSession":
+        session = cls(record["session_id"], record["user_id"], record.get("budget_id"), record["state"])
+        session.last_used = record.get("last_used", time.time())
+        session.revision = record.get("revision", 0)
+        session.summary = record.get("summary")
+        session.summarised_turns = record.get("summarised_turns", 0)
+        return session
+
+
+class DiskSessionBackend:
+    """
+    Stores one JSON file per session so sessions survive restarts and LRU eviction.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        # Session ids are generated by us, but never trust them as path components.
+        safe_id = "".join(c for c in session_id if c.isalnum() or c == "-")
+        return os.path.join(self.directory, f"{safe_id}.json")
+
+    def save(self, session: BudgetSession):
+        path = self._path(session.session_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session.to_record(), f)
+        os.replace(tmp_path, path)
+
+    def load(self, session_id: str) -> Optional[BudgetSession]:
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return BudgetSession.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def delete(self, session_id: str):
+        path = self._path(session_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def purge_older_than(self, cutoff: float, keep=()) -> int:
+        """
+        Delete session files last written before cutoff (epoch seconds), except the session
+        ids in keep. Every turn rewrites its session's file, so the file's modification time
+        is when the session was last used. Returns the number of files deleted.
+        """
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json") or entry.name[:-len(".json")] in keep:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # Deleted by another worker sharing the directory.
+                continue
+        return removed
+
+
+class SessionStore:
+    """
+    In-memory LRU/TTL store of BudgetSessions keyed by session id, with a secondary
+    index on (user_id, budget_id) for sessions about a stored budget. An optional DiskSessionBackend backs evicted sessions.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: int = 3600, backend: Optional[DiskSessionBackend] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._sessions: "OrderedDict[str, BudgetSession]" = OrderedDict()
+        self._by_budget: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, session: BudgetSession) -> bool:
+        return time.time() - session.last_used > self.ttl_seconds
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            key = (session.user_id, session.budget_id)
+            if self._by_budget.get(key) == session_id:
+                del self._by_budget[key]
+
+    def _insert(self, session: BudgetSession):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        # Sessions without a stored budget are independent; only stored budgets have one live session.
+        if session.budget_id is not None:
+            self._by_budget[(session.user_id, session.budget_id)] = session.session_id
+        while len(self._sessions) > self.max_entries:
+            oldest_id = next(iter(self._sessions))
+            # Evicted sessions stay on disk (if configured), so they can be reloaded later.
+            self._drop(oldest_id)
+
+    def get(self, session_id: str, user_id: str) -> Optional[BudgetSession]:
+        """
+        Return the session if it exists, belongs to user_id and has not expired.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and self.backend is not None:
+                session = self.backend.load(session_id)
+                if session is not None:
+                    self._insert(session)
+            if session is None:
+                return None
+            if self._expired(session):
+                self._drop(session_id)
+                if self.backend is not None:
+                    self.backend.delete(session_id)
+                return None
+            if session.user_id != user_id:
+                return None
+            self._sessions.move_to_end(session_id)
+            session.touch()
+            return session
+
+    def create(self, user_id: str, budget_id: Optional[str], state: Dict[str, Any]) -> BudgetSession:
+        session = BudgetSession(uuid.uuid4().hex, user_id, budget_id, state)
+        with self._lock:
+            old_id = self._by_budget.get((user_id, budget_id)) if budget_id is not None else None
+            if old_id is not None:
+                self._drop(old_id)
+            self._insert(session)
+        self.save(session)
+        return session
+
+    def save(self, session: BudgetSession):
+        if self.backend is not None:
+            self.backend.save(session)
+
+    def purge_expired(self) -> int:
+        """
+        Drop every expired session, in memory and in the disk backend (including sessions
+        that were evicted from memory, or written by another worker). Returns the number of
+        sessions removed. Touches the disk, so the server runs it in a thread.
+        """
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if self._expired(s)]
+            for session_id in expired:
+                self._drop(session_id)
+            live = set(self._sessions)
+        removed = len(expired)
+        if self.backend is not None:
+            for session_id in expired:
+                self.backend.delete(session_id)
+            removed += self.backend.purge_older_than(time.time() - self.ttl_seconds, keep=live)
+        return removed
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+session_store = SessionStore(
+    max_entries=settings.SESSION_MAX_ENTRIES,
+    ttl_seconds=settings.SESSION_TTL_SECONDS,
+    backend=DiskSessionBackend(settings.SESSION_DIR) if settings.SESSION_DIR else None,
+)
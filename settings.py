@@ -0,0 +1,234 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read an integer setting from the environment, falling back to the default.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Read a float setting from the environment, falling back to the default.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def _env_list(name: str, default: str):
+    """
+    Read a comma separated list setting. The value "none" gives an empty list.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        value = default
+    if value.strip().lower() == "none":
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def _env_str(name: str, default=None):
+    """
+    Read a string setting from the environment. Empty strings count as unset.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value
+
+
+# Chat session store
+# Maximum number of live chat sessions kept in memory before the least recently used one is evicted.
+SESSION_MAX_ENTRIES = _env_int("BUDGIT_SESSION_MAX_ENTRIES", 256)
+# Sessions that have not been used for this many seconds are dropped.
+SESSION_TTL_SECONDS = _env_int("BUDGIT_SESSION_TTL_SECONDS", 60 * 60)
+# Directory for the optional on-disk session backend. Leave unset to keep sessions in memory only.
+SESSION_DIR = _env_str("BUDGIT_SESSION_DIR")
+# How often (seconds) expired sessions are removed from memory and from SESSION_DIR (0 = never).
+SESSION_PURGE_INTERVAL_SECONDS = _env_int("BUDGIT_SESSION_PURGE_INTERVAL_SECONDS", 5 * 60)
+
+# Model registry
+# How often (seconds) the server checks config.json for changes and hot-reloads the models.
+CONFIG_RELOAD_INTERVAL_SECONDS = _env_int("BUDGIT_CONFIG_RELOAD_INTERVAL_SECONDS", 5)
+
+# Model backend: "gemini", or "fake" for the offline stand-in in fake_model.py (benchmarks, no quota).
+MODEL_BACKEND = _env_str("BUDGIT_MODEL_BACKEND", "gemini").lower()
+# Replies the fake backend replays, as written by MODEL_RECORD_PATH; unset uses built-in replies.
+FAKE_MODEL_RECORDINGS = _env_str("BUDGIT_FAKE_MODEL_RECORDINGS")
+# Simulated latency of the fake backend: time to first token, prompt and history prefill rate,
+# and output rate.
+FAKE_MODEL_FIRST_TOKEN_MS = _env_float("BUDGIT_FAKE_MODEL_FIRST_TOKEN_MS", 400)
+FAKE_MODEL_PREFILL_TOKENS_PER_SECOND = _env_float("BUDGIT_FAKE_MODEL_PREFILL_TOKENS_PER_SECOND", 20000)
+FAKE_MODEL_TOKENS_PER_SECOND = _env_float("BUDGIT_FAKE_MODEL_TOKENS_PER_SECOND", 150)
+# Requests per minute the fake backend accepts before answering with quota errors (0 = no limit).
+FAKE_MODEL_REQUESTS_PER_MINUTE = _env_float("BUDGIT_FAKE_MODEL_REQUESTS_PER_MINUTE", 0)
+# Append every live model reply (with a hash of its prompt) to this JSON-lines file, for the fake backend.
+MODEL_RECORD_PATH = _env_str("BUDGIT_MODEL_RECORD_PATH")
+
+# Prompt builder
+# Also render the legacy full-state prompt for every turn and report how much smaller the compact one is.
+# Costs a full json.dumps of the budget per turn, so keep it off in production.
+PROMPT_COMPARE_LEGACY = _env_int("BUDGIT_PROMPT_COMPARE_LEGACY", 0) == 1
+
+# Async pipeline
+# Worker threads for CPU-bound receipt work (image decoding, Tesseract OCR).
+OCR_WORKERS = _env_int("BUDGIT_OCR_WORKERS", max(2, os.cpu_count() or 1))
+# Worker processes for batch receipt OCR (/receipts/batch).
+OCR_PROCESS_WORKERS = _env_int("BUDGIT_OCR_PROCESS_WORKERS", max(2, os.cpu_count() or 1))
+# Receipts processed at once per server process; further uploads wait their turn.
+RECEIPT_MAX_CONCURRENCY = _env_int("BUDGIT_RECEIPT_MAX_CONCURRENCY", 8)
+# Gemini requests in flight at once per server process.
+MODEL_MAX_CONCURRENCY = _env_int("BUDGIT_MODEL_MAX_CONCURRENCY", 16)
+# Share one Gemini request between identical calls in flight at the same time (same model,
+# config, history and prompt), e.g. double-submitted chats or the same receipt uploaded twice.
+MODEL_COALESCE = _env_int("BUDGIT_MODEL_COALESCE", 1) == 1
+
+# Model call scheduler (scheduler.py)
+# The project's Gemini quota: requests and input tokens per minute (0 = no limit). Shared
+# evenly by the server's worker processes.
+MODEL_REQUESTS_PER_MINUTE = _env_float("BUDGIT_MODEL_REQUESTS_PER_MINUTE", 1000)
+MODEL_TOKENS_PER_MINUTE = _env_float("BUDGIT_MODEL_TOKENS_PER_MINUTE", 1000000)
+# Unused quota saved up for bursts, in seconds' worth of the rate.
+MODEL_BURST_SECONDS = _env_float("BUDGIT_MODEL_BURST_SECONDS", 5)
+# Calls waiting per priority (chat, receipt) before new ones are turned away with a 429.
+MODEL_QUEUE_SIZE = _env_int("BUDGIT_MODEL_QUEUE_SIZE", 64)
+# Longest a call may wait to start, including rate-limit retries, before the request gets a 429.
+MODEL_CHAT_QUEUE_SECONDS = _env_float("BUDGIT_MODEL_CHAT_QUEUE_SECONDS", 10)
+MODEL_RECEIPT_QUEUE_SECONDS = _env_float("BUDGIT_MODEL_RECEIPT_QUEUE_SECONDS", 30)
+# Retries of a rate-limited call, with jittered exponential backoff between these bounds.
+MODEL_RETRY_ATTEMPTS = _env_int("BUDGIT_MODEL_RETRY_ATTEMPTS", 3)
+MODEL_RETRY_BASE_MS = _env_float("BUDGIT_MODEL_RETRY_BASE_MS", 500)
+MODEL_RETRY_MAX_MS = _env_float("BUDGIT_MODEL_RETRY_MAX_MS", 8000)
+
+# Idempotency-Key on /chat and /receipt: responses kept for retries, by total size and age.
+IDEMPOTENCY_MAX_BYTES = _env_int("BUDGIT_IDEMPOTENCY_MAX_BYTES", 32 * 1024 * 1024)
+IDEMPOTENCY_TTL_SECONDS = _env_int("BUDGIT_IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60)
+
+# Receipt uploads
+# Largest receipt image accepted, in bytes. Bigger uploads get a 413.
+RECEIPT_MAX_BYTES = _env_int("BUDGIT_RECEIPT_MAX_BYTES", 10 * 1024 * 1024)
+# Most images accepted in one /receipts/batch request.
+RECEIPT_BATCH_MAX_FILES = _env_int("BUDGIT_RECEIPT_BATCH_MAX_FILES", 50)
+# Receipts parsed per Gemini call in a batch.
+RECEIPT_BATCH_LLM_SIZE = _env_int("BUDGIT_RECEIPT_BATCH_LLM_SIZE", 5)
+# Chunk size used when streaming an upload into memory.
+UPLOAD_CHUNK_BYTES = _env_int("BUDGIT_UPLOAD_CHUNK_BYTES", 64 * 1024)
+
+# OCR preprocessing
+# Stages run before Tesseract, in order. Any of: grayscale, crop, downscale, binarize. "none" disables.
+# binarize is off by default: Tesseract thresholds internally, and a global Otsu pass first
+# lost small print on reciept_test_1.png (see `python receipt_reader.py`).
+OCR_PREPROCESS_STAGES = _env_list("BUDGIT_OCR_PREPROCESS_STAGES", "grayscale,crop,downscale")
+# Resolution the receipt is scaled down to, assuming a standard 80mm (3.15in) paper roll.
+OCR_TARGET_DPI = _env_int("BUDGIT_OCR_TARGET_DPI", 300)
+OCR_RECEIPT_WIDTH_INCHES = _env_float("BUDGIT_OCR_RECEIPT_WIDTH_INCHES", 3.15)
+
+# Receipt cache
+# In-memory tier size, in bytes of cached OCR text and parsed JSON.
+RECEIPT_CACHE_MEMORY_BYTES = _env_int("BUDGIT_RECEIPT_CACHE_MEMORY_BYTES", 16 * 1024 * 1024)
+# SQLite file for the on-disk tier ("none" keeps the cache in memory only) and its size limit.
+RECEIPT_CACHE_PATH = _env_str("BUDGIT_RECEIPT_CACHE_PATH", "receipt_cache.sqlite3")
+if RECEIPT_CACHE_PATH.lower() == "none":
+    RECEIPT_CACHE_PATH = None
+RECEIPT_CACHE_DISK_BYTES = _env_int("BUDGIT_RECEIPT_CACHE_DISK_BYTES", 256 * 1024 * 1024)
+# Near-duplicate matching: maximum differing bits (out of 256) between perceptual hashes. 0 disables it.
+RECEIPT_CACHE_HASH_DISTANCE = _env_int("BUDGIT_RECEIPT_CACHE_HASH_DISTANCE", 0)
+
+# Local receipt parser
+# Receipts the regex parser reads with at least this confidence (0..1) skip Gemini entirely.
+# Set above 1 to always use the model.
+RECEIPT_LOCAL_PARSE_MIN_CONFIDENCE = _env_float("BUDGIT_RECEIPT_LOCAL_PARSE_MIN_CONFIDENCE", 0.9)
+
+# Logging
+# Minimum level written: DEBUG, INFO, WARNING or ERROR. DEBUG adds request headers and payload dumps.
+LOG_LEVEL = _env_str("BUDGIT_LOG_LEVEL", "INFO").upper()
+# JSON-lines log file ("none" disables logging), rotated at LOG_MAX_BYTES keeping LOG_BACKUP_COUNT old files.
+LOG_PATH = _env_str("BUDGIT_LOG_PATH", "budgit.log.jsonl")
+if LOG_PATH.lower() == "none":
+    LOG_PATH = None
+LOG_MAX_BYTES = _env_int("BUDGIT_LOG_MAX_BYTES", 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = _env_int("BUDGIT_LOG_BACKUP_COUNT", 5)
+# The writer thread flushes up to LOG_BATCH_SIZE records at a time, at least every LOG_FLUSH_INTERVAL_SECONDS.
+LOG_BATCH_SIZE = _env_int("BUDGIT_LOG_BATCH_SIZE", 256)
+LOG_FLUSH_INTERVAL_SECONDS = _env_float("BUDGIT_LOG_FLUSH_INTERVAL_SECONDS", 0.5)
+# Records waiting for the writer; beyond this, new records are dropped rather than blocking requests.
+LOG_QUEUE_SIZE = _env_int("BUDGIT_LOG_QUEUE_SIZE", 10000)
+
+# Model reply validation
+# Follow-up calls asking the model to fix a reply that could not be repaired locally (0 disables).
+RESPONSE_REPAIR_RETRIES = _env_int("BUDGIT_RESPONSE_REPAIR_RETRIES", 1)
+
+# Response cache for read-only chat turns
+# Sessions with cached replies, and replies kept per session (dropped when the budget changes).
+RESPONSE_CACHE_SESSIONS = _env_int("BUDGIT_RESPONSE_CACHE_SESSIONS", 1024)
+RESPONSE_CACHE_ENTRIES = _env_int("BUDGIT_RESPONSE_CACHE_ENTRIES", 64)
+# Cosine similarity (0..1) at which a rephrased question reuses a cached reply. 0 disables it.
+RESPONSE_CACHE_SIMILARITY = _env_float("BUDGIT_RESPONSE_CACHE_SIMILARITY", 0.0)
+# Answer simple read-only questions (surplus, totals, categories, item list) locally.
+RESPONSE_CACHE_LOCAL_ANSWERS = _env_int("BUDGIT_RESPONSE_CACHE_LOCAL_ANSWERS", 1) == 1
+
+# Apply simple edit commands ("add groceries $120", "delete Netflix", "set my budget to 3000")
+# locally instead of sending them to the model.
+INTENT_ROUTER = _env_int("BUDGIT_INTENT_ROUTER", 1) == 1
+
+# Conversation history sent to the model
+# Turns replayed verbatim after compaction; the window may grow to twice this before the
+# older turns are folded into the running summary.
+HISTORY_RECENT_TURNS = _env_int("BUDGIT_HISTORY_RECENT_TURNS", 6)
+# Most estimated tokens of verbatim turns in a chat before compaction.
+HISTORY_TOKEN_BUDGET = _env_int("BUDGIT_HISTORY_TOKEN_BUDGET", 3000)
+# Target size of the running summary of older turns.
+HISTORY_SUMMARY_TOKENS = _env_int("BUDGIT_HISTORY_SUMMARY_TOKENS", 300)
+
+# Server-side budget storage (SQLite). "none" disables it; budgets then live only in the
+# client and in chat sessions.
+BUDGET_DB_PATH = _env_str("BUDGIT_BUDGET_DB_PATH", "budgets.sqlite3")
+if BUDGET_DB_PATH.lower() == "none":
+    BUDGET_DB_PATH = None
+BUDGET_DB_POOL_SIZE = _env_int("BUDGIT_BUDGET_DB_POOL_SIZE", 4)
+
+# Firebase auth (when USE_AUTH is on)
+# Project the ID tokens are issued for; read from firebase_credentials.json when unset.
+FIREBASE_PROJECT_ID = _env_str("BUDGIT_FIREBASE_PROJECT_ID")
+# Where the token signing certificates come from. AUTH_CERTS_PATH, a JSON file of
+# {"key id": "PEM certificate"}, replaces the Google URL for offline testing.
+AUTH_CERTS_URL = _env_str("BUDGIT_AUTH_CERTS_URL",
+                          "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com")
+AUTH_CERTS_PATH = _env_str("BUDGIT_AUTH_CERTS_PATH")
+# Verified tokens remembered until they expire (0 disables the cache).
+AUTH_TOKEN_CACHE_SIZE = _env_int("BUDGIT_AUTH_TOKEN_CACHE_SIZE", 4096)
+
+# Observability
+# Directory for per-request profiles: a request sent with "X-Profile: 1" is sampled and its
+# collapsed stacks written here. Unset disables profiling.
+PROFILE_DIR = _env_str("BUDGIT_PROFILE_DIR")
+PROFILE_INTERVAL_MS = _env_float("BUDGIT_PROFILE_INTERVAL_MS", 5)
+# Secret a request's X-Profile header must carry to be profiled; unset turns profiling off.
+PROFILE_TOKEN = _env_str("BUDGIT_PROFILE_TOKEN")
+
+# Serving (serve.py)
+# Addresses to listen on, "host:port" (IPv6 as "[::]:port"). Cloud Run passes the port in PORT.
+BIND = _env_list("BUDGIT_BIND", f"0.0.0.0:{_env_int('PORT', 8000)}")
+# Worker processes. Each has its own event loop, caches and in-memory chat sessions.
+WORKERS = _env_int("BUDGIT_WORKERS", 1)
+# Threads per worker for blocking calls made from the event loop (token verification, sync
+# dependencies, upload reads). OCR has its own pool (OCR_WORKERS).
+BLOCKING_THREADS = _env_int("BUDGIT_BLOCKING_THREADS", 32)
+# On SIGTERM: seconds to keep serving while /readyz reports draining, then seconds in-flight
+# requests get to finish before they are cancelled.
+DRAIN_SECONDS = _env_float("BUDGIT_DRAIN_SECONDS", 0)
+GRACEFUL_TIMEOUT_SECONDS = _env_int("BUDGIT_GRACEFUL_TIMEOUT_SECONDS", 8)
+# Warm up at startup (OCR threads, Tesseract check, budget database) before taking traffic.
+PRELOAD = _env_int("BUDGIT_PRELOAD", 1) == 1
+# Comma-separated proxy addresses whose X-Forwarded-For / X-Forwarded-Proto headers are trusted
+# for the client address and scheme. "*" trusts any sender, which lets clients spoof their address
+# unless only a proxy can reach the server.
+FORWARDED_ALLOW_IPS = _env_str("BUDGIT_FORWARDED_ALLOW_IPS", "127.0.0.1")
+# Tesseract executable; unset finds it on PATH (or in its default install folder on Windows).
+TESSERACT_CMD = _env_str("BUDGIT_TESSERACT_CMD")
@@ -0,0 +1,16 @@
+"""
+Test setup: the repository's flat modules are imported from the root, with offline,
+quiet settings (fake model, no log file, no SQLite files) fixed before settings is read.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("BUDGIT_MODEL_BACKEND", "fake")
+os.environ.setdefault("BUDGIT_LOG_PATH", "none")
+os.environ.setdefault("BUDGIT_BUDGET_DB_PATH", "none")
+os.environ.setdefault("BUDGIT_RECEIPT_CACHE_PATH", "none")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
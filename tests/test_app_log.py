@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+
+from app_log import LogWriter, StructuredLogger, redact_headers, request_id_var
+
+
+def _writer(path, **overrides) -> LogWriter:
+    options = dict(max_bytes=0, backup_count=0, batch_size=3, flush_interval=60.0, queue_size=1000)
+    options.update(overrides)
+    return LogWriter(str(path), **options)
+
+
+def _records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_json_lines(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = StructuredLogger(_writer(path), level="INFO")
+    log.debug("hidden")
+    token = request_id_var.set("req-1")
+    try:
+        log.info("Chat turn", items=3, headers=redact_headers({"Authorization": "Bearer x", "Accept": "*/*"}))
+    finally:
+        request_id_var.reset(token)
+    log.error("Failed", error="boom")
+    log.shutdown()
+
+    first, second = _records(path)
+    assert (first["level"], first["msg"], first["request_id"], first["items"]) == ("INFO", "Chat turn", "req-1", 3)
+    assert first["headers"] == {"Authorization": "<redacted>", "Accept": "*/*"}
+    assert second["level"] == "ERROR" and "request_id" not in second
+
+
+def test_shutdown_flushes_everything_queued(tmp_path):
+    path = tmp_path / "log.jsonl"
+    writer = _writer(path)
+    log = StructuredLogger(writer)
+    for index in range(500):
+        log.info("line", index=index)
+    # The writer only wakes every 60 seconds when idle; stop must not wait for that.
+    log.shutdown()
+    assert [record["index"] for record in _records(path)] == list(range(500))
+    assert not writer._thread.is_alive() and writer._file is None
+    assert (writer.written, writer.dropped) == (500, 0)
+    # A second shutdown (lifespan, then atexit) is harmless.
+    log.shutdown()
+
+
+def test_rotation(tmp_path):
+    path = tmp_path / "log.jsonl"
+    writer = _writer(path, max_bytes=200, backup_count=2, batch_size=1)
+    log = StructuredLogger(writer)
+    for index in range(30):
+        log.info("x" * 20, index=index)
+    log.shutdown()
+    assert sorted(os.listdir(tmp_path)) == ["log.jsonl", "log.jsonl.1", "log.jsonl.2"]
+    assert all(os.path.getsize(tmp_path / name) <= 200 for name in os.listdir(tmp_path))
+    assert _records(path)[-1]["index"] == 29
+
+
+def test_unwritable_log_counts_dropped_lines(tmp_path):
+    writer = _writer(tmp_path / "missing" / "log.jsonl")
+    log = StructuredLogger(writer)
+    log.info("lost")
+    log.shutdown()
+    assert log.stats()["dropped"] == 1
+
+
+def test_app_shutdown_flushes_the_log(tmp_path, monkeypatch):
+    import chat_api
+    import settings
+
+    path = tmp_path / "log.jsonl"
+    monkeypatch.setattr(chat_api, "log", StructuredLogger(_writer(path)))
+    monkeypatch.setattr(settings, "PRELOAD", False)
+    monkeypatch.setattr(settings, "SESSION_PURGE_INTERVAL_SECONDS", 0)
+
+    async def run():
+        async with chat_api.lifespan(chat_api.app):
+            chat_api.log.info("Serving", port=8080)
+
+    asyncio.run(run())
+    assert [record["msg"] for record in _records(path)] == ["Models initialised", "Serving"]
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from budget_delta import DeltaError, apply_operations, content_item_id, diff_items, ensure_item_ids
+
+
+def _items():
+    return [
+        {"id": "aaaaaa", "item_name": "Rent", "amount": 1200, "category": "Housing"},
+        {"id": "bbbbbb", "item_name": "Gym", "amount": 40, "category": "Health"},
+    ]
+
+
+def test_ensure_item_ids_keeps_existing_and_fills_missing():
+    items = _items() + [{"item_name": "Coffee", "amount": 5}]
+    ensure_item_ids(items)
+    assert [item["id"] for item in items[:2]] == ["aaaaaa", "bbbbbb"]
+    assert isinstance(items[2]["id"], str) and len(items[2]["id"]) == 6
+    assert items[2]["id"] not in ("aaaaaa", "bbbbbb")
+
+
+def test_ensure_item_ids_replaces_duplicates():
+    items = _items() + [{"id": "aaaaaa", "item_name": "Parking", "amount": 30}]
+    ensure_item_ids(items)
+    assert len({item["id"] for item in items}) == 3
+    assert items[0]["id"] == "aaaaaa"
+
+
+def test_content_ids_are_stable():
+    first = [{"item_name": "Coffee", "amount": 5}, {"item_name": "Tea", "amount": 3}]
+    second = [dict(item) for item in first]
+    assert [item["id"] for item in ensure_item_ids(first)] == [item["id"] for item in ensure_item_ids(second)]
+
+
+def test_identical_items_get_distinct_ids():
+    items = [{"item_name": "Coffee", "amount": 5} for _ in range(3)]
+    ensure_item_ids(items)
+    assert len({item["id"] for item in items}) == 3
+
+
+def test_content_item_id_skips_taken():
+    item = {"item_name": "Coffee", "amount": 5}
+    first = content_item_id(item, set())
+    assert content_item_id(item, {first}) != first
+
+
+def test_ensure_item_ids_scales_linearly():
+    items = [{"item_name": f"Item {index}", "amount": index} for index in range(20000)]
+    start = time.perf_counter()
+    ensure_item_ids(items)
+    assert time.perf_counter() - start < 2.0
+    assert len({item["id"] for item in items}) == len(items)
+
+
+def test_apply_operations():
+    items, problems = apply_operations(_items(), [
+        {"op": "add", "item": {"item_name": "Coffee", "amount": 5, "unknown": True}},
+        {"op": "update", "id": "aaaaaa", "item": {"amount": 1250}},
+        {"op": "remove", "id": "bbbbbb"},
+    ])
+    assert problems == []
+    assert [item["item_name"] for item in items] == ["Rent", "Coffee"]
+    assert items[0]["amount"] == 1250
+    assert "unknown" not in items[1] and items[1]["id"] not in ("aaaaaa", "bbbbbb")
+
+
+def test_apply_operations_does_not_modify_input():
+    original = _items()
+    apply_operations(original, [{"op": "update", "id": "aaaaaa", "item": {"amount": 1}}])
+    assert original == _items()
+
+
+def test_apply_operations_reports_problems():
+    items, problems = apply_operations(_items(), [
+        {"op": "update", "id": "missing", "item": {"amount": 1}},
+        {"op": "remove", "id": "missing"},
+        {"op": "add", "item": {"item_name": "No amount"}},
+        {"op": "rename"},
+        "not an operation",
+    ])
+    assert items == _items()
+    assert len(problems) == 5
+
+
+def test_apply_operations_strict():
+    with pytest.raises(DeltaError):
+        apply_operations(_items(), [{"op": "remove", "id": "missing"}], strict=True)
+
+
+def test_diff_items_round_trips():
+    old = _items()
+    new, _ = apply_operations(old, [
+        {"op": "add", "id": "cccccc", "item": {"item_name": "Coffee", "amount": 5}},
+        {"op": "update", "id": "aaaaaa", "item": {"amount": 1250}},
+        {"op": "remove", "id": "bbbbbb"},
+    ])
+    operations = diff_items(old, new)
+    assert {"op": "update", "id": "aaaaaa", "item": {"amount": 1250}} in operations
+    assert {"op": "remove", "id": "bbbbbb"} in operations
+    replayed, problems = apply_operations(old, operations, strict=True)
+    assert problems == []
+    assert sorted(replayed, key=lambda item: item["id"]) == sorted(new, key=lambda item: item["id"])
+
+
+def test_diff_of_unchanged_items_is_empty():
+    assert diff_items(_items(), _items()) == []
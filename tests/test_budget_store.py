@@ -0,0 +1,97 @@
+import copy
+
+import pytest
+
+from budget_delta import diff_items
+from budget_store import BudgetStoreError, SQLiteBudgetBackend
+
+
+def _turns(*messages):
+    return [{"user_message": message, "ai_response": f"re: {message}"} for message in messages]
+
+
+STATE = {"Budget": {
+    "budget_limit": 2000, "budget_surplus": 1810, "warnings": ["watch rent"],
+    "items": [
+        {"id": "a", "item_name": "Utilities", "amount": 150, "category": "Utilities", "due_date": 200.0},
+        {"id": "b", "item_name": "Gym", "amount": 40, "category": "Health", "due_date": 100.0},
+    ],
+    "conversations": _turns("hi", "add gym"),
+}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteBudgetBackend(str(tmp_path / "budgets.sqlite3"))
+
+
+def _items(state):
+    return [(item["id"], item["item_name"], item["amount"]) for item in state["Budget"]["items"]]
+
+
+def test_round_trip(store):
+    store.save_budget("u1", "b1", STATE, name="October")
+    loaded = store.load_budget("u1", "b1")
+    assert _items(loaded) == [("a", "Utilities", 150), ("b", "Gym", 40)]
+    assert loaded["Budget"]["conversations"] == STATE["Budget"]["conversations"]
+    assert loaded["Budget"]["warnings"] == ["watch rent"]
+    [listed] = store.list_budgets("u1")
+    assert (listed["id"], listed["name"], listed["item_count"]) == ("b1", "October", 2)
+
+
+def test_edit_and_save_only_the_changes(store):
+    store.save_budget("u1", "b1", STATE)
+    loaded = store.load_budget("u1", "b1")
+    edited = copy.deepcopy(loaded)
+    items = edited["Budget"]["items"]
+    items[1]["amount"] = 45
+    del items[0]
+    items.append({"id": "c", "item_name": "Coffee", "amount": 4.5, "category": "Food"})
+    edited["Budget"]["conversations"] += _turns("edit")
+    changes = diff_items(loaded["Budget"]["items"], items)
+    assert {change["op"] for change in changes} == {"add", "update", "remove"}
+
+    store.save_budget("u1", "b1", edited, changes=changes)
+    reloaded = store.load_budget("u1", "b1")
+    assert _items(reloaded) == [("b", "Gym", 45), ("c", "Coffee", 4.5)]
+    assert reloaded["Budget"]["conversations"] == _turns("hi", "add gym", "edit")
+    # A full save writes the same rows.
+    store.save_budget("u1", "b2", edited)
+    assert store.load_budget("u1", "b2")["Budget"]["items"] == reloaded["Budget"]["items"]
+
+
+@pytest.mark.parametrize("history", [
+    _turns("hi"),
+    [],
+    # Same length and longer, but not the stored history.
+    _turns("other", "turns"),
+    _turns("new", "chat", "entirely"),
+    _turns("hi", "changed"),
+])
+def test_conversation_follows_the_saved_history(store, history):
+    store.save_budget("u1", "b1", STATE)
+    state = copy.deepcopy(STATE)
+    state["Budget"]["conversations"] = history
+    store.save_budget("u1", "b1", state, changes=[])
+    assert store.load_budget("u1", "b1")["Budget"]["conversations"] == history
+
+
+def test_budget_of_another_user(store):
+    store.save_budget("u1", "b1", STATE)
+    with pytest.raises(BudgetStoreError):
+        store.save_budget("u2", "b1", {"Budget": {"items": []}})
+    assert store.load_budget("u2", "b1") is None
+    assert store.list_budgets("u2") == []
+    assert store.query_items("u2", budget_id="b1") == []
+    assert not store.delete_budget("u2", "b1")
+    assert _items(store.load_budget("u1", "b1")) == [("a", "Utilities", 150), ("b", "Gym", 40)]
+
+
+def test_query_items_and_delete(store):
+    store.save_budget("u1", "b1", STATE)
+    assert [item["id"] for item in store.query_items("u1", category="Health")] == ["b"]
+    assert [item["id"] for item in store.query_items("u1", due_after=50.0)] == ["b", "a"]
+    assert [item["id"] for item in store.query_items("u1", due_before=150.0)] == ["b"]
+    assert store.delete_budget("u1", "b1")
+    assert store.load_budget("u1", "b1") is None
+    assert store.query_items("u1") == []
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import firebase_auth
+from firebase_auth import TokenCache, get_current_user
+
+
+def test_cached_token_expires():
+    cache = TokenCache(max_entries=10)
+    cache.put("live", time.time() + 60, {"uid": "u1"})
+    cache.put("expired", time.time() - 1, {"uid": "u1"})
+    assert cache.get("live") == {"uid": "u1"}
+    assert cache.get("expired") is None
+    assert cache.stats()["entries"] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_is_lru_bounded():
+    cache = TokenCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, time.time() + 60, {"uid": key})
+    cache.get("a")
+    cache.put("c", time.time() + 60, {"uid": "c"})
+    assert cache.get("b") is None and cache.get("a") is not None
+    disabled = TokenCache(max_entries=0)
+    disabled.put("a", time.time() + 60, {"uid": "a"})
+    assert disabled.get("a") is None
+
+
+def test_revoke_drops_only_that_users_tokens():
+    cache = TokenCache(max_entries=10)
+    cache.put("t1", time.time() + 60, {"uid": "u1"})
+    cache.put("t2", time.time() + 60, {"uid": "u1"})
+    cache.put("t3", time.time() + 60, {"uid": "u2"})
+    cache.revoke("u1", at=1000.5)
+    assert cache.get("t1") is None and cache.get("t2") is None
+    assert cache.get("t3") == {"uid": "u2"}
+    assert cache.is_revoked("u1", 999)
+    # Same second as the revocation: accepted, like Firebase's tokensValidAfterTime.
+    assert not cache.is_revoked("u1", 1000)
+    assert not cache.is_revoked("u2", 999)
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    """
+    Signature checks replaced by a table of token -> claims, counting verifications.
+    """
+    claims, verified = {}, []
+    cache = TokenCache(max_entries=10)
+
+    def verify_token(token):
+        verified.append(token)
+        if token not in claims:
+            raise ValueError("Could not verify token signature")
+        return claims[token]
+
+    monkeypatch.setattr(firebase_auth, "verify_token", verify_token)
+    monkeypatch.setattr(firebase_auth, "token_cache", cache)
+    return claims, verified, cache
+
+
+def _claims(uid, issued, lifetime=3600):
+    return {"sub": uid, "email": f"{uid}@example.com", "iat": issued, "exp": issued + lifetime}
+
+
+def _user(token):
+    return asyncio.run(get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+
+
+def test_verified_tokens_are_cached_until_exp(tokens):
+    claims, verified, _ = tokens
+    now = int(time.time())
+    claims["fresh"] = _claims("u1", now)
+    claims["stale"] = _claims("u1", now - 3601)
+    assert _user("fresh") == _user("fresh") == {"uid": "u1", "email": "u1@example.com"}
+    _user("stale")
+    _user("stale")
+    # The expired one is verified again every time (and then rejected by the real check).
+    assert verified == ["fresh", "stale", "stale"]
+
+
+def test_revoked_tokens_are_refused(tokens):
+    claims, verified, cache = tokens
+    now = int(time.time())
+    claims["old"] = _claims("u1", now - 10)
+    claims["other"] = _claims("u2", now - 10)
+    _user("old")
+    cache.revoke("u1")
+    with pytest.raises(HTTPException) as error:
+        _user("old")
+    assert error.value.status_code == 401 and "revoked" in error.value.detail
+    assert _user("other")["uid"] == "u2"
+    claims["new"] = _claims("u1", now + 1)
+    assert _user("new")["uid"] == "u1"
+
+
+def test_bad_token(tokens):
+    with pytest.raises(HTTPException) as error:
+        _user("forged")
+    assert error.value.status_code == 401
+
+
+def test_logout_revokes_the_callers_tokens(tokens, monkeypatch):
+    import chat_api
+
+    claims, _, cache = tokens
+    monkeypatch.setattr(chat_api, "token_cache", cache)
+    claims["t1"] = _claims("u1", int(time.time()) - 10)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"Authorization": "Bearer t1"}
+            before = await client.post("/verify-token", headers=headers)
+            logout = await client.post("/logout", headers=headers)
+            after = await client.post("/verify-token", headers=headers)
+            return before, logout, after
+
+    before, logout, after = asyncio.run(scenario())
+    assert before.status_code == 200 and logout.json() == {"success": True}
+    assert after.status_code == 401
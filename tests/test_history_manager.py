@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+import history_manager
+import settings
+from history_manager import chat_history, compact, needs_compaction
+
+
+def _turns(*names):
+    return [{"user_message": f"ask {name}", "ai_response": f"answer {name}"} for name in names]
+
+
+@pytest.fixture
+def small_window(monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_RECENT_TURNS", 2)
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET", 1000)
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    prompts = []
+
+    async def generate_text(model, prompt):
+        prompts.append(prompt)
+        return json.dumps({"summary": f"summary {len(prompts)}"})
+
+    monkeypatch.setattr(history_manager, "generate_text", generate_text)
+    return prompts
+
+
+def test_compaction_threshold(small_window):
+    assert not needs_compaction(_turns(*"abcd"), 0)
+    assert needs_compaction(_turns(*"abcde"), 0)
+    # Only the turns after the summary count.
+    assert not needs_compaction(_turns(*"abcdefg"), 3)
+    long_turn = [{"user_message": "x" * 4004, "ai_response": ""}]
+    assert needs_compaction(long_turn, 0)
+
+
+def test_compact_keeps_the_recent_turns(small_window, summaries):
+    conversations = _turns(*"abcde")
+    assert asyncio.run(compact(conversations, None, 0)) == ("summary 1", 3)
+    [prompt] = summaries
+    assert "ask c" in prompt and "ask d" not in prompt
+
+    # Below the threshold again: nothing to do.
+    conversations += _turns("f")
+    assert asyncio.run(compact(conversations, "summary 1", 3)) == ("summary 1", 3)
+    assert len(summaries) == 1
+
+    conversations += _turns("g", "h")
+    assert asyncio.run(compact(conversations, "summary 1", 3)) == ("summary 2", 6)
+    assert "summary 1" in summaries[1] and "ask f" in summaries[1] and "ask c" not in summaries[1]
+
+
+def test_local_summary_when_the_model_fails(small_window, monkeypatch):
+    async def generate_text(model, prompt):
+        raise RuntimeError("model down")
+
+    monkeypatch.setattr(history_manager, "generate_text", generate_text)
+    summary, summarised = asyncio.run(compact(_turns(*"abcde"), "earlier", 0))
+    assert summarised == 3
+    assert summary == "earlier\nUser asked: ask a\nUser asked: ask b\nUser asked: ask c"
+
+
+def test_chat_history_replays_only_turns_after_the_summary(small_window):
+    history = chat_history(_turns(*"abcde"), "summary 1", 3)
+    texts = [part["text"] for turn in history for part in turn["parts"]]
+    assert any("summary 1" in text for text in texts)
+    assert "ask c" not in texts
+    assert texts[-4:] == ["ask d", "answer d", "ask e", "answer e"]
+
+
+def test_diverged_upload_resets_the_summary(small_window, summaries, monkeypatch):
+    import chat_api
+    from session_store import SessionStore
+
+    store = SessionStore()
+    monkeypatch.setattr(chat_api, "session_store", store)
+    state = {"Budget": {"items": [], "conversations": _turns(*"abcde")}}
+    session = store.create("u1", None, state)
+
+    async def scenario():
+        async with session.lock:
+            await chat_api.compact_history(session)
+        compacted = (session.summary, session.summarised_turns)
+        # The client uploads a different history.
+        uploaded = {"Budget": {"items": [], "conversations": _turns(*"vwxyz")}}
+        await chat_api.resolve_session("u1", session.session_id, None, uploaded)
+        reset = (session.summary, session.summarised_turns)
+        async with session.lock:
+            await chat_api.compact_history(session)
+        return compacted, reset
+
+    compacted, reset = asyncio.run(scenario())
+    assert compacted == ("summary 1", 3)
+    assert reset == (None, 0)
+    # The summary is rebuilt from the uploaded turns only.
+    assert (session.summary, session.summarised_turns) == ("summary 2", 3)
+    assert "ask v" in summaries[1] and "ask a" not in summaries[1]
@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import MAX_KEY_LENGTH, IdempotencyStore, fingerprint
+
+
+class Counter:
+    """
+    A request handler that counts how often it really ran.
+    """
+
+    def __init__(self, result=None, error=None, delay=0.0):
+        self.calls = 0
+        self.result = result if result is not None else {"reply": "ok"}
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_fingerprint():
+    assert fingerprint("/chat", {"a": 1, "b": 2}) == fingerprint("/chat", {"b": 2, "a": 1})
+    assert fingerprint("/chat", {"a": 1}) != fingerprint("/receipt", {"a": 1})
+
+
+def test_retry_replays_first_response():
+    async def scenario():
+        store, call = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60), Counter()
+        first = await store.run("u1", "key", "fp", call)
+        second = await store.run("u1", "key", "fp", call)
+        return store, call, first, second
+
+    store, call, first, second = asyncio.run(scenario())
+    assert call.calls == 1
+    assert first == (json.dumps({"reply": "ok"}).encode(), False)
+    assert second == (first[0], True)
+    assert store.stats()["replays"] == 1
+
+
+def test_keys_are_per_user():
+    async def scenario():
+        store, call = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60), Counter()
+        await store.run("u1", "key", "fp", call)
+        await store.run("u2", "key", "fp", call)
+        return call.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_key_reused_for_different_request():
+    async def scenario():
+        store = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60)
+        await store.run("u1", "key", "fp", Counter())
+        await store.run("u1", "key", "other", Counter())
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 422
+
+
+def test_key_too_long():
+    store = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(store.run("u1", "k" * (MAX_KEY_LENGTH + 1), "fp", Counter()))
+    assert error.value.status_code == 400
+
+
+def test_concurrent_retry_waits_for_first_attempt():
+    async def scenario():
+        store, call = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60), Counter(delay=0.05)
+        return call, await asyncio.gather(store.run("u1", "key", "fp", call), store.run("u1", "key", "fp", call))
+
+    call, (first, second) = asyncio.run(scenario())
+    assert call.calls == 1
+    assert first[1] is False and second == (first[0], True)
+
+
+def test_errors_are_not_stored():
+    async def scenario():
+        store = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=60)
+        with pytest.raises(ValueError):
+            await store.run("u1", "key", "fp", Counter(error=ValueError("model failed")))
+        call = Counter()
+        result = await store.run("u1", "key", "fp", call)
+        return store, call, result
+
+    store, call, result = asyncio.run(scenario())
+    assert call.calls == 1 and result[1] is False
+    assert store.stats()["entries"] == 1
+
+
+def test_expired_entries_run_again():
+    async def scenario():
+        store, call = IdempotencyStore(max_bytes=1 << 20, ttl_seconds=0), Counter()
+        await store.run("u1", "key", "fp", call)
+        await store.run("u1", "key", "fp", call)
+        return call.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_lru_bound_on_bytes():
+    async def scenario():
+        store = IdempotencyStore(max_bytes=60, ttl_seconds=60)
+        for key in ("a", "b", "c"):
+            await store.run("u1", key, "fp", Counter(result={"reply": key * 10}))
+        # Too large to keep at all.
+        await store.run("u1", "big", "fp", Counter(result={"reply": "x" * 100}))
+        return store
+
+    stats = asyncio.run(scenario()).stats()
+    assert stats["bytes"] <= 60
+    assert stats["entries"] == 2
+
+
+def test_receipt_retry_is_keyed_on_image_bytes(monkeypatch):
+    import httpx
+    import chat_api
+
+    async def fake_receipt_turn(image_buffer, *args):
+        return {"bytes": image_buffer.getvalue().decode()}
+
+    monkeypatch.setattr(chat_api, "receipt_turn", fake_receipt_turn)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            def send(image):
+                return client.post("/receipt", headers={"Idempotency-Key": "receipt-1"},
+                                   files={"receipt": ("photo.png", image, "image/png")})
+            return await send(b"first"), await send(b"first"), await send(b"other")
+
+    first, retry, different = asyncio.run(scenario())
+    assert first.status_code == 200 and first.json() == {"bytes": "first"}
+    assert retry.headers.get("Idempotent-Replayed") == "true" and retry.json() == first.json()
+    # Same file name and size, different image.
+    assert different.status_code == 422
@@ -0,0 +1,114 @@
+import copy
+
+import pytest
+
+from intent_router import apply_command, parse_command
+
+STATE = {"Budget": {"budget_limit": 2000, "items": [
+    {"id": "a", "item_name": "Utilities", "amount": 150, "category": "Utilities"},
+    {"id": "b", "item_name": "Gym", "amount": 40, "category": "Health"},
+    {"id": "c", "item_name": "Netflix subscription", "amount": 15, "category": "Entertainment"},
+    {"id": "d", "item_name": "Car insurance", "amount": 120, "category": "Transport"},
+    {"id": "e", "item_name": "Home insurance", "amount": 60, "category": "Housing"},
+]}}
+
+
+def _state():
+    return copy.deepcopy(STATE)
+
+
+@pytest.mark.parametrize("message, item", [
+    ("add groceries $120", {"item_name": "Groceries", "amount": 120.0, "recurrence_schedule": None}),
+    ("Please add $15 for Spotify monthly", {"item_name": "Spotify", "amount": 15.0, "recurrence_schedule": "Monthly"}),
+    ("add coffee: 4.50 weekly under food", {"item_name": "Coffee", "amount": 4.5, "category": "Food",
+                                            "recurrence_schedule": "Weekly"}),
+    ("add Phone bill 1,200 to my budget", {"item_name": "Phone bill", "amount": 1200.0}),
+])
+def test_add(message, item):
+    command = parse_command(message, _state())
+    assert command["intent"] == "add"
+    [operation] = command["operations"]
+    assert operation["op"] == "add"
+    assert item.items() <= operation["item"].items()
+
+
+@pytest.mark.parametrize("message, item_id", [
+    ("delete gym", "b"),
+    ("Remove the Gym please", "b"),
+    ("get rid of netflix", "c"),
+    ("cancel my Netflix subscription", "c"),
+    ("drop car insurance", "d"),
+])
+def test_remove(message, item_id):
+    command = parse_command(message, _state())
+    assert command["intent"] == "remove"
+    assert command["operations"] == [{"op": "remove", "id": item_id}]
+
+
+@pytest.mark.parametrize("message, item_id, fields", [
+    ("change gym to 45", "b", {"amount": 45.0}),
+    ("set utilities amount to $160", "a", {"amount": 160.0}),
+    ("update netflix to 17.99 monthly", "c", {"amount": 17.99, "recurrence_schedule": "Monthly"}),
+])
+def test_update(message, item_id, fields):
+    command = parse_command(message, _state())
+    assert command["intent"] == "update"
+    assert command["operations"] == [{"op": "update", "id": item_id, "item": fields}]
+
+
+@pytest.mark.parametrize("message", ["set my budget to 3000", "raise the monthly budget limit to $3,000"])
+def test_limit(message):
+    command = parse_command(message, _state())
+    assert command["intent"] == "limit"
+    assert command["budget_limit"] == 3000.0
+    assert command["operations"] == []
+
+
+@pytest.mark.parametrize("message", [
+    "delete it",
+    "get rid of it",
+    "remove that",
+    "delete this one",
+    "remove the last one",
+    "drop them",
+    "change it to 5",
+    "set it to 0",
+    "update that to 10",
+    # Words shorter than 3 letters or inside other words do not pick an item.
+    "delete g",
+    "remove ut",
+    "delete util",
+    # Several items match.
+    "remove insurance",
+    "set insurance to 100",
+    # Nothing matches.
+    "delete rent",
+    "change rent to 1450",
+    # Not a simple command.
+    "add groceries and rent 100",
+    "what should I cut?",
+    "",
+])
+def test_ambiguous_commands_go_to_the_model(message):
+    assert parse_command(message, _state()) is None
+
+
+def test_apply_command_edits_and_records_the_turn():
+    state = _state()
+    reply = apply_command("delete gym", state)
+    assert reply.startswith("Removed Gym ($40.00) from your budget. Your surplus is now $1,655.00.")
+    assert [item["id"] for item in state["Budget"]["items"]] == ["a", "c", "d", "e"]
+    assert state["Budget"]["conversations"][-1] == {"user_message": "delete gym", "ai_response": reply}
+
+
+def test_apply_command_leaves_the_budget_alone_on_fallthrough():
+    state = _state()
+    assert apply_command("delete it", state) is None
+    assert state == STATE
+
+
+def test_apply_command_sets_limit():
+    state = _state()
+    reply = apply_command("set my budget to 300", state)
+    assert state["Budget"]["budget_limit"] == 300.0
+    assert "over budget by $85.00" in reply
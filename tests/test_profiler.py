@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+import profiler
+import settings
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    directory = tmp_path / "profiles"
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(directory))
+    monkeypatch.setattr(settings, "PROFILE_TOKEN", "s3cret")
+    monkeypatch.setattr(settings, "PROFILE_INTERVAL_MS", 1)
+    return directory
+
+
+def _get(headers):
+    import chat_api
+
+    async def request():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/healthz", headers=headers)
+
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize("header", ["1", "wrong", ""])
+def test_profiling_needs_the_operator_token(profiling, header):
+    response = _get({"X-Profile": header})
+    assert response.status_code == 200
+    assert "X-Profile-File" not in response.headers
+    assert not profiling.exists()
+
+
+def test_profiled_request_writes_collapsed_stacks(profiling):
+    response = _get({"X-Profile": "s3cret", "X-Request-ID": "req/../1"})
+    name = response.headers["X-Profile-File"]
+    assert name.endswith("-req1.collapsed")
+    assert os.listdir(profiling) == [name]
+
+
+def test_profiling_off_without_token(profiling, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_TOKEN", None)
+    assert profiler.start_profile("r1", "s3cret") == (None, None)
+
+
+def test_one_profile_at_a_time(profiling):
+    first, path = profiler.start_profile("r1", "s3cret")
+    try:
+        assert first is not None
+        assert profiler.start_profile("r2", "s3cret") == (None, None)
+    finally:
+        profiler.finish_profile(first, path)
+    second, path = profiler.start_profile("r3", "s3cret")
+    assert second is not None
+    profiler.finish_profile(second, path)
+    assert len(os.listdir(profiling)) == 2
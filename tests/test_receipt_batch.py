@@ -0,0 +1,100 @@
+import asyncio
+import io
+import json
+import uuid
+
+import pytest
+
+import chat_api
+import workers
+from session_store import SessionStore
+
+
+def _receipt(merchant: str, total: str) -> str:
+    return f"{merchant}\nMilk 2%          {total}\nTOTAL            {total}\n"
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    """
+    OCR without Tesseract or the process pool: each upload's bytes name its result and
+    how long its OCR takes. Parsing with the model always fails.
+    """
+    results = {}
+
+    def ocr_receipt_bytes(data):
+        _, text = results[data]
+        if isinstance(text, Exception):
+            raise text
+        return text, None
+
+    async def timed_ocr(data):
+        await asyncio.sleep(results[data][0])
+        return ocr_receipt_bytes(data)
+
+    async def ai_filter_receipt_texts_async(texts):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(workers, "run_in_process", lambda func, data: timed_ocr(data))
+    monkeypatch.setattr(chat_api, "ocr_receipt_bytes", ocr_receipt_bytes)
+    monkeypatch.setattr(chat_api, "ai_filter_receipt_texts_async", ai_filter_receipt_texts_async)
+
+    def run(files):
+        uploads = []
+        for name, delay, text in files:
+            # Unique bytes, so nothing comes from the receipt cache.
+            data = f"{name}-{uuid.uuid4()}".encode()
+            results[data] = (delay, text)
+            uploads.append((name, io.BytesIO(data)))
+        session = SessionStore().create("u1", None, {"Budget": {"budget_limit": 100, "items": []}})
+
+        async def collect():
+            return [json.loads(line) async for line in chat_api.receipt_batch_events(session, uploads)]
+
+        return asyncio.run(collect())
+
+    return run
+
+
+def test_events_follow_ocr_completion_and_items_follow_upload_order(batch):
+    events = batch([
+        ("slow.png", 0.05, _receipt("SLOW MART", "3.00")),
+        ("broken.png", 0.0, ValueError("cannot identify image file")),
+        ("fast.png", 0.01, _receipt("FAST SHOP", "2.00")),
+    ])
+    assert [(event["event"], event.get("filename")) for event in events] == [
+        ("received", None),
+        ("error", "broken.png"),
+        ("ocr", "fast.png"), ("parsed", "fast.png"),
+        ("ocr", "slow.png"), ("parsed", "slow.png"),
+        ("done", None),
+    ]
+    assert events[0]["count"] == 3
+    assert events[1] == {"event": "error", "stage": "ocr", "index": 1, "filename": "broken.png",
+                         "detail": "cannot identify image file"}
+    assert events[3]["receipt"]["merchant"] == "FAST SHOP"
+    state = events[-1]["state"]
+    assert [item["item_name"] for item in state["Budget"]["items"]] == ["SLOW MART", "FAST SHOP"]
+    assert state["Budget"]["budget_surplus"] == 95
+
+
+def test_parse_failure_is_reported_per_file(batch):
+    events = batch([
+        ("clear.png", 0.0, _receipt("CLEAR CO", "5.00")),
+        ("blurry.png", 0.01, "s0m3 n01se"),
+    ])
+    assert [(event["event"], event.get("filename")) for event in events] == [
+        ("received", None),
+        ("ocr", "clear.png"), ("parsed", "clear.png"),
+        ("ocr", "blurry.png"),
+        ("error", "blurry.png"),
+        ("done", None),
+    ]
+    assert events[4]["stage"] == "parse" and events[4]["detail"] == "model unavailable"
+    assert [item["item_name"] for item in events[-1]["state"]["Budget"]["items"]] == ["CLEAR CO"]
+
+
+def test_nothing_processed(batch):
+    events = batch([("broken.png", 0.0, ValueError("truncated"))])
+    assert [event["event"] for event in events] == ["received", "error", "done"]
+    assert events[-1]["error"] == "No receipts could be processed"
@@ -0,0 +1,111 @@
+import os
+from datetime import date
+
+import pytest
+
+import receipt_parser
+from receipt_parser import is_confident, parse_date, parse_receipt, to_budget_items
+
+SAMPLE_REFERENCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reciept_test_1.txt")
+
+GROCERY = """\
+FRESH MARKET
+123 Main St
+03/05/2024 10:12
+Milk 2%          3.99
+Bread            2.50 A
+Eggs
+2 @ 1.25         2.50
+Bananas 1.10 lb @ 0.59 /lb 0.65
+Coupon          -1.00
+SUBTOTAL         8.64
+TAX              0.43
+TOTAL            9.07
+VISA            9.07
+CHANGE           0.00
+"""
+
+
+def test_grocery_receipt_adds_up():
+    receipt = parse_receipt(GROCERY)
+    assert receipt["merchant"] == "FRESH MARKET"
+    assert [item["name"] for item in receipt["items"]] == ["Milk 2%", "Bread", "Eggs", "Bananas", "Coupon"]
+    assert receipt["subtotal"] == 8.64
+    assert receipt["tax"] == 0.43
+    assert receipt["total"] == 9.07
+    assert receipt["date"] == "2024-03-05"
+    assert receipt["confidence"] == 0.95
+    assert receipt["source"] == "local"
+    assert {item["category"] for item in receipt["items"]} == {"Groceries"}
+
+
+def test_quantities_and_discounts():
+    items = {item["name"]: item for item in parse_receipt(GROCERY)["items"]}
+    # "2 @ 1.25" on its own line belongs to the name on the line above.
+    assert items["Eggs"]["quantity"] == 2
+    assert items["Bananas"]["quantity"] == 1.1
+    assert items["Coupon"]["price"] == -1.0
+
+
+def test_payment_lines_after_total_are_not_items():
+    receipt = parse_receipt(GROCERY)
+    assert not any(item["name"] in ("VISA", "CHANGE") for item in receipt["items"])
+
+
+def test_sample_receipt_reference_text():
+    with open(SAMPLE_REFERENCE, encoding="utf-8") as reference:
+        receipt = parse_receipt(reference.read())
+    assert receipt["items"] == [
+        {"name": "Pain Killer", "price": 2.99, "quantity": 1, "category": "Health"},
+        {"name": "Corona Medication", "price": 199.98, "quantity": 2, "category": "Health"},
+    ]
+    assert receipt["total"] == 202.97
+    assert receipt["date"] == "2020-07-22"
+    assert is_confident(receipt, 0.9)
+
+
+def test_items_that_do_not_add_up_are_not_confident():
+    receipt = parse_receipt("SHOP\nWidget 5.00\nGadget 3.00\nTOTAL 20.00\n")
+    assert receipt["confidence"] < 0.5
+    assert not is_confident(receipt, 0.9)
+
+
+def test_no_total_means_no_confidence():
+    receipt = parse_receipt("SHOP\nWidget 5.00\n")
+    assert receipt["total"] is None
+    assert receipt["confidence"] == 0.0
+    assert not is_confident(None, 0.0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Date: 2024-03-05", date(2024, 3, 5)),
+    ("03/05/2024", date(2024, 3, 5)),
+    ("25/12/23", date(2023, 12, 25)),
+    ("Mar 5, 2024", date(2024, 3, 5)),
+    ("5 March 2024", date(2024, 3, 5)),
+    ("13/13/2024", None),
+    ("no date here", None),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize("line, amount", [
+    ("Item $1,234.56", 1234.56),
+    ("Item 3,99", 3.99),
+    ("Refund -2.00", -2.0),
+    ("Refund 2.00-", -2.0),
+    ("Item 3.99 TX", 3.99),
+    ("Item $2.99 SALE", 2.99),
+])
+def test_line_price(line, amount):
+    assert receipt_parser._line_price(line) == ("Item" if line.startswith("Item") else "Refund", amount)
+
+
+def test_to_budget_items_is_one_item_per_receipt():
+    receipt = parse_receipt(GROCERY)
+    [item] = to_budget_items(receipt)
+    assert item["item_name"] == "FRESH MARKET (2024-03-05)"
+    assert item["amount"] == 9.07
+    assert item["category"] == "Groceries"
+    assert item["due_date"] == 1709596800
@@ -0,0 +1,153 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+
+import pytest
+
+from budget_analytics import analyse
+from recurrence import ScheduleIndex, add_months, monthly_factor, occurrences, parse_schedule
+
+TODAY = date(2024, 1, 20)
+
+
+def _due(day: date) -> int:
+    return calendar.timegm(day.timetuple())
+
+
+ITEMS = [
+    {"id": "rent", "item_name": "Rent", "amount": 1200, "category": "Housing",
+     "recurrence_schedule": "monthly", "due_date": _due(date(2023, 11, 1))},
+    {"id": "gym", "item_name": "Gym", "amount": 40, "category": "Health",
+     "recurrence_schedule": "every 2 weeks", "due_date": _due(date(2024, 1, 3))},
+    {"id": "car", "item_name": "Insurance", "amount": 300, "category": "Transport",
+     "recurrence_schedule": "quarterly", "due_date": _due(date(2024, 1, 31))},
+    {"id": "pay", "item_name": "Card", "amount": 25, "category": "Housing",
+     "recurrence_schedule": "0 0 1,15 * *"},
+    {"id": "mon", "item_name": "Lunch", "amount": 12, "category": "Food",
+     "recurrence_schedule": "0 12 * * 1", "due_date": _due(date(2024, 2, 1))},
+    {"id": "once", "item_name": "Concert", "amount": 90, "category": "Fun", "due_date": _due(date(2024, 3, 9))},
+    {"id": "past", "item_name": "Old bill", "amount": 10, "category": "Fun", "due_date": _due(date(2023, 3, 9))},
+    {"id": "none", "item_name": "Coffee", "amount": 5, "category": "Food"},
+]
+
+
+@pytest.mark.parametrize("text, unit, step", [
+    ("weekly", "days", 7),
+    ("Bi-Weekly", "days", 14),
+    ("every 3 weeks", "days", 21),
+    ("every other month", "months", 2),
+    ("Quarterly", "months", 3),
+    ("semiannually", "months", 6),
+    ("each year", "months", 12),
+    ("semi-monthly", "cron", 1),
+    ("0 9 1,15 * *", "cron", 1),
+])
+def test_parse_schedule(text, unit, step):
+    schedule = parse_schedule(text)
+    assert (schedule.unit, schedule.step) == (unit, step)
+
+
+@pytest.mark.parametrize("text", [None, "", "sometimes", "every 0 days", "0 9 * *", "0 9 40 * *"])
+def test_unknown_schedules(text):
+    assert parse_schedule(text) is None
+
+
+def test_cron_fields():
+    schedule = parse_schedule("0 0 * 2 1-5")
+    assert schedule.matches(date(2024, 2, 5))        # Monday in February
+    assert not schedule.matches(date(2024, 2, 4))    # Sunday
+    assert not schedule.matches(date(2024, 3, 4))    # Monday, wrong month
+    either = parse_schedule("0 0 13 * 5")
+    assert either.matches(date(2024, 9, 13)) and either.matches(date(2024, 9, 6))
+
+
+def test_add_months_clamps_day():
+    assert add_months(date(2024, 1, 31), 1) == date(2024, 2, 29)
+    assert add_months(date(2024, 1, 31), 2) == date(2024, 3, 31)
+    assert add_months(date(2024, 11, 30), 3, 31) == date(2025, 2, 28)
+
+
+def test_occurrences():
+    monthly = list(occurrences(parse_schedule("monthly"), date(2024, 1, 31), date(2024, 1, 1), date(2024, 5, 1)))
+    assert monthly == [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)]
+    weekly = list(occurrences(parse_schedule("weekly"), date(2024, 1, 3), date(2024, 1, 10), date(2024, 1, 25)))
+    assert weekly == [date(2024, 1, 10), date(2024, 1, 17), date(2024, 1, 24)]
+    assert list(occurrences(None, date(2024, 1, 3), date(2024, 1, 1), date(2024, 2, 1))) == [date(2024, 1, 3)]
+    assert list(occurrences(None, None, date(2024, 1, 1), date(2024, 2, 1))) == []
+
+
+def _brute_force_projection(items, start, months):
+    index = ScheduleIndex(items, start)
+    end = add_months(start.replace(day=1), months)
+    totals = defaultdict(lambda: defaultdict(float))
+    for event in index.timeline(start, end):
+        totals[event["date"][:7]][event["category"]] += event["amount"]
+    return totals
+
+
+def test_projection_matches_timeline():
+    months = 14
+    projection = ScheduleIndex(ITEMS, TODAY).projection(TODAY, months)
+    expected = _brute_force_projection(ITEMS, TODAY, months)
+    assert len(projection["months"]) == months
+    for month in projection["months"]:
+        by_category = {category: round(amount, 2) for category, amount in expected[month["month"]].items()}
+        assert month["by_category"] == by_category
+        assert month["total"] == pytest.approx(sum(by_category.values()))
+    assert projection["total"] == pytest.approx(sum(month["total"] for month in projection["months"]))
+
+
+def test_projection_first_month_starts_today():
+    projection = ScheduleIndex(ITEMS, TODAY).projection(TODAY, 1)
+    january = projection["months"][0]
+    # Rent (the 1st) and the 1st/15th card payment are already past on the 20th.
+    assert "Housing" not in january["by_category"]
+    assert january["by_category"]["Transport"] == 300
+    assert january["by_category"]["Health"] == 40   # the 31st; the 3rd and 17th are before today
+
+
+def test_upcoming_is_sorted_and_bounded():
+    index = ScheduleIndex(ITEMS, TODAY)
+    upcoming = index.upcoming(days=30)
+    dates = [event["date"] for event in upcoming]
+    assert dates == sorted(dates)
+    assert all("2024-01-20" <= day < "2024-02-19" for day in dates)
+    assert [event["id"] for event in upcoming[:2]] == ["gym", "car"]
+    assert {"past", "none", "once"}.isdisjoint(event["id"] for event in upcoming)
+    assert len(index.upcoming(days=30, limit=2)) == 2
+
+
+def test_empty_budget():
+    index = ScheduleIndex([], TODAY)
+    assert index.upcoming() == []
+    assert index.projection(TODAY, 3)["total"] == 0
+
+
+@pytest.mark.parametrize("text, factor", [
+    ("monthly", 1.0),
+    ("bimonthly", 0.5),
+    ("quarterly", 1 / 3),
+    ("semiannually", 1 / 6),
+    ("yearly", 1 / 12),
+    ("weekly", 146097 / 4800 / 7),
+    ("every 2 weeks", 146097 / 4800 / 14),
+    ("semi-monthly", 2.0),
+    ("0 0 1,15 * *", 2.0),
+    (None, 0.0),
+    ("sometimes", 0.0),
+])
+def test_monthly_factor(text, factor):
+    assert monthly_factor(text) == pytest.approx(factor)
+
+
+def test_weekday_cron_factor():
+    # Every Monday: 52.1775 weeks a year.
+    assert monthly_factor("0 9 * * 1") == pytest.approx(146097 / 4800 / 7, rel=1e-3)
+
+
+def test_monthly_totals_agree_with_long_projection():
+    items = [dict(item, due_date=None) for item in ITEMS if item.get("recurrence_schedule")]
+    months = 12 * 40
+    projection = ScheduleIndex(items, TODAY).projection(TODAY, months)
+    monthly = analyse({"Budget": {"items": items}})["monthly_recurring"]
+    assert projection["total"] / months == pytest.approx(monthly, rel=0.005)
@@ -0,0 +1,106 @@
+import pytest
+
+from response_cache import ResponseCache, budget_hash, cacheable_question, local_answer, normalise_message
+
+STATE = {"Budget": {"budget_limit": 2000, "items": [
+    {"id": "a", "item_name": "Rent", "amount": 1200, "category": "Housing"},
+    {"id": "b", "item_name": "Groceries", "amount": 400, "category": "Food"},
+    {"id": "c", "item_name": "Dining out", "amount": 150, "category": "Food"},
+]}}
+
+
+def test_normalise_message():
+    assert normalise_message("Hey, what's my  SURPLUS please?") == "what is surplus"
+    assert normalise_message("Is $12.50 ok?") == "is $12.50 ok"
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("What's my surplus?", "Your budget surplus is $250.00"),
+    ("How much do I have left?", "Your budget surplus is $250.00"),
+    ("Total spending", "Your expenses total $1,750.00 across 3 items"),
+    ("Show me my budget", "Here is your budget:\nRent: $1,200.00 (Housing)"),
+    ("Spending by category", "Here is your spending by category:\nHousing: $1,200.00 (69%)\nFood: $550.00 (31%)"),
+    ("What is my budget limit?", "Your budget limit is $2,000.00"),
+])
+def test_local_answers(message, expected):
+    assert local_answer(message, STATE).startswith(expected)
+
+
+@pytest.mark.parametrize("message", [
+    "How much should I spend on groceries?",
+    "Should I limit my dining out?",
+    "Will I go over budget if I buy a car?",
+    "What is the remaining balance for emergencies?",
+    "Show me how to budget for items like a car",
+    "Add coffee for $5",
+    "Remove rent",
+    "",
+])
+def test_advice_and_edits_go_to_the_model(message):
+    assert local_answer(message, STATE) is None
+
+
+def test_over_budget_answer():
+    state = {"Budget": {"budget_limit": 1000, "items": STATE["Budget"]["items"]}}
+    assert local_answer("surplus", state).startswith("You are over budget by $750.00")
+
+
+def test_answers_without_limit_or_items():
+    assert local_answer("budget limit", {"Budget": {"items": []}}).startswith("You have not set a budget limit yet")
+    assert local_answer("show my budget", {"Budget": {"items": []}}).startswith("Your budget has no items yet")
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Where could I cut back on subscriptions?", False),
+    ("Which bills are due first?", True),
+    ("Can I afford a holiday?", True),
+    ("why?", False),
+    ("and the next one?", False),
+    ("explain that", False),
+    ("Tell me a joke", False),
+    ("Set my budget to 3000", False),
+])
+def test_cacheable_question(message, expected):
+    assert cacheable_question(message) is expected
+
+
+def test_budget_hash_ignores_conversation():
+    with_history = dict(STATE, history=[{"role": "user", "parts": ["hi"]}])
+    assert budget_hash(with_history) == budget_hash(STATE)
+    changed = {"Budget": dict(STATE["Budget"], budget_limit=2500)}
+    assert budget_hash(changed) != budget_hash(STATE)
+
+
+def test_cache_round_trip_and_invalidation():
+    cache = ResponseCache(max_sessions=2, max_entries=2, local_answers=False)
+    question = "Which bills are due first?"
+    assert cache.lookup("s1", STATE, question) is None
+    cache.store("s1", STATE, question, "Rent, then groceries.")
+    assert cache.lookup("s1", STATE, "which bills are due first") == "Rent, then groceries."
+    # Another session, or the same session after an edit, does not see it.
+    assert cache.lookup("s2", STATE, question) is None
+    edited = {"Budget": dict(STATE["Budget"], budget_limit=2500)}
+    assert cache.lookup("s1", edited, question) is None
+
+
+def test_contextual_replies_are_not_stored():
+    cache = ResponseCache(max_sessions=2, max_entries=2, local_answers=False)
+    cache.store("s1", STATE, "why?", "Because rent is due first.")
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("s1", STATE, "why?") is None
+
+
+def test_cache_evicts_least_recent():
+    cache = ResponseCache(max_sessions=1, max_entries=1, local_answers=False)
+    cache.store("s1", STATE, "Which bills are due first?", "Rent.")
+    cache.store("s1", STATE, "Can I afford a holiday?", "Not this month.")
+    assert cache.lookup("s1", STATE, "Which bills are due first?") is None
+    cache.store("s2", STATE, "Can I afford a holiday?", "Not this month.")
+    assert cache.stats() == {"sessions": 1, "entries": 1}
+
+
+def test_similar_messages_match_with_similarity():
+    cache = ResponseCache(max_sessions=1, max_entries=8, similarity=0.8, local_answers=False)
+    cache.store("s1", STATE, "Can I afford a holiday in summer?", "Not this month.")
+    assert cache.lookup("s1", STATE, "Can I afford holidays in summer?") == "Not this month."
+    assert cache.lookup("s1", STATE, "Which bills are due first?") is None
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+from response_stream import AiResponseExtractor
+
+REPLY = json.dumps({
+    "conversation": {"user_message": "hi", "ai_response": 'Say "hi" \\ to café \U0001F600\nbye'},
+    "Budget": {"operations": [{"op": "add", "item": {"item_name": "Coffee", "amount": 4.5}}]},
+})
+
+
+def _feed(chunks):
+    extractor = AiResponseExtractor()
+    deltas = [extractor.feed(chunk) for chunk in chunks]
+    return extractor, deltas
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(REPLY)])
+def test_chunk_boundaries(size):
+    extractor, deltas = _feed([REPLY[i:i + size] for i in range(0, len(REPLY), size)])
+    assert "".join(deltas) == extractor.text == json.loads(REPLY)["conversation"]["ai_response"]
+    assert extractor.done
+
+
+@pytest.mark.parametrize("raw, text", [
+    ('"caf\\u00e9"', "café"),
+    ('"\\ud83d\\ude00!"', "\U0001F600!"),
+    ('"\\uD83D\\uDE00"', "\U0001F600"),
+    ('"tab\\tquote\\"slash\\/"', 'tab\tquote"slash/'),
+])
+def test_escapes_split_anywhere(raw, text):
+    reply = '{"ai_response": ' + raw + "}"
+    for cut in range(len(reply)):
+        extractor, deltas = _feed([reply[:cut], reply[cut:]])
+        assert "".join(deltas) == text, cut
+        assert extractor.done
+
+
+def test_escape_is_not_emitted_half_decoded():
+    extractor = AiResponseExtractor()
+    assert extractor.feed('{"ai_response": "a\\ud83d') == "a"
+    assert extractor.feed("\\ude") == ""
+    assert extractor.feed('00"') == "\U0001F600"
+
+
+def test_key_split_across_chunks_and_text_after_the_value():
+    extractor, deltas = _feed(['{"Budget": {}, "ai_res', 'ponse"', ' : "ok', '"}', '"ai_response": "again"'])
+    assert deltas == ["", "", "ok", "", ""]
+    assert extractor.done
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_chat_stream_sends_deltas_then_the_applied_state(monkeypatch):
+    import httpx
+    import chat_api
+    from session_store import SessionStore
+
+    monkeypatch.setattr(chat_api, "session_store", SessionStore())
+
+    async def stream_chat_message(chat_session, prompt, **kwargs):
+        for i in range(0, len(REPLY), 9):
+            yield REPLY[i:i + 9]
+
+    monkeypatch.setattr(chat_api, "stream_chat_message", stream_chat_message)
+    state = {"Budget": {"budget_limit": 100, "items": [{"id": "a", "item_name": "Gym", "amount": 40}],
+                        "conversations": []},
+             "conversation": "what else should I track?"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.post("/chat/stream", json=state)
+            session = _events(first.text)[-1][1]
+            second = await client.post("/chat/stream", json={
+                "session_id": session["session_id"], "revision": session["revision"],
+                "conversation": "anything else?"})
+            return _events(first.text), _events(second.text)
+
+    first, second = asyncio.run(scenario())
+    assert {event for event, _ in first[:-1]} == {"delta"}
+    assert "".join(data["text"] for _, data in first[:-1]) == json.loads(REPLY)["conversation"]["ai_response"]
+    event, done = first[-1]
+    assert event == "done" and done["revision"] == 1
+    # The model's operations are applied and the surplus recomputed.
+    assert [item["item_name"] for item in done["Budget"]["items"]] == ["Gym", "Coffee"]
+    assert done["Budget"]["budget_surplus"] == 55.5
+
+    # A client at the current revision gets only the changes.
+    event, done = second[-1]
+    assert event == "done" and done["revision"] == 2
+    [operation] = done["delta"]["operations"]
+    assert operation["op"] == "add" and operation["item"]["item_name"] == "Coffee"
+    assert done["delta"]["budget_surplus"] == 51.0
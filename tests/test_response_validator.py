@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+import response_validator
+import settings
+from response_stream import AiResponseExtractor
+from response_validator import parse_chat_reply, parse_json_reply, validate_chat_reply
+
+REPLY = {"conversation": {"user_message": "hi", "ai_response": "Hello!"}, "Budget": {"budget_limit": 2000}}
+
+
+@pytest.mark.parametrize("text, repair", [
+    (json.dumps(REPLY), None),
+    ("```json\n" + json.dumps(REPLY) + "\n```", "code_fence"),
+    ("Sure, here it is: " + json.dumps(REPLY) + " Let me know!", "surrounding_text"),
+    ('{"conversation": {"ai_response": "Hello!"}, "Budget": {"budget_limit": 2000,},}', "trailing_comma"),
+])
+def test_local_repairs(text, repair):
+    value, applied = parse_json_reply(text)
+    assert applied == repair
+    assert value["Budget"]["budget_limit"] == 2000
+
+
+def test_unrepairable_text():
+    assert parse_json_reply("no json here") == (None, None)
+    reply, repairs, error = validate_chat_reply("no json here")
+    assert reply is None and error == "reply is not valid JSON"
+
+
+def test_conversation_string_and_dropped_operations():
+    text = json.dumps({"conversation": "Done.", "Budget": {"operations": [
+        {"op": "remove", "id": "a"}, {"op": "rename", "id": "b"}, "garbage"]}})
+    reply, repairs, error = validate_chat_reply(text)
+    assert error is None
+    assert repairs == ["conversation_string", "dropped_operations"]
+    assert reply["conversation"]["ai_response"] == "Done."
+    assert [operation["op"] for operation in reply["Budget"]["operations"]] == ["remove"]
+
+
+def test_full_items_list_keeps_ids():
+    text = json.dumps({"Budget": {"items": [
+        {"id": "a", "item_name": "Rent", "amount": "1,450"},
+        {"id": 7, "item_name": "Gym", "amount": 40},
+        {"item_name": "Coffee", "amount": 4.5},
+    ]}})
+    reply, _, error = validate_chat_reply(text)
+    assert error is None
+    assert [item.get("id") for item in reply["Budget"]["items"]] == ["a", "7", None]
+    assert reply["Budget"]["items"][0]["amount"] == 1450
+
+
+def test_invalid_reply_reports_the_field():
+    reply, _, error = validate_chat_reply(json.dumps({"Budget": {"budget_limit": "lots"}}))
+    assert reply is None and error.startswith("Budget.budget_limit")
+
+
+@pytest.fixture
+def model_replies(monkeypatch):
+    replies, prompts = [], []
+
+    async def generate_text(model, prompt):
+        prompts.append(prompt)
+        return replies.pop(0)
+
+    monkeypatch.setattr(response_validator, "generate_text", generate_text)
+    monkeypatch.setattr(settings, "RESPONSE_REPAIR_RETRIES", 2)
+    return replies, prompts
+
+
+def test_retry_asks_the_model_to_fix_its_reply(model_replies):
+    replies, prompts = model_replies
+    replies.append(json.dumps(REPLY))
+    assert asyncio.run(parse_chat_reply('{"Budget": {"budget_limit": "lots"}}')) == REPLY
+    [prompt] = prompts
+    assert "Problem: Budget.budget_limit" in prompt and '"lots"' in prompt
+
+
+def test_retries_give_up(model_replies):
+    replies, prompts = model_replies
+    replies.extend(["still not json", "nor this"])
+    assert asyncio.run(parse_chat_reply("not json")) is None
+    assert len(prompts) == 2
+
+
+def test_valid_reply_needs_no_model_call(model_replies):
+    _, prompts = model_replies
+    assert asyncio.run(parse_chat_reply("```\n" + json.dumps(REPLY) + "\n```")) == REPLY
+    assert prompts == []
+
+
+@pytest.mark.parametrize("raw, text", [
+    ('"a\\uZZZZ b"', "a\\uZZZZ b"),
+    ('"a\\uD83D b"', "a\\uD83D b"),
+    ('"a\\uDE00"', "a\\uDE00"),
+    ('"a\\uD83D\\uZZZZ"', "a\\uD83D\\uZZZZ"),
+    ('"\\u12"', "\\u12"),
+])
+def test_stream_shows_malformed_escapes_as_written(raw, text):
+    extractor = AiResponseExtractor()
+    assert extractor.feed('{"ai_response": ' + raw + "}") == text
+    assert extractor.done
@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pytest
+
+import scheduler
+import settings
+from scheduler import ModelOverloaded, ModelScheduler, TokenBucket, is_rate_limited
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+def _scheduler(**overrides) -> ModelScheduler:
+    options = dict(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1, queue_size=10, burst_seconds=1)
+    options.update(overrides)
+    return ModelScheduler(**options)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    now = bucket.updated
+    assert bucket.wait_time(4, now) == 0
+    bucket.take(4, now)
+    assert bucket.wait_time(1, now) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.0)
+    # More than the capacity waits only for a full bucket.
+    assert bucket.wait_time(100, now + 0.5) == pytest.approx(1.5)
+
+
+def test_token_bucket_pause_and_unlimited():
+    bucket = TokenBucket(rate=0, capacity=0)
+    now = time.monotonic()
+    bucket.take(1000, now)
+    assert bucket.wait_time(1000, now) == 0
+    bucket.pause(2.0, now)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(1.5)
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(RateLimited())
+    assert not is_rate_limited(ValueError())
+
+
+def test_model_overloaded_is_a_429_with_retry_after():
+    error = ModelOverloaded(2.2, "queue full")
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "3"}
+
+
+def test_chat_runs_before_queued_receipts():
+    async def scenario():
+        model = _scheduler()
+        await model.acquire("chat", 1, time.monotonic() + 5)
+        order = []
+
+        async def call(role):
+            await model.acquire(role, 1, time.monotonic() + 5)
+            order.append(role)
+            model.release()
+
+        tasks = [asyncio.create_task(call("receipt")), asyncio.create_task(call("chat"))]
+        await asyncio.sleep(0)
+        model.release()
+        await asyncio.gather(*tasks)
+        return order, model.running
+
+    assert asyncio.run(scenario()) == (["chat", "receipt"], 0)
+
+
+def test_full_queue_is_shed():
+    async def scenario():
+        model = _scheduler(queue_size=1)
+        await model.acquire("chat", 1, time.monotonic() + 5)
+        waiting = asyncio.create_task(model.acquire("chat", 1, time.monotonic() + 5))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(ModelOverloaded, match="queue full"):
+                await model.acquire("chat", 1, time.monotonic() + 5)
+        finally:
+            model.release()
+            await waiting
+            model.release()
+        return model.shed
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_call_over_quota_is_shed_at_once():
+    async def scenario():
+        model = _scheduler(requests_per_minute=60, max_concurrency=5)
+        await model.acquire("chat", 1, time.monotonic() + 5)
+        started = time.monotonic()
+        with pytest.raises(ModelOverloaded, match="over quota") as error:
+            await model.acquire("chat", 1, time.monotonic() + 0.1)
+        return time.monotonic() - started, error.value.retry_after
+
+    elapsed, retry_after = asyncio.run(scenario())
+    assert elapsed < 0.05
+    assert retry_after >= 1
+
+
+def test_waiting_past_deadline_is_shed():
+    async def scenario():
+        model = _scheduler()
+        await model.acquire("chat", 1, time.monotonic() + 5)
+        with pytest.raises(ModelOverloaded, match="queue timeout"):
+            await model.acquire("receipt", 1, time.monotonic() + 0.05)
+        return model._queued
+
+    assert asyncio.run(scenario()) == {1: 0}
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_RETRY_BASE_MS", 4)
+    monkeypatch.setattr(settings, "MODEL_RETRY_MAX_MS", 8)
+    monkeypatch.setattr(settings, "MODEL_RETRY_ATTEMPTS", 3)
+    ranges = []
+
+    def uniform(low, high):
+        ranges.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(scheduler.random, "uniform", uniform)
+    return ranges
+
+
+def test_rate_limits_are_retried_with_full_jitter(fast_retries):
+    failures = [RateLimited(), RateLimited()]
+
+    async def call():
+        if failures:
+            raise failures.pop()
+        return "reply"
+
+    async def scenario():
+        model = _scheduler()
+        return await model.run("chat", 1, call), model
+
+    result, model = asyncio.run(scenario())
+    assert result == "reply"
+    assert model.retries == 2 and model.running == 0
+    # Full jitter: anywhere from 0 up to the exponential backoff.
+    assert fast_retries == [(0, 0.004), (0, 0.008)]
+
+
+def test_rate_limits_give_up_after_the_attempts(fast_retries):
+    async def call():
+        raise RateLimited()
+
+    async def scenario():
+        model = _scheduler()
+        with pytest.raises(ModelOverloaded, match="rate limited"):
+            await model.run("chat", 1, call)
+        return model
+
+    model = asyncio.run(scenario())
+    assert model.retries == settings.MODEL_RETRY_ATTEMPTS
+    assert model.running == 0
+
+
+def test_other_errors_are_not_retried(fast_retries):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(_scheduler().run("chat", 1, call))
+    assert len(calls) == 1
+    assert fast_retries == []
@@ -0,0 +1,88 @@
+import asyncio
+import signal
+import threading
+
+import httpx
+import pytest
+
+import serve
+import settings
+
+
+def test_parse_bind():
+    assert serve.parse_bind("8080") == ("0.0.0.0", 8080)
+    assert serve.parse_bind("127.0.0.1:9000") == ("127.0.0.1", 9000)
+    assert serve.parse_bind("[::]:8080") == ("::", 8080)
+
+
+@pytest.fixture
+def drain(monkeypatch):
+    """
+    The drain handler installed over a fake server shutdown handler; returns the calls it got.
+    """
+    shutdowns = []
+    stopped = threading.Event()
+
+    def shutdown(signum, frame):
+        shutdowns.append(signum)
+        stopped.set()
+
+    previous = signal.signal(signal.SIGTERM, shutdown)
+    monkeypatch.setattr(settings, "DRAIN_SECONDS", 0.2)
+    serve.draining.clear()
+    serve.install_drain_handler()
+    yield shutdowns, stopped
+    signal.signal(signal.SIGTERM, previous)
+    serve.draining.clear()
+
+
+def _sigterm():
+    signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+
+def _readyz():
+    import chat_api
+    from model_registry import model_registry
+
+    model_registry.load()
+
+    async def request():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/readyz")
+
+    return asyncio.run(request())
+
+
+def test_readyz_fails_while_draining_then_the_server_stops(drain):
+    shutdowns, stopped = drain
+    ready = _readyz()
+    assert ready.status_code == 200 and ready.json()["draining"] is False
+
+    _sigterm()
+    # Still serving, but no longer ready, until the drain period is over.
+    draining = _readyz()
+    assert draining.status_code == 503
+    assert draining.json()["status"] == "unavailable" and draining.json()["draining"] is True
+    assert shutdowns == []
+    assert stopped.wait(2)
+    assert shutdowns == [signal.SIGTERM]
+
+
+def test_second_sigterm_stops_at_once(drain):
+    shutdowns, stopped = drain
+    _sigterm()
+    _sigterm()
+    assert shutdowns == [signal.SIGTERM]
+    # The drain timer does not call the server's handler again (uvicorn would force the exit).
+    stopped.clear()
+    assert not stopped.wait(0.4)
+    assert shutdowns == [signal.SIGTERM]
+
+
+def test_no_drain_period(drain, monkeypatch):
+    shutdowns, _ = drain
+    monkeypatch.setattr(settings, "DRAIN_SECONDS", 0)
+    _sigterm()
+    assert shutdowns == [signal.SIGTERM]
+    assert serve.draining.is_set()
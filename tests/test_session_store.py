@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+
+from session_store import DiskSessionBackend, SessionStore
+
+
+def _state(*names):
+    return {"Budget": {"items": [{"id": name, "item_name": name, "amount": 1} for name in names],
+                       "conversations": []}}
+
+
+def test_sessions_without_a_budget_do_not_replace_each_other():
+    store = SessionStore()
+    first = store.create("u1", None, _state("a"))
+    second = store.create("u1", None, _state("b"))
+    assert store.get(first.session_id, "u1") is first
+    assert store.get(second.session_id, "u1") is second
+
+
+def test_one_live_session_per_stored_budget():
+    store = SessionStore()
+    first = store.create("u1", "budget-1", _state("a"))
+    second = store.create("u1", "budget-1", _state("b"))
+    other_user = store.create("u2", "budget-1", _state("c"))
+    assert store.get(first.session_id, "u1") is None
+    assert store.get(second.session_id, "u1") is second
+    assert store.get(other_user.session_id, "u2") is other_user
+
+
+def test_sessions_belong_to_their_user():
+    store = SessionStore()
+    session = store.create("u1", None, _state("a"))
+    assert store.get(session.session_id, "u2") is None
+
+
+def test_lru_eviction_and_reload_from_disk(tmp_path):
+    store = SessionStore(max_entries=1, backend=DiskSessionBackend(str(tmp_path)))
+    first = store.create("u1", None, _state("a"))
+    store.create("u1", None, _state("b"))
+    assert len(store) == 1
+    reloaded = store.get(first.session_id, "u1")
+    assert reloaded is not first
+    assert reloaded.state == first.state
+
+
+def test_purge_expired_removes_memory_and_disk(tmp_path):
+    backend = DiskSessionBackend(str(tmp_path))
+    store = SessionStore(ttl_seconds=60, backend=backend)
+    live = store.create("u1", None, _state("a"))
+    stale = store.create("u1", None, _state("b"))
+    stale.last_used = time.time() - 120
+    # A session file another worker left behind, not in this process's memory.
+    orphan = SessionStore(backend=backend).create("u2", None, _state("c"))
+    old = time.time() - 120
+    os.utime(backend._path(orphan.session_id), (old, old))
+
+    assert store.purge_expired() == 2
+    assert len(store) == 1
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(backend._path(live.session_id))]
+
+
+def test_reset_keeps_summary_only_for_the_same_history():
+    store = SessionStore()
+    state = _state("a")
+    state["Budget"]["conversations"] = [{"user_message": "hi", "ai_response": "hello"}] * 3
+    session = store.create("u1", None, state)
+    session.summary, session.summarised_turns = "Greetings.", 2
+
+    continued = _state("a")
+    continued["Budget"]["conversations"] = state["Budget"]["conversations"] + [{"user_message": "x", "ai_response": "y"}]
+    session.reset(continued)
+    assert (session.summary, session.summarised_turns) == ("Greetings.", 2)
+
+    diverged = _state("a")
+    diverged["Budget"]["conversations"] = [{"user_message": "other", "ai_response": "turns"}] * 3
+    session.reset(diverged)
+    assert (session.summary, session.summarised_turns) == (None, 0)
+    assert session.chat is None and session.stored_items is None
+
+
+def test_full_state_upload_waits_for_the_running_turn(monkeypatch):
+    import chat_api
+
+    store = SessionStore()
+    monkeypatch.setattr(chat_api, "session_store", store)
+    session = store.create("u1", None, _state("a"))
+    original = session.state
+
+    async def scenario():
+        async with session.lock:
+            upload = asyncio.create_task(chat_api.resolve_session("u1", session.session_id, None, _state("b")))
+            await asyncio.sleep(0.01)
+            # The turn holding the lock still sees its own state.
+            assert session.state is original and not upload.done()
+        return await upload
+
+    assert asyncio.run(scenario()) is session
+    assert [item["id"] for item in session.state["Budget"]["items"]] == ["b"]
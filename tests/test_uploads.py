@@ -0,0 +1,131 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import chat_api
+import settings
+from chat_api import read_upload
+
+
+class Upload(UploadFile):
+    """
+    An UploadFile that records how it was read.
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data), filename="photo.png")
+        self.reads = []
+        self.closed = False
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads.append(size)
+        return await super().read(size)
+
+    async def close(self):
+        self.closed = True
+        await super().close()
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_BYTES", 4)
+
+
+def test_read_upload_in_chunks(small_chunks):
+    upload = Upload(b"0123456789")
+    buffer = asyncio.run(read_upload(upload, 10))
+    assert buffer.read() == b"0123456789"
+    assert upload.reads == [4, 4, 4, 4] and upload.closed
+
+
+def test_read_upload_stops_at_the_limit(small_chunks):
+    upload = Upload(b"x" * 100)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(read_upload(upload, 10))
+    assert error.value.status_code == 413
+    # Stopped at the chunk that crossed the limit, not after reading everything.
+    assert len(upload.reads) == 3 and upload.closed
+
+
+def test_empty_upload():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(read_upload(Upload(b""), 10))
+    assert error.value.status_code == 400
+
+
+def _post_receipt(data: bytes, path: str = "/receipt", field: str = "receipt"):
+    async def request():
+        transport = httpx.ASGITransport(app=chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, files={field: ("photo.png", data, "image/png")},
+                                     data={"current_state": '{"Budget": {"items": []}}'})
+
+    return asyncio.run(request())
+
+
+@pytest.fixture
+def no_receipt_turn(monkeypatch):
+    async def receipt_turn(*args):
+        raise AssertionError("oversized upload reached the handler")
+
+    monkeypatch.setattr(chat_api, "receipt_turn", receipt_turn)
+    monkeypatch.setattr(settings, "RECEIPT_MAX_BYTES", 1000)
+
+
+def test_oversized_content_length_is_rejected_before_the_body(no_receipt_turn):
+    response = _post_receipt(b"x" * (1024 * 1024 + 2000))
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Receipt upload too large"}
+
+
+def test_oversized_file_is_rejected_while_reading(no_receipt_turn):
+    # Small enough to pass the Content-Length check, which allows room for the form framing.
+    response = _post_receipt(b"x" * 2000)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Receipt upload larger than 1000 bytes"}
+
+
+def test_batch_limit_scales_with_the_file_count(no_receipt_turn, monkeypatch):
+    monkeypatch.setattr(settings, "RECEIPT_BATCH_MAX_FILES", 2)
+    oversized = b"x" * (1024 * 1024 + 1500)
+    assert _post_receipt(oversized).json() == {"detail": "Receipt upload too large"}
+    # Room for two receipts in the request, but each file is still held to the limit.
+    response = _post_receipt(oversized, path="/receipts/batch", field="receipts")
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Receipt upload larger than 1000 bytes"}
+
+
+def test_receipt_is_decoded_from_memory(monkeypatch):
+    import tempfile
+
+    import numpy as np
+    from PIL import Image
+
+    import receipt_reader
+
+    def no_temp_file(*args, **kwargs):
+        raise AssertionError("upload written to a temporary file")
+
+    for name in ("TemporaryFile", "NamedTemporaryFile", "mkstemp"):
+        monkeypatch.setattr(tempfile, name, no_temp_file)
+    seen = []
+
+    def ocr_image(image):
+        seen.append(image.size)
+        return "FRESH MARKET\nMilk 2%          3.99\nBread            2.50\nTOTAL            6.49\n"
+
+    monkeypatch.setattr(receipt_reader, "ocr_image", ocr_image)
+    # Noise does not compress: a PNG larger than the 1MB Starlette spools to disk by default.
+    pixels = np.random.default_rng(0).integers(0, 256, (700, 1000, 3), dtype=np.uint8)
+    png = io.BytesIO()
+    Image.fromarray(pixels).save(png, format="PNG")
+    assert png.tell() > 1024 * 1024
+
+    response = _post_receipt(png.getvalue())
+    assert response.status_code == 200, response.text
+    assert seen and seen[0][1] == 700
+    [item] = response.json()["Budget"]["items"]
+    assert (item["item_name"], item["amount"]) == ("FRESH MARKET", 6.49)
@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional
+
+import settings
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_receipt_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    The bounded pool that CPU-bound work (PIL, Tesseract) runs on, so it never blocks the event loop.
+    Tesseract runs as a subprocess, so threads give real parallelism here.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.OCR_WORKERS, thread_name_prefix="budgit-ocr")
+    return _executor
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for batch OCR. Workers are spawned (not forked) so they don't inherit
+    the server's threads and gRPC state.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.OCR_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def receipt_slots() -> asyncio.Semaphore:
+    """
+    Limits how many receipts are in the pipeline at once, which bounds memory use under bursts.
+    """
+    global _receipt_semaphore
+    if _receipt_semaphore is None:
+        _receipt_semaphore = asyncio.Semaphore(settings.RECEIPT_MAX_CONCURRENCY)
+    return _receipt_semaphore
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Run a blocking function on the OCR pool and await its result. It runs in a copy of the
+    caller's context, so its log records and stage timings belong to the caller's request.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_in_process(func, *args):
+    """
+    Run a picklable top-level function on the process pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+def shutdown():
+    global _executor, _process_pool, _receipt_semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    _receipt_semaphore = None